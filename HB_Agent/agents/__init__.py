@@ -1,8 +1,12 @@
-from .agent_builder import AgentBuilder
+from .agent_builder import AgentBuilder, LazyAgentBuilder
 from .ollama_agent import OllamaAgent
 from .openai_agent import OpenAIAgent
+from .response_cache import ResponseCache, response_cache
 
 __all__ = ["AgentBuilder",
+           "LazyAgentBuilder",
            "OllamaAgent",
-           "OpenAIAgent"
+           "OpenAIAgent",
+           "ResponseCache",
+           "response_cache"
            ]
\ No newline at end of file
@@ -1,3 +1,6 @@
+import asyncio
+import threading
+import time
 from core import ConversationHandler, PromptManager
 
 class AgentBuilder:
@@ -11,3 +14,55 @@ class AgentBuilder:
     def run(self,prompt):
         response=self.conversation_handler.run_conversation(prompt)
         return response
+
+    async def arun(self, prompt):
+        return await self.conversation_handler.arun_conversation(prompt)
+
+
+class LazyAgentBuilder:
+    """AgentBuilder that is only built on first use. Takes the AgentBuilder arguments, with agent_factory
+    instead of agent so the LLM client is also created on first use. Messages restored before the build
+    are kept and handed to the conversation handler when it is created."""
+    def __init__(self, agent_factory, **builder_kwargs):
+        self.agent_factory = agent_factory
+        self.builder_kwargs = builder_kwargs
+        self._builder = None
+        self._messages = [] # messages while the expert is not built yet
+        self._lock = threading.Lock()
+        self.build_seconds = None
+
+    @property
+    def built(self):
+        return self._builder is not None
+
+    def _build(self):
+        with self._lock:
+            if self._builder is None:
+                started = time.perf_counter()
+                builder = AgentBuilder(agent=self.agent_factory(), **self.builder_kwargs)
+                builder.conversation_handler.messages = self._messages
+                self._builder = builder
+                self.build_seconds = time.perf_counter() - started
+        return self._builder
+
+    @property
+    def conversation_handler(self):
+        return self._build().conversation_handler
+
+    @property
+    def messages(self):
+        return self._builder.conversation_handler.messages if self.built else self._messages
+
+    @messages.setter
+    def messages(self, messages):
+        if self.built:
+            self._builder.conversation_handler.messages = messages
+        else:
+            self._messages = messages
+
+    def run(self, prompt):
+        return self._build().run(prompt)
+
+    async def arun(self, prompt):
+        builder = self._builder or await asyncio.to_thread(self._build) # the first call creates the LLM client off the event loop
+        return await builder.arun(prompt)
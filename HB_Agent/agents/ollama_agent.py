@@ -6,5 +6,8 @@ class OllamaAgent:
     def __init__(self, model_name="mistral:latest"):
         self.llm = OllamaLLM(model=model_name)
     
-    def query(self, messages) -> str:
-        return self.llm.invoke(messages)
\ No newline at end of file
+    def query(self, messages, cache: bool = True) -> str:
+        return self.llm.invoke(messages) # local model, not cached
+
+    async def aquery(self, messages, cache: bool = True) -> str:
+        return await self.llm.ainvoke(messages)
@@ -1,16 +1,41 @@
 from langchain_openai import ChatOpenAI
-from config import OPENAI_API_KEY
+import config
+from llm_clients import http_client, http_async_client
+from request_timing import timed
+from .response_cache import response_cache, cache_key
 
 
 class OpenAIAgent:
     """OpenAI agent class to allow OpenAI models to be used for experts"""
     def __init__(self, model_name="gpt-4.1"):
-        api_key = OPENAI_API_KEY 
+        api_key = config.get_api_key() # key of the session the agent is built for
         if not api_key:
             raise ValueError("Missing OpenAI API Key. Set OPENAI_API_KEY in .env file.")
         
-        self.llm = ChatOpenAI(model=model_name, api_key=api_key, temperature=0.2)
-    
-    def query(self, messages) -> str:
-        return self.llm.invoke(messages)
+        self.llm = ChatOpenAI(model=model_name, api_key=api_key, temperature=0.2,
+                              http_client=http_client, http_async_client=http_async_client) # shared connection pool
 
+    def _cache_key(self, messages):
+        return cache_key(config.get_username(), self.llm.model_name, messages, {"temperature": self.llm.temperature})
+
+    def query(self, messages, cache: bool = True) -> str:
+        """Answer of the model, an identical earlier request is answered from the response cache unless cache=False"""
+        key = self._cache_key(messages) if cache and response_cache.enabled else None
+        if key is not None and (response := response_cache.get(key)) is not None:
+            return response
+        with timed("llm.expert"):
+            response = self.llm.invoke(messages)
+        if key is not None:
+            response_cache.set(key, response)
+        return response
+
+    async def aquery(self, messages, cache: bool = True):
+        """query without blocking the event loop, several experts can wait for their answer at the same time"""
+        key = self._cache_key(messages) if cache and response_cache.enabled else None
+        if key is not None and (response := response_cache.get(key)) is not None:
+            return response
+        with timed("llm.expert"):
+            response = await self.llm.ainvoke(messages)
+        if key is not None:
+            response_cache.set(key, response)
+        return response
@@ -0,0 +1,80 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+import request_timing
+
+LLM_CACHE_SIZE = int(os.getenv("LLM_CACHE_SIZE", 512)) # responses kept in memory, 0 disables the cache
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", 3600)) # seconds a response is reused
+
+
+def _serializable(value):
+    """Messages can be dicts, strings or langchain messages and prompt values"""
+    if hasattr(value, "model_dump"):
+        return value.model_dump()
+    if hasattr(value, "to_messages"):
+        return [message.model_dump() for message in value.to_messages()]
+    return str(value)
+
+def cache_key(user: str, model: str, messages, params: dict):
+    """sha256 of the user, the model, the full message list and the sampling parameters. With the user in the key
+    a multi-tenant agent never answers one user with the completion (and API key) of another."""
+    payload = json.dumps({"user": user, "model": model, "messages": messages, "params": params},
+                         default=_serializable, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """LRU of LLM responses with a time to live. An identical request (same user, model, messages and parameters) within
+    the TTL returns the stored response without an API call, e.g. a question that is asked again in a new
+    conversation or a reflection that is retried."""
+    def __init__(self, maxsize: int = LLM_CACHE_SIZE, ttl: float = LLM_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict() # key -> (stored at, response)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+
+    @property
+    def enabled(self):
+        return self.maxsize > 0 and self.ttl > 0
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry[0] > self.ttl:
+                del self._entries[key]
+                self.expired += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                request_timing.count("llm_cache.misses", 1)
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        request_timing.count("llm_cache.hits", 1)
+        return entry[1]
+
+    def set(self, key: str, response):
+        with self._lock:
+            self._entries[key] = (time.monotonic(), response)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {"size": len(self._entries), "maxsize": self.maxsize, "ttl_seconds": self.ttl, "hits": self.hits,
+                    "misses": self.misses, "expired": self.expired, "hit_rate": self.hits / lookups if lookups else 0.0}
+
+
+response_cache = ResponseCache() # shared by the experts of all sessions, a hit needs the same user and the exact same prompt
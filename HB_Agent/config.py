@@ -1,6 +1,31 @@
 from dotenv import load_dotenv  
+import contextvars
 import os
 
 load_dotenv()
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+AGENT_MULTI_TENANT = os.getenv("AGENT_MULTI_TENANT") == "1" # one process serves many users, selected per request with X-Username
+AGENT_MAX_SESSIONS = int(os.getenv("AGENT_MAX_SESSIONS", 200)) # user sessions kept in memory in multi-tenant mode
 
+_session = contextvars.ContextVar("session", default=None) # (username, api key) of the request that is handled
+
+def bind_user(username: str, openai_key: str):
+    """Set the user and OpenAI key of a pre-started (pooled) container, used by the /bind endpoint"""
+    global OPENAI_API_KEY
+    OPENAI_API_KEY = openai_key
+    os.environ["OPENAI_API_KEY"] = openai_key
+    os.environ["USERNAME"] = username
+
+def use_session(username: str, api_key: str = None):
+    """Set the user of the current request, copied into the threads and tasks it starts"""
+    _session.set((username, api_key))
+
+def get_api_key():
+    """OpenAI key of the current user, the key of the process if the user has none"""
+    session = _session.get()
+    return session[1] if session and session[1] else OPENAI_API_KEY
+
+def get_username():
+    """Username of the current request, the user of the container outside of a request"""
+    session = _session.get()
+    return session[0] if session else os.getenv("USERNAME", "default_user")
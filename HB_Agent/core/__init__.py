@@ -1,9 +1,22 @@
-from .prompt_manager import PromptManager
+from .prompt_manager import PromptManager, load_template
 from .conversation_handler import ConversationHandler
 from .conversation_reflection import ConversationReflection
+from .checkpoint import save_checkpoint, load_checkpoint
+from .session_store import Session, SessionStore
+from .ingestion_jobs import IngestionJob, IngestionQueue
+from .history_manager import HistoryManager, count_tokens
 
 __all__ = [
     "PromptManager",
+    "load_template",
     "ConversationHandler",
-    "ConversationReflection"
+    "ConversationReflection",
+    "save_checkpoint",
+    "load_checkpoint",
+    "Session",
+    "SessionStore",
+    "IngestionJob",
+    "IngestionQueue",
+    "HistoryManager",
+    "count_tokens"
 ]
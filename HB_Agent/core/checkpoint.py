@@ -0,0 +1,29 @@
+import json
+import os
+import time
+
+CHECKPOINT_DIR = os.getenv("CHECKPOINT_DIR", "/chroma_db/checkpoints") # on the shared volume, a new container of the user can restore it
+
+
+def checkpoint_path(username: str):
+    return os.path.join(CHECKPOINT_DIR, f"{username}.json")
+
+def save_checkpoint(username: str, state: dict):
+    """Write the conversation state of the user, atomic so a stop during the write keeps the previous checkpoint"""
+    os.makedirs(CHECKPOINT_DIR, exist_ok=True)
+    path = checkpoint_path(username)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({**state, "saved_at": time.time()}, f)
+    os.replace(tmp_path, path)
+    return path
+
+def load_checkpoint(username: str):
+    """Conversation state of the user and remove the checkpoint, None if there is none"""
+    path = checkpoint_path(username)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        state = json.load(f)
+    os.remove(path) # restored once, the running container holds the newer state from now on
+    return state
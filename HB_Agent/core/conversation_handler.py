@@ -1,4 +1,7 @@
+import asyncio
 import json
+import request_timing
+from .history_manager import HistoryManager, message_tokens
 
 class ConversationHandler:
     """"Runs conversation with the experts, adds episodic memories and semantic memories to the prompt for the expert. Finally it uses a reflection
@@ -12,6 +15,8 @@ class ConversationHandler:
         self.top_k_semantic = top_k_semantic
         self.messages = []
         self.name=name
+        self.history = HistoryManager(agent) # only the newest messages are sent in full, older ones as a summary
+        self._lock = None # asyncio lock of arun_conversation, created in the event loop
 
     def format_conversation(self, messages):
         """"Create conversation summary for the episodic memory """
@@ -31,32 +36,84 @@ class ConversationHandler:
                     "response": {"last_message": "No messages to store. Please have a conversation with the agent first."}
                 })
             else:
-                from core import ConversationReflection
-                from memory import ChromaMemory
-                memory = ChromaMemory()
-                reflection_generator = ConversationReflection(self.agent, self.prompt_manager.reflection_prompt_file)
-                conversation = self.format_conversation(self.messages)
-                reflection = reflection_generator.reflect_on_conversation(conversation)
+                from memory import get_memory
+                memory = get_memory()
+                reflection = self.reflect()
                 memory.add_entry(reflection, self.collection_episodic)
                 # Clear messages after storing in episodic memory
                 self.messages = []
+                self.history.reset()
                 return json.dumps({
                     "prompt": {"message_id": "success", "expert_prompt": "Memory updated successfully."},
                     "response": {"last_message": "Memory has been updated and conversation history cleared."}
                 }) # send if update succesfull
         self.messages.append(user_message) # add user message
         system_prompt = self.prompt_manager.get_episodic_prompt(prompt, self.collection_episodic, self.top_k_episodic) #enhance prompt with episodic knowledge
-        system_message = {"role": "system", "content": system_prompt.content} # set system prompt
-        self.messages = [system_message] + [msg for msg in self.messages if msg["role"] != "system"] # add all messages except system prompt
         context_message = self.prompt_manager.get_semantic_prompt(prompt, self.collection_semantic, self.top_k_semantic) # get semantic knowledge if availabe
+        summary, window = self.history.compact(self._dialog())
+        placeholder, combined_string = self._build_prompt(system_prompt, context_message, user_message, summary, window)
+        response = self.agent.query(placeholder)
+        return self._store_response(response, combined_string)
+
+    def reflect(self):
+        """Reflection on the messages for the episodic memory, None if there are no messages. Does not store it."""
+        if not self.messages:
+            return None
+        from core import ConversationReflection
+        reflection_generator = ConversationReflection(self.agent, self.prompt_manager.reflection_prompt_file)
+        return reflection_generator.reflect_on_conversation(self.format_conversation(self.messages))
+
+    async def areflect(self):
+        """reflect without blocking the event loop"""
+        if not self.messages:
+            return None
+        from core import ConversationReflection
+        reflection_generator = ConversationReflection(self.agent, self.prompt_manager.reflection_prompt_file)
+        return await reflection_generator.areflect_on_conversation(self.format_conversation(self.messages))
+
+    async def arun_conversation(self, prompt):
+        """run_conversation without blocking the event loop: the episodic and semantic memory are retrieved at the
+        same time and the expert is awaited, so the supervisor can wait for several experts at once"""
+        if prompt.lower() == "exit":
+            return await asyncio.to_thread(self.run_conversation, prompt)
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock: # two calls to the same expert keep their messages in order
+            user_message = {"role": "user", "content": prompt}
+            self.messages.append(user_message) # add user message
+            system_prompt, context_message = await asyncio.gather(
+                self.prompt_manager.aget_episodic_prompt(prompt, self.collection_episodic, self.top_k_episodic),
+                self.prompt_manager.aget_semantic_prompt(prompt, self.collection_semantic, self.top_k_semantic)
+            )
+            summary, window = await self.history.acompact(self._dialog())
+            placeholder, combined_string = self._build_prompt(system_prompt, context_message, user_message, summary, window)
+            response = await self.agent.aquery(placeholder)
+            return self._store_response(response, combined_string)
+
+    def _dialog(self):
+        """Messages of the conversation without the system prompt"""
+        return [msg for msg in self.messages if msg["role"] != "system"]
+
+    def _build_prompt(self, system_prompt, context_message, user_message, summary, window):
+        """Messages for the expert and the prompt that is shown in streamlit: the system prompt with the summary of the
+        older messages and the messages of the window"""
+        system_message = {"role": "system", "content": system_prompt.content} # set system prompt
+        self.messages = [system_message] + self._dialog() # add all messages except system prompt
+        if summary:
+            system_message = {"role": "system", "content": f"{system_prompt.content}\n\nSummary of the earlier conversation:\n{summary}"}
+        sent = [system_message, *window]
         combined_string = (
                 "#### Episodic Memory:\n\n" +
-                json.dumps(self.messages, ensure_ascii=False, indent=2) +
+                json.dumps(sent, ensure_ascii=False, indent=2) +
                 "\n\n---\n\n#### Semantic Memory:\n" +
                 context_message
             )# create string for placeholder message to show in streamlit
-        placeholder = [*self.messages, context_message, user_message]
-        response = self.agent.query(placeholder)
+        placeholder = [*sent, context_message, user_message]
+        request_timing.count(f"prompt_tokens.{self.name}", sum(message_tokens(message) for message in placeholder))
+        return placeholder, combined_string
+
+    def _store_response(self, response, combined_string):
+        """Add the answer of the expert to the messages and return it with the prompt"""
         message_id = response.id # get response id
         prompt_id={"message_id": message_id, "expert_prompt": combined_string} # to log the prompt in the expert message
         content = response.content # content of response
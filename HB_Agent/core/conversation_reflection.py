@@ -1,6 +1,13 @@
 from langchain.prompts import ChatPromptTemplate
-import os
+from functools import lru_cache
 from langchain_core.output_parsers.json import JsonOutputParser
+from .prompt_manager import load_template
+
+
+@lru_cache(maxsize=None)
+def reflection_template(file_path: str):
+    """Parsed reflection prompt, shared by all experts that use the same template file"""
+    return ChatPromptTemplate.from_template(load_template(file_path))
 
 
 class ConversationReflection:
@@ -8,19 +15,22 @@ class ConversationReflection:
     def __init__(self, llm, reflection_prompt_file: str):
         self.llm = llm
         self.reflection_prompt_template = self._load_prompt_from_file(reflection_prompt_file)
-        self.reflection_prompt_file = ChatPromptTemplate.from_template(self.reflection_prompt_template)
+        self.reflection_prompt_file = reflection_template(reflection_prompt_file)
 
     def _load_prompt_from_file(self, file_path: str):
-        """Loads the contents of a text file."""
-        if not os.path.exists(file_path):
-            raise FileNotFoundError(f"The file {file_path} does not exist.")
-        with open(file_path, 'r') as file:
-            return file.read().strip()
+        """Loads the contents of a text file (cached)."""
+        return load_template(file_path)
 
-    def reflect_on_conversation(self, conversation: str):
+    def reflect_on_conversation(self, conversation: str, cache: bool = True):
+        """Reflection as dict, cache=False asks the model again for a conversation that was reflected on before"""
         prompt = self.reflection_prompt_file.format(conversation=conversation)
-        response = self.llm.query(prompt)
+        response = self.llm.query(prompt, cache=cache)
         message = response.content
         parsed_response = JsonOutputParser().parse(message)
         return parsed_response
 
+    async def areflect_on_conversation(self, conversation: str, cache: bool = True):
+        """reflect_on_conversation without blocking the event loop"""
+        prompt = self.reflection_prompt_file.format(conversation=conversation)
+        response = await self.llm.aquery(prompt, cache=cache)
+        return JsonOutputParser().parse(response.content)
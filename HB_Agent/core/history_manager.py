@@ -0,0 +1,112 @@
+import logging
+import os
+from functools import lru_cache
+from request_timing import timed
+from .prompt_manager import load_template
+
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", 4000)) # tokens of conversation history sent with every turn
+HISTORY_SUMMARY_WORDS = int(os.getenv("HISTORY_SUMMARY_WORDS", 300)) # maximum length of the running summary
+HISTORY_ENCODING = os.getenv("HISTORY_ENCODING", "o200k_base") # tiktoken encoding of the gpt-4.1 models
+HISTORY_SUMMARY_PROMPT = "Set_up/Templates/Summary_prompt.txt"
+
+
+@lru_cache(maxsize=1)
+def _encoding():
+    try:
+        import tiktoken
+        return tiktoken.get_encoding(HISTORY_ENCODING)
+    except Exception as e: # the encoding is downloaded on first use, estimate the tokens without network
+        logging.warning(f"Tokenizer {HISTORY_ENCODING} not available, estimating tokens from characters: {e}")
+        return None
+
+def count_tokens(text: str):
+    encoding = _encoding()
+    if encoding is None:
+        return len(text) // 4 + 1
+    return len(encoding.encode(text, disallowed_special=()))
+
+def message_tokens(message):
+    """Tokens of a chat message ({"role", "content"} dict or string), with the few tokens of the message framing"""
+    if isinstance(message, dict):
+        return count_tokens(str(message.get("content") or "")) + 4
+    return count_tokens(str(message)) + 4
+
+def format_messages(messages):
+    """User and assistant messages as 'Role: content' lines"""
+    return "\n".join(f"{message['role'].capitalize()}: {message['content']}"
+                     for message in messages if message['role'] in ['assistant', 'user'])
+
+
+class HistoryManager:
+    """Keeps the history that is sent with every turn under a token budget. Once the messages since the last summary
+    go over the budget, the oldest ones are folded into a running summary with one LLM call and only the newest
+    messages (half the budget) are sent in full, so the next turns do not need to summarize again. The summary is
+    kept between turns and only extended with the messages that left the window."""
+    def __init__(self, agent, budget: int = HISTORY_TOKEN_BUDGET, summary_prompt_file: str = HISTORY_SUMMARY_PROMPT):
+        self.agent = agent # OpenAIAgent or OllamaAgent that writes the summary
+        self.budget = budget
+        self.summary_prompt_file = summary_prompt_file
+        self.summary = ""
+        self.summarized = 0 # messages at the start of the conversation that are in the summary
+        self.summary_calls = 0
+
+    def reset(self):
+        """Forget the summary, e.g. after the conversation was stored in the episodic memory and cleared"""
+        self.summary, self.summarized = "", 0
+
+    def state(self):
+        return {"summary": self.summary, "summarized": self.summarized}
+
+    def restore(self, state: dict):
+        self.summary, self.summarized = state.get("summary", ""), state.get("summarized", 0)
+
+    def _fold(self, messages):
+        """Index of the first message that stays in the window, the messages before it and after the summary are
+        summarized. Equal to self.summarized when the window is within the budget."""
+        if self.summarized > len(messages): # the conversation was cleared or replaced
+            self.reset()
+        tokens = [message_tokens(message) for message in messages[self.summarized:]]
+        if sum(tokens) <= self.budget:
+            return self.summarized
+        start, used = len(messages), 0
+        while start > self.summarized and used + tokens[start - 1 - self.summarized] <= self.budget // 2:
+            start -= 1
+            used += tokens[start - self.summarized]
+        return min(start, len(messages) - 1) # the last message is always sent in full
+
+    def _summary_prompt(self, messages):
+        return load_template(self.summary_prompt_file).format(
+            summary=self.summary or "(no summary yet)", conversation=format_messages(messages),
+            max_words=HISTORY_SUMMARY_WORDS)
+
+    def _update(self, start, response):
+        if response is not None:
+            self.summary = response.content.strip()
+            self.summary_calls += 1
+        self.summarized = start
+
+    def compact(self, messages):
+        """(summary, messages in the window) of the conversation, summarizes first if it went over the budget"""
+        start = self._fold(messages)
+        if start > self.summarized:
+            response = None
+            try:
+                with timed("history.summarize"):
+                    response = self.agent.query(self._summary_prompt(messages[self.summarized:start]))
+            except Exception as e: # the oldest messages are dropped without summary, the turn goes on
+                logging.error(f"Summarizing the conversation history failed: {e}")
+            self._update(start, response)
+        return self.summary, messages[self.summarized:]
+
+    async def acompact(self, messages):
+        """compact without blocking the event loop"""
+        start = self._fold(messages)
+        if start > self.summarized:
+            response = None
+            try:
+                with timed("history.summarize"):
+                    response = await self.agent.aquery(self._summary_prompt(messages[self.summarized:start]))
+            except Exception as e:
+                logging.error(f"Summarizing the conversation history failed: {e}")
+            self._update(start, response)
+        return self.summary, messages[self.summarized:]
@@ -0,0 +1,88 @@
+import contextvars
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", 1)) # ingestion jobs that run at the same time, the files of a job run in parallel
+INGEST_MAX_JOBS = int(os.getenv("INGEST_MAX_JOBS", 100)) # finished jobs kept for their status and events
+
+
+class IngestionJob:
+    """Status and progress events of one PDF upload"""
+    def __init__(self, username: str, expert_name: str, collection_name: str, files: list):
+        self.id = uuid.uuid4().hex
+        self.username = username
+        self.expert_name = expert_name
+        self.collection_name = collection_name
+        self.files = files
+        self.status = "queued" # queued, running, done, partial (some files failed) or failed
+        self.summary = None
+        self.error = None
+        self.created_at = time.time()
+        self.events = []
+        self._lock = threading.Lock()
+        self.add_event({"event": "queued", "files": files})
+
+    def add_event(self, event: dict):
+        with self._lock:
+            self.events.append({**event, "job_id": self.id, "timestamp": time.time()})
+
+    def events_since(self, index: int):
+        with self._lock:
+            return self.events[index:]
+
+    @property
+    def finished(self):
+        return self.status in ("done", "partial", "failed")
+
+    def info(self):
+        return {"job_id": self.id, "username": self.username, "expert_name": self.expert_name,
+                "collection": self.collection_name, "files": self.files, "status": self.status,
+                "summary": self.summary, "error": self.error, "created_at": self.created_at}
+
+
+class IngestionQueue:
+    """Runs ingestion jobs in worker threads, outside of the request that uploaded the files. run(job) does the
+    work and returns the summary, it runs with a copy of the context of submit (session key, user)."""
+    def __init__(self, workers: int = INGEST_WORKERS, max_jobs: int = INGEST_MAX_JOBS):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ingest")
+        self.max_jobs = max_jobs
+        self._jobs = OrderedDict() # job id -> job, oldest first
+        self._lock = threading.Lock()
+
+    def submit(self, job: IngestionJob, run):
+        with self._lock:
+            self._jobs[job.id] = job
+            finished = [job_id for job_id, old in self._jobs.items() if old.finished]
+            for job_id in finished[:max(0, len(self._jobs) - self.max_jobs)]:
+                del self._jobs[job_id]
+        self.executor.submit(contextvars.copy_context().run, self._run, job, run)
+        return job
+
+    def get(self, job_id: str):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _run(self, job: IngestionJob, run):
+        job.status = "running"
+        job.add_event({"event": "started"})
+        try:
+            job.summary = run(job)
+            failed = job.summary.get("failed") or []
+            if failed and len(failed) >= job.summary.get("files", 0):
+                raise RuntimeError(f"Ingestion failed for all files: {', '.join(failed)}")
+            status = "partial" if failed else "done"
+            job.add_event({"event": status, **job.summary}) # before the status, a reader that sees the job finished has all events
+            job.status = status
+        except Exception as e:
+            job.error = str(e)
+            job.add_event({"event": "failed", "error": str(e)})
+            job.status = "failed"
+
+    def stats(self):
+        with self._lock:
+            jobs = list(self._jobs.values())
+        return {status: sum(job.status == status for job in jobs) for status in ("queued", "running", "done", "partial", "failed")}
@@ -1,7 +1,16 @@
 from langchain_core.messages import SystemMessage
+from functools import lru_cache
 import os
 
 
+@lru_cache(maxsize=None)
+def load_template(file_path: str):
+    """Contents of a prompt template file, read once per process and shared by all experts and sessions."""
+    if not os.path.exists(file_path):
+        raise FileNotFoundError(f"The file {file_path} does not exist.")
+    with open(file_path, 'r') as file:
+        return file.read().strip()
+
 
 class PromptManager:
     """Determines how the prompt of the expert is updated, based on the availability of data in the episodic and semantic memory. 
@@ -17,17 +26,24 @@ class PromptManager:
         
         
     def _load_prompt_from_file(self, file_path: str):
-        """Loads the contents of a text file."""
-        if not os.path.exists(file_path):
-            raise FileNotFoundError(f"The file {file_path} does not exist.")
-        with open(file_path, 'r') as file:
-            return file.read().strip()
+        """Loads the contents of a text file (cached)."""
+        return load_template(file_path)
 
     def get_episodic_prompt(self, query: str, collection: str, top_k : int):
         """Generate the episodic prompt using the template and query."""
-        from memory import ChromaMemory
-        database = ChromaMemory()
+        from memory import get_memory
+        database = get_memory() # shared instance with open collection handles
         memory = database.search(query, collection, top_k)
+        return self._episodic_prompt(memory)
+
+    async def aget_episodic_prompt(self, query: str, collection: str, top_k : int):
+        """get_episodic_prompt without blocking the event loop"""
+        from memory import get_memory
+        memory = await get_memory().asearch(query, collection, top_k)
+        return self._episodic_prompt(memory)
+
+    def _episodic_prompt(self, memory):
+        """System message with the insights of the retrieved episodic memories"""
         if not memory or memory == ["No results found."]:
             return SystemMessage(content=self.system_prompt)
         conversations = []
@@ -50,10 +66,16 @@ class PromptManager:
 
     def get_semantic_prompt(self, query: str, collection: str, top_k :int):
         """Generate the semantic prompt using the template and query."""
-        from memory import ChromaMemory
-        database = ChromaMemory()
-        memories = database.search(query, collection, top_k)
+        from memory import get_memory, SEMANTIC_RETRIEVAL_MODE
+        database = get_memory()
+        memories = database.search(query, collection, top_k, mode=SEMANTIC_RETRIEVAL_MODE) # keyword queries are answered by the BM25 index
 
         semantic_prompt = self.semantic_prompt_template.format(memories=memories) # memories as entry
         
         return semantic_prompt
+
+    async def aget_semantic_prompt(self, query: str, collection: str, top_k :int):
+        """get_semantic_prompt without blocking the event loop"""
+        from memory import get_memory, SEMANTIC_RETRIEVAL_MODE
+        memories = await get_memory().asearch(query, collection, top_k, mode=SEMANTIC_RETRIEVAL_MODE)
+        return self.semantic_prompt_template.format(memories=memories)
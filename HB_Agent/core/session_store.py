@@ -0,0 +1,90 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+
+
+class Session:
+    """Supervisor graph and conversation history of one user"""
+    def __init__(self, username: str, api_key: str, supervisor):
+        self.username = username
+        self.api_key = api_key
+        self.supervisor = supervisor
+        self.conversation_history = []
+        self.history = None # HistoryManager that keeps the conversation history in the prompt under a token budget
+        self.created_at = time.time()
+        self.last_used = self.created_at
+
+
+class SessionStore:
+    """LRU of user sessions. A missing session is built once by factory(username, api_key) in a worker thread,
+    also when several requests of the user arrive at the same time. The least recently used session is passed
+    to on_evict (e.g. to checkpoint it) once more than maxsize sessions are held, a new session of that user is only
+    built once on_evict is done."""
+    def __init__(self, factory, maxsize: int, on_evict=None):
+        self.factory = factory
+        self.maxsize = maxsize
+        self.on_evict = on_evict
+        self._sessions = OrderedDict() # username -> Session
+        self._building = {} # username -> task building the session
+        self._evicting = {} # username -> future of on_evict of the evicted session
+        self.evictions = 0
+
+    def get(self, username: str):
+        session = self._sessions.get(username)
+        if session is not None:
+            self._sessions.move_to_end(username)
+            session.last_used = time.time()
+        return session
+
+    def add(self, session: Session):
+        self._sessions[session.username] = session
+        self._sessions.move_to_end(session.username)
+        while len(self._sessions) > self.maxsize:
+            _, evicted = self._sessions.popitem(last=False)
+            self.evictions += 1
+            if self.on_evict is not None:
+                future = asyncio.get_running_loop().run_in_executor(None, self.on_evict, evicted)
+                self._evicting[evicted.username] = future
+                future.add_done_callback(lambda done, username=evicted.username: self._evicted(username, done))
+        return session
+
+    def _evicted(self, username: str, future):
+        if self._evicting.get(username) is future:
+            del self._evicting[username]
+        if not future.cancelled() and future.exception() is not None:
+            logging.error(f"Checkpoint of the evicted session of {username} failed: {future.exception()}")
+
+    async def get_or_create(self, username: str, api_key: str = None):
+        session = self.get(username)
+        if session is not None:
+            if api_key:
+                session.api_key = api_key # the key of the user can change between logins
+            return session
+        evicting = self._evicting.get(username)
+        if evicting is not None: # the checkpoint has to be written before the new session restores it
+            await asyncio.wait([evicting])
+            session = self.get(username)
+            if session is not None:
+                return session
+        task = self._building.get(username)
+        if task is None:
+            task = asyncio.ensure_future(asyncio.to_thread(self.factory, username, api_key))
+            self._building[username] = task
+            task.add_done_callback(lambda _: self._building.pop(username, None))
+        session = await asyncio.shield(task) # a cancelled request does not cancel the build for the others
+        return self.get(username) or self.add(session)
+
+    def single(self):
+        """The only session of a single-user agent, None if it is not bound yet"""
+        return next(iter(self._sessions.values()), None)
+
+    def remove(self, username: str):
+        return self._sessions.pop(username, None)
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def stats(self):
+        return {"sessions": len(self._sessions), "maxsize": self.maxsize, "building": len(self._building),
+                "evicting": len(self._evicting), "evictions": self.evictions}
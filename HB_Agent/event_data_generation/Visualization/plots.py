@@ -127,9 +127,112 @@ def plot_stacked_bar_percentages(perc_per_window, perc_per_day, WINDOWS, DAYS, o
         plt.savefig(f'{output_prefix}_day.png')
     plt.close()
 
+GANTT_SLOT_MINUTES = 10 # resolution of the occupancy image
+GANTT_MAX_BAR_DAYS = 14 # above this number of days the occupancy image is used instead of bars
+
+def _gantt_event_types(days):
+    """Collect the event types of a range of days, keeps the order in which they are first seen"""
+    event_types = []
+    for day in days:
+        for et in day.get('events', {}):
+            if et not in event_types:
+                event_types.append(et)
+    return event_types
+
+def _gantt_color_map(event_types):
+    """Dynamically generate a color map based on the number of event types"""
+    n_events = len(event_types)
+    cmap = plt.get_cmap('tab20' if n_events > 10 else 'tab10') # use a colormap and assign colors to each event type
+    color_list = [mcolors.to_hex(cmap(i % cmap.N)) for i in range(n_events)]
+    return {et: color_list[i] for i, et in enumerate(event_types)}
+
+def compute_occupancy(days, event_types, slot_minutes=GANTT_SLOT_MINUTES):
+    """Rasterize the events of a range of days into an occupancy matrix (event type x time slot).
+    Each cell holds the fraction of the slot in which the event type is active, events running past
+    the last day are clipped."""
+    total_minutes = len(days) * 1440
+    occupancy = np.zeros((len(event_types), total_minutes // slot_minutes))
+    for row, et in enumerate(event_types):
+        starts = []
+        ends = []
+        for day_idx, day in enumerate(days):
+            for ev in day.get('events', {}).get(et, []):
+                starts.append(ev['start'] + day_idx * 1440)
+                ends.append(ev['start'] + ev['duration'] + day_idx * 1440)
+        if not starts:
+            continue
+        starts = np.clip(np.array(starts, dtype=int), 0, total_minutes)
+        ends = np.clip(np.array(ends, dtype=int), 0, total_minutes)
+        delta = np.zeros(total_minutes + 1)
+        np.add.at(delta, starts, 1) # +1 where an event starts, -1 where it ends
+        np.add.at(delta, ends, -1)
+        active = np.cumsum(delta)[:total_minutes] > 0 # minute is occupied if at least one event is running
+        occupancy[row] = active.reshape(-1, slot_minutes).mean(axis=1)
+    return occupancy
+
+def plot_gantt(all_results, person_idx=0, start_day=0, num_days=7, output_file=None):
+    """Gantt chart for one person over a range of days (num_days None for the full horizon).
+    Short ranges are drawn with one broken_barh call per event type, long ranges are rasterized
+    into a 10-minute occupancy image so the render time does not depend on the number of events."""
+    person = all_results[person_idx]
+    end_day = len(person['days']) if num_days is None else start_day + num_days
+    days = person['days'][start_day:end_day]
+    event_types = _gantt_event_types(days)
+    if not days or not event_types:
+        return
+    color_map = _gantt_color_map(event_types)
+    n_days = len(days)
+    fig, ax = plt.subplots(figsize=(16, max(4, len(event_types) * 0.6 + 2)))
+    if n_days <= GANTT_MAX_BAR_DAYS:
+        for y, et in enumerate(event_types):
+            bars = []
+            for day_idx, day in enumerate(days):
+                for ev in day.get('events', {}).get(et, []):
+                    bars.append((ev['start'] + day_idx * 1440, ev['duration']))
+            ax.broken_barh(bars, (y - 0.4, 0.8), facecolors=color_map[et], edgecolor='black') # one collection per event type
+            if n_days <= 7: # event numbers are only readable on the preview
+                day_counter = {}
+                for bar_start, duration in bars:
+                    day_counter[bar_start // 1440] = day_counter.get(bar_start // 1440, 0) + 1
+                    ax.text(bar_start + duration/2, y, f"{day_counter[bar_start // 1440]}", va='center', ha='center', color='white', fontsize=8)
+        for d in range(n_days + 1):
+            ax.axvline(d*1440, color='k', linestyle='--', alpha=0.3)
+        xticks = []
+        xticklabels = []
+        hour_step = 2 if n_days <= 3 else 6 # fewer hour labels when more days are shown
+        for d in range(n_days):
+            for h in range(0, 24, hour_step):
+                xticks.append(d*1440 + h*60)
+                xticklabels.append(f"{h:02d}:00\nD{start_day + d}")
+        ax.set_xticks(xticks)
+        ax.set_xticklabels(xticklabels, rotation=45, fontsize=8)
+        ax.set_xlim(0, n_days * 1440)
+        ax.set_ylim(len(event_types) - 0.5, -0.5)
+    else:
+        occupancy = compute_occupancy(days, event_types)
+        image = np.ones(occupancy.shape + (4,))
+        for row, et in enumerate(event_types):
+            image[row, :, :3] = mcolors.to_rgb(color_map[et])
+            image[row, :, 3] = occupancy[row] # transparency shows how much of the slot is occupied
+        ax.imshow(image, aspect='auto', interpolation='nearest',
+                  extent=(0, n_days * 1440, len(event_types) - 0.5, -0.5))
+        step = max(1, n_days // 15) # keep the number of day labels readable
+        ax.set_xticks([d*1440 for d in range(0, n_days, step)])
+        ax.set_xticklabels([f"D{start_day + d}" for d in range(0, n_days, step)], rotation=45)
+    ax.set_yticks(range(len(event_types)))
+    ax.set_yticklabels(event_types)
+    ax.set_xlabel(f'Time (minutes since start of Day {start_day})')
+    ax.set_title(f"Event Schedule (Person {person['person_id'] if 'person_id' in person else person_idx}, "
+                 f"Days {start_day}-{start_day + n_days - 1})")
+    plt.tight_layout()
+    if output_file:
+        plt.savefig(output_file)
+        print(f"Gantt chart saved as {output_file}")
+    plt.close()
+
 def run_all_plots(all_results, custom_windows=None):
-    """Runs all the different plots, outputs events per hour, per day, trend analysis and preview of gantt chart for 
-    7 days for one person"""
+    """Runs all the different plots, outputs events per hour, per day, trend analysis, a preview of the gantt chart for 
+    7 days and the full horizon occupancy chart for one person"""
     persons = all_results
     num_persons = len(persons)
     num_days = len(persons[0]['days'])
@@ -208,60 +311,11 @@ def run_all_plots(all_results, custom_windows=None):
         plt.savefig(f'avg_events_per_weekday_{t}.png')
         plt.close()
         print(f"Saved avg events per weekday for {t} as avg_events_per_weekday_{t}.png")
-    # Gantt chart for a single person (first person) and max 7 days
-    person = all_results[0]
-    days = person['days'][:7] # fix 6 days
-    if days and 'events' in days[0]:
-        event_types = list(days[0]['events'].keys())
-        schedule = []
-        for day_idx, day in enumerate(days):
-            for et in event_types:
-                for idx, ev in enumerate(day['events'][et]):
-                    schedule.append({
-                        'type': et,
-                        'start': ev['start'] + day_idx * 1440,
-                        'duration': ev['duration'],
-                        'event_num': idx+1,
-                        'day': day_idx
-                    })
-        fig, ax = plt.subplots(figsize=(16, 6))
-        yticks = []
-        yticklabels = []
-        y = 0
-        # Dynamically generate a color map based on the number of event types
-        n_events = len(event_types)
-        # Use a colormap (e.g., tab10, tab20, or hsv) and assign colors to each event type
-        cmap = plt.get_cmap('tab20' if n_events > 10 else 'tab10')
-        color_list = [mcolors.to_hex(cmap(i % cmap.N)) for i in range(n_events)]
-        color_map = {et: color_list[i] for i, et in enumerate(event_types)}
-        for et in event_types:
-            events = [e for e in schedule if e['type'] == et]
-            for ev in events:
-                bar_start = ev['start']
-                ax.barh(y, ev['duration'], left=bar_start, color=color_map.get(et, 'tab:brown'), edgecolor='black')
-                ax.text(bar_start + ev['duration']/2, y, f"{ev['event_num']}", va='center', ha='center', color='white', fontsize=8)
-            yticks.append(y)
-            yticklabels.append(et)
-            y += 1
-        ax.set_yticks(yticks)
-        ax.set_yticklabels(yticklabels)
-        ax.set_xlabel('Time (minutes since start of Day 0)')
-        ax.set_title("All Days Event Schedule (First Person, Max 7 Days)")
-        for d in range(len(days) + 1):
-            ax.axvline(d*1440, color='k', linestyle='--', alpha=0.3)
-            ax.text(d*1440 + 10, y-0.5, f"Day {d}", va='top', ha='left', color='k', fontsize=10)
-        xticks = []
-        xticklabels = []
-        for d in range(len(days)):
-            for h in range(0, 25, 2):
-                xticks.append(d*1440 + h*60)
-                xticklabels.append(f"{h:02d}:00\nD{d}")
-        ax.set_xticks(xticks)
-        ax.set_xticklabels(xticklabels, rotation=45)
-        plt.tight_layout()
-        plt.savefig("all_days_gantt_singleperson_7days.png")
-        plt.close()
-        print("All-days Gantt chart (first person, max 7 days) saved as all_days_gantt_singleperson_7days.png")
+    # Gantt chart for a single person (first person), 7 day preview and the full horizon as occupancy image
+    plot_gantt(all_results, person_idx=0, start_day=0, num_days=7,
+               output_file="all_days_gantt_singleperson_7days.png")
+    plot_gantt(all_results, person_idx=0, start_day=0, num_days=None,
+               output_file="all_days_gantt_singleperson_horizon.png")
     # Stacked bar plots logic above
     event_counts, WINDOWS, DAYS = get_event_counts_by_event_type(all_results, custom_windows)
     perc_per_window, perc_per_day = compute_accumulated_percentages(event_counts, WINDOWS, DAYS)
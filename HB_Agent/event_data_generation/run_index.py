@@ -0,0 +1,108 @@
+import os
+import json
+import fcntl
+import hashlib
+from contextlib import contextmanager
+from datetime import datetime
+
+INDEX_FILE = "runs_index.json" # per user manifest of the data generation runs, read by the gateway
+LOCK_FILE = ".runs_index.lock"
+
+
+@contextmanager
+def _locked_index(base_folder):
+    """Exclusive lock on the user index while it is read, changed and written back"""
+    os.makedirs(base_folder, exist_ok=True)
+    with open(os.path.join(base_folder, LOCK_FILE), "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def load_index(base_folder):
+    """Load the run index of a user. Folders of runs created before the index existed are added once,
+    afterwards the next run id is read from the index instead of probing data_1, data_2, ..."""
+    index_path = os.path.join(base_folder, INDEX_FILE)
+    if os.path.exists(index_path):
+        with open(index_path, "r") as f:
+            return json.load(f)
+    index = {"next_id": 1, "runs": {}}
+    for name in os.listdir(base_folder) if os.path.isdir(base_folder) else []:
+        folder = os.path.join(base_folder, name)
+        if name.startswith("data_") and name[5:].isdigit() and os.path.isdir(folder):
+            index["runs"][name] = {"run": name, "id": int(name[5:]), "status": "completed",
+                                   "created_at": datetime.fromtimestamp(os.path.getmtime(folder)).isoformat(),
+                                   "variables_hash": _stored_variables_hash(folder),
+                                   **_run_contents(folder)}
+            index["next_id"] = max(index["next_id"], int(name[5:]) + 1)
+    return index
+
+
+def _write_index(base_folder, index):
+    """Write to a temporary file and replace, readers never see a partially written index"""
+    index_path = os.path.join(base_folder, INDEX_FILE)
+    tmp_path = f"{index_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(index, f, indent=2)
+    os.replace(tmp_path, index_path)
+
+
+def _run_contents(folder):
+    """Files directly in the run folder and the total size of the run"""
+    files = sorted(f for f in os.listdir(folder) if os.path.isfile(os.path.join(folder, f)))
+    size = 0
+    for root, _, names in os.walk(folder):
+        for name in names:
+            size += os.path.getsize(os.path.join(root, name))
+    return {"files": files, "size_bytes": size}
+
+
+def _stored_variables_hash(folder):
+    """Hash of the used_variables.json of an existing run, None if the run has none"""
+    try:
+        with open(os.path.join(folder, "used_variables.json"), "r") as f:
+            return variables_hash(json.load(f))
+    except (OSError, ValueError):
+        return None
+
+
+def variables_hash(variables_dict):
+    """Hash of the variables used for a run, equal variables give the same hash"""
+    return hashlib.sha1(json.dumps(variables_dict, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def allocate_run(base_folder, variables_dict=None):
+    """Reserve the next run id and create its folder. Returns the output folder"""
+    with _locked_index(base_folder):
+        index = load_index(base_folder)
+        run_id = index["next_id"]
+        while os.path.exists(os.path.join(base_folder, f"data_{run_id}")): # folder created outside the index
+            run_id += 1
+        run = f"data_{run_id}"
+        os.makedirs(os.path.join(base_folder, run))
+        index["next_id"] = run_id + 1
+        index["runs"][run] = {
+            "run": run,
+            "id": run_id,
+            "status": "running",
+            "created_at": datetime.now().isoformat(),
+            "variables_hash": variables_hash(variables_dict) if variables_dict is not None else None,
+            "files": [],
+            "size_bytes": 0
+        }
+        _write_index(base_folder, index)
+    return os.path.join(base_folder, run)
+
+
+def finish_run(base_folder, output_folder, status="completed"):
+    """Record the final status, files and size of a run in the index"""
+    run = os.path.basename(output_folder.rstrip(os.sep))
+    with _locked_index(base_folder):
+        index = load_index(base_folder)
+        entry = index["runs"].setdefault(run, {"run": run, "id": int(run[5:]), "created_at": None, "variables_hash": None})
+        entry.update(_run_contents(output_folder))
+        entry["status"] = status
+        entry["completed_at"] = datetime.now().isoformat()
+        _write_index(base_folder, index)
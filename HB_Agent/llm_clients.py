@@ -0,0 +1,19 @@
+import os
+import httpx
+from llm_replay import LLM_REPLAY_MODE, ReplayStore, ReplayTransport, AsyncReplayTransport
+
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", 100)) # connections to the OpenAI API for all users of the process
+OPENAI_MAX_KEEPALIVE = int(os.getenv("OPENAI_MAX_KEEPALIVE", 20))
+OPENAI_TIMEOUT = httpx.Timeout(600.0, connect=10.0) # same read timeout as the openai client default
+
+_limits = httpx.Limits(max_connections=OPENAI_MAX_CONNECTIONS, max_keepalive_connections=OPENAI_MAX_KEEPALIVE)
+
+# One connection pool per process, passed to every ChatOpenAI and OpenAIEmbeddings instance so the sessions
+# of all users reuse the same TLS connections instead of each client opening its own.
+replay_store = ReplayStore() if LLM_REPLAY_MODE else None # record or replay the OpenAI exchanges of this process
+if replay_store is None:
+    http_client = httpx.Client(limits=_limits, timeout=OPENAI_TIMEOUT)
+    http_async_client = httpx.AsyncClient(limits=_limits, timeout=OPENAI_TIMEOUT)
+else:
+    http_client = httpx.Client(timeout=OPENAI_TIMEOUT, transport=ReplayTransport(replay_store, httpx.HTTPTransport(limits=_limits)))
+    http_async_client = httpx.AsyncClient(timeout=OPENAI_TIMEOUT, transport=AsyncReplayTransport(replay_store, httpx.AsyncHTTPTransport(limits=_limits)))
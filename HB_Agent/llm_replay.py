@@ -0,0 +1,236 @@
+import asyncio
+import base64
+import hashlib
+import json
+import logging
+import math
+import os
+import random
+import threading
+import time
+from collections import Counter
+import httpx
+
+LLM_REPLAY_MODE = os.getenv("LLM_REPLAY_MODE", "") # record: store every OpenAI exchange in the fixtures, replay: answer from them without network
+LLM_FIXTURES_PATH = os.getenv("LLM_FIXTURES_PATH", "/chroma_db/llm_fixtures.jsonl") # one recorded exchange per line
+LLM_REPLAY_LATENCY = os.getenv("LLM_REPLAY_LATENCY", "0") # seconds before a replayed response starts, or "recorded" for the recorded time to the first chunk
+LLM_REPLAY_CHUNK_DELAY = float(os.getenv("LLM_REPLAY_CHUNK_DELAY", 0)) # seconds between the events of a replayed stream
+REPLAY_EMBEDDING_DIM = 1536 # size of synthesized embeddings when no recorded embedding shows the size
+
+# response headers that describe the transfer of the recorded body, not the body itself
+_TRANSFER_HEADERS = {"content-length", "content-encoding", "transfer-encoding", "connection"}
+
+
+def _body(request: httpx.Request):
+    try:
+        return json.loads(request.content or b"{}")
+    except ValueError:
+        return {}
+
+def exact_key(path: str, body: dict):
+    """sha256 of the endpoint and the full request body"""
+    return hashlib.sha256(json.dumps([path, body], sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+def _headers(response: httpx.Response):
+    return {k: v for k, v in response.headers.items() if k.lower() not in _TRANSFER_HEADERS}
+
+def fallback_key(path: str, body: dict):
+    """Shape of a request for a replay without an exact recording: the same endpoint and model and for chat requests
+    the same tools, streaming and role of the last message (a new question or the answer of a tool)"""
+    messages = body.get("messages") or [{}]
+    tools = sorted(tool.get("function", {}).get("name", "") for tool in body.get("tools") or [])
+    return json.dumps([path, body.get("model"), tools, bool(body.get("stream")), messages[-1].get("role")])
+
+
+class ReplayStore:
+    """Recorded exchanges with the OpenAI API (chat completions of the supervisor and the experts, embeddings).
+    In record mode every exchange is appended to the fixtures file. In replay mode a request is answered with the
+    recording of the same request, otherwise with a recording of a request of the same shape (the prompt of a replayed
+    session differs when the memories differ). Embeddings of texts without recording are synthesized."""
+    def __init__(self, path: str = LLM_FIXTURES_PATH, mode: str = LLM_REPLAY_MODE,
+                 latency: str = LLM_REPLAY_LATENCY, chunk_delay: float = LLM_REPLAY_CHUNK_DELAY):
+        if mode not in ("record", "replay"):
+            raise ValueError(f"Unknown LLM_REPLAY_MODE '{mode}', must be record or replay")
+        self.path = path
+        self.mode = mode
+        self.latency = latency
+        self.chunk_delay = chunk_delay
+        self._exact = {} # exact key -> recordings
+        self._fallback = {} # fallback key -> recordings
+        self._used = Counter() # key -> recordings replayed, repeated requests get the recordings in order
+        self._embedding_dim = {} # model -> size of the recorded embeddings
+        self._lock = threading.Lock()
+        self.stats = Counter()
+        if mode == "replay":
+            self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            raise FileNotFoundError(f"No LLM fixtures at {self.path}, record them first with LLM_REPLAY_MODE=record")
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    self._add(json.loads(line))
+        logging.info(f"Replaying {sum(len(r) for r in self._exact.values())} recorded LLM exchanges from {self.path}")
+
+    def _add(self, recording):
+        self._exact.setdefault(recording["key"], []).append(recording)
+        if not recording["path"].endswith("/embeddings"): # the embeddings of other texts are synthesized
+            self._fallback.setdefault(recording["fallback"], []).append(recording)
+        elif recording["status"] == 200:
+            embedding = (json.loads(recording["body"]).get("data") or [{}])[0].get("embedding")
+            if embedding:
+                # base64 of float32 values, the default of the openai client, or a list of floats
+                self._embedding_dim[recording["model"]] = len(base64.b64decode(embedding)) // 4 if isinstance(embedding, str) else len(embedding)
+
+    def record(self, request: httpx.Request, response: httpx.Response, content: bytes, seconds: float):
+        """Append the exchange, `content` is the decoded body and `seconds` the time to its first chunk"""
+        body = _body(request)
+        recording = {"key": exact_key(request.url.path, body), "fallback": fallback_key(request.url.path, body),
+                     "path": request.url.path, "model": body.get("model"), "request": body, "status": response.status_code,
+                     "headers": _headers(response), "body": content.decode(response.encoding or "utf-8", errors="replace"),
+                     "seconds": round(seconds, 4)} # no request headers, they hold the key
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(recording, ensure_ascii=False) + "\n")
+            self.stats["recorded"] += 1
+        return recording
+
+    def _next(self, key, recordings):
+        index = self._used[key] % len(recordings)
+        self._used[key] += 1
+        return recordings[index]
+
+    def lookup(self, request: httpx.Request):
+        """(recording, how it was found) of the request, a synthesized or missing response has no recording"""
+        body = _body(request)
+        key, fallback = exact_key(request.url.path, body), fallback_key(request.url.path, body)
+        with self._lock:
+            if key in self._exact:
+                found = self._next(key, self._exact[key]), "replayed"
+            elif request.url.path.endswith("/embeddings"):
+                found = self._synthesize_embeddings(body), "synthesized"
+            elif fallback in self._fallback:
+                found = self._next(fallback, self._fallback[fallback]), "fallback"
+            else:
+                found = None, "missing"
+            self.stats[found[1]] += 1
+        return found
+
+    def _synthesize_embeddings(self, body):
+        inputs = body.get("input")
+        inputs = [inputs] if isinstance(inputs, str) or (inputs and isinstance(inputs[0], int)) else inputs or []
+        dim = self._embedding_dim.get(body.get("model"), REPLAY_EMBEDDING_DIM)
+        data = []
+        for index, text in enumerate(inputs):
+            rng = random.Random(hashlib.sha256(json.dumps(text).encode("utf-8")).digest()) # same text, same vector
+            vector = [rng.gauss(0, 1) for _ in range(dim)]
+            norm = math.sqrt(sum(value * value for value in vector))
+            data.append({"object": "embedding", "index": index, "embedding": [value / norm for value in vector]})
+        return {"status": 200, "headers": {"content-type": "application/json"}, "seconds": 0.0,
+                "body": json.dumps({"object": "list", "model": body.get("model"), "data": data,
+                                    "usage": {"prompt_tokens": 0, "total_tokens": 0}})}
+
+    def delay(self, recording):
+        """Seconds before the replayed response starts"""
+        if self.latency == "recorded":
+            return recording.get("seconds", 0.0) if recording else 0.0
+        return float(self.latency or 0)
+
+    def events(self, recording):
+        """Body of the recording in parts: the events of a stream, the whole body otherwise"""
+        body = recording["body"]
+        if "text/event-stream" not in recording["headers"].get("content-type", ""):
+            return [body.encode("utf-8")]
+        return [(event + "\n\n").encode("utf-8") for event in body.split("\n\n") if event.strip()]
+
+    def response(self, request: httpx.Request, recording, content):
+        if recording is None:
+            return httpx.Response(404, request=request, json={"error": {
+                "message": f"No recorded LLM exchange for {request.url.path} in {self.path}", "type": "replay_miss"}})
+        return httpx.Response(recording["status"], headers=recording["headers"], content=content, request=request)
+
+    def info(self):
+        with self._lock:
+            return {"mode": self.mode, "path": self.path, "latency": self.latency, "chunk_delay": self.chunk_delay,
+                    "recordings": sum(len(r) for r in self._exact.values()), **self.stats}
+
+
+class ReplayTransport(httpx.BaseTransport):
+    """httpx transport of the sync OpenAI clients that records the exchanges of `transport` or replays them"""
+    def __init__(self, store: ReplayStore, transport: httpx.BaseTransport = None):
+        self.store = store
+        self.transport = transport
+
+    def handle_request(self, request):
+        if self.store.mode == "record":
+            started = time.perf_counter()
+            response = self.transport.handle_request(request)
+            def content(): # chunks are passed on as they arrive, the exchange is recorded once the stream is complete
+                chunks, first = [], None
+                try:
+                    for chunk in response.iter_bytes():
+                        if first is None:
+                            first = time.perf_counter() - started
+                        chunks.append(chunk)
+                        yield chunk
+                finally:
+                    response.close()
+                # not reached when the stream fails or is closed before its end, a partial body is not recorded
+                self.store.record(request, response, b"".join(chunks), time.perf_counter() - started if first is None else first)
+            return httpx.Response(response.status_code, headers=_headers(response), content=content(), request=request)
+        recording, _ = self.store.lookup(request)
+        time.sleep(self.store.delay(recording))
+        if recording is None:
+            return self.store.response(request, None, None)
+        events, delay = self.store.events(recording), self.store.chunk_delay
+        def content():
+            for i, event in enumerate(events):
+                if i and delay:
+                    time.sleep(delay)
+                yield event
+        return self.store.response(request, recording, content())
+
+    def close(self):
+        if self.transport is not None:
+            self.transport.close()
+
+
+class AsyncReplayTransport(httpx.AsyncBaseTransport):
+    """ReplayTransport of the async OpenAI clients, waits without blocking the event loop"""
+    def __init__(self, store: ReplayStore, transport: httpx.AsyncBaseTransport = None):
+        self.store = store
+        self.transport = transport
+
+    async def handle_async_request(self, request):
+        if self.store.mode == "record":
+            started = time.perf_counter()
+            response = await self.transport.handle_async_request(request)
+            async def content():
+                chunks, first = [], None
+                try:
+                    async for chunk in response.aiter_bytes():
+                        if first is None:
+                            first = time.perf_counter() - started
+                        chunks.append(chunk)
+                        yield chunk
+                finally:
+                    await response.aclose()
+                await asyncio.to_thread(self.store.record, request, response, b"".join(chunks),
+                                        time.perf_counter() - started if first is None else first)
+            return httpx.Response(response.status_code, headers=_headers(response), content=content(), request=request)
+        recording, _ = self.store.lookup(request)
+        await asyncio.sleep(self.store.delay(recording))
+        if recording is None:
+            return self.store.response(request, None, None)
+        events, delay = self.store.events(recording), self.store.chunk_delay
+        async def content():
+            for i, event in enumerate(events):
+                if i and delay:
+                    await asyncio.sleep(delay)
+                yield event
+        return self.store.response(request, recording, content())
+
+    async def aclose(self):
+        if self.transport is not None:
+            await self.transport.aclose()
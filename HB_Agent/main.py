@@ -1,12 +1,17 @@
-from fastapi import FastAPI, HTTPException, UploadFile, File
+import time
+_import_started = time.perf_counter() # cold start is measured from the first import of the agent
+from fastapi import FastAPI, HTTPException, UploadFile, File, Request, Depends
 from fastapi.responses import StreamingResponse, JSONResponse
 from pydantic import BaseModel
 from langgraph.prebuilt import create_react_agent
-from agents import AgentBuilder, OpenAIAgent
+from agents import LazyAgentBuilder, OpenAIAgent, response_cache
 from langchain_core.messages import SystemMessage,  HumanMessage, AIMessage,ToolMessage
 from langchain_openai import ChatOpenAI
 from langchain_core.tools import tool
-from config import OPENAI_API_KEY
+import config
+from llm_clients import http_client, http_async_client, replay_store
+import request_timing
+from request_timing import timed
 import uvicorn
 from pydantic import BaseModel
 import json
@@ -15,34 +20,83 @@ from datetime import datetime
 from fastapi.responses import JSONResponse
 import shutil
 from typing import List
-from memory import PDFProcessor,ChromaMemory
+from memory import PDFProcessor, get_memory, embedding_cache, retrieval_stats, SEMANTIC_RETRIEVAL_MODE
+from core import save_checkpoint, load_checkpoint, Session, SessionStore, load_template, IngestionJob, IngestionQueue, HistoryManager, count_tokens
 import logging
+import asyncio
+import contextvars
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from event_data_generation.run_full_pipeline_modular import run_pipeline_from_vars
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 app = FastAPI()
+# Cold start timings in seconds, reported on /metrics/cold-start and in the log
+cold_start = {"imports_seconds": time.perf_counter() - _import_started, "supervisor_seconds": {}, "bootstrap_seconds": {}}
+_startup_build = None # task building the session of a single-user container
 def load_prompt_from_file(file_path: str):
-    """Loads the contents of a text file."""
-    if not os.path.exists(file_path):
-        raise FileNotFoundError(f"The file {file_path} does not exist.")
-    with open(file_path, 'r') as file:
-        return file.read().strip()
+    """Loads the contents of a text file (cached for the process)."""
+    return load_template(file_path)
+
+SEMANTIC_BOOTSTRAP = [ # general knowledge collection -> semantic collection of the user
+    ("general_environmental", "environmental_expert_sem_{username}"),
+    ("general_event", "event_expert_sem_{username}"),
+    ("general_analytical", "analytical_expert_sem_{username}")
+]
+bootstrap_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="bootstrap")
+REFLECTION_CONCURRENCY = int(os.getenv("REFLECTION_CONCURRENCY", 4)) # reflections (LLM calls) of the memory updates running at once
+reflection_limit = asyncio.Semaphore(REFLECTION_CONCURRENCY)
+ingestion_queue = IngestionQueue() # PDF uploads are embedded in the background, not inside the request
+INGEST_HEARTBEAT = 15.0 # seconds without progress after which the event stream sends a heartbeat line
+_bootstrapping = set() # users whose semantic memories are being copied
+_bootstrap_lock = threading.Lock()
+
+def semantic_marker(username):
+    """Define user-specific marker path inside the persisted Chroma volume"""
+    return f"/chroma_db/markers/semantic_initialized_{username}.txt"
+
+def bootstrap_semantic_memory(username):
+    """Copy the general knowledge into the semantic collections of a new user"""
+    marker_file = semantic_marker(username)
+    started = time.perf_counter()
+    memory = get_memory()
+    # Copy general knowledge entries for each agent. Ensure that you use the correct collection name, and store in Data folder. 
+    for general_name, user_collection in SEMANTIC_BOOTSTRAP:
+        # documents and stored embeddings are copied as they are, nothing is embedded again
+        memory.copy_collection(general_name, user_collection.format(username=username))
+    # Create the persistent marker file
+    with open(marker_file, "w") as f:
+        f.write("Initialized")
+    cold_start["bootstrap_seconds"][username] = time.perf_counter() - started
+    logging.info(f"Initialized the semantic memories of {username} in {cold_start['bootstrap_seconds'][username]:.1f} s")  # Log message for Docker container
+
+def start_semantic_bootstrap(username):
+    """Run the semantic memory bootstrap of a new user in the background, the supervisor is usable while it runs
+    (the experts see the general knowledge once it is copied)"""
+    os.makedirs("/chroma_db/markers", exist_ok=True) # Ensure the marker directory exists inside the persisted Chroma volume
+    if os.path.exists(semantic_marker(username)):
+        logging.info("Semantic memories already initialized")  # Log message for Docker container
+        return
+    with _bootstrap_lock:
+        if username in _bootstrapping:
+            return
+        _bootstrapping.add(username)
+
+    def done(future):
+        _bootstrapping.discard(username)
+        if future.exception() is not None:
+            logging.error(f"Semantic memory bootstrap of {username} failed: {future.exception()}")
+    # copied context: the embeddings use the key of the session that started the bootstrap
+    bootstrap_executor.submit(contextvars.copy_context().run, bootstrap_semantic_memory, username).add_done_callback(done)
 
 def create_supervisor(username):
     """Creates a multi-agent architecture with supervisor architecture, initializes three different 
     experts. An event, analytical and environemental expert for the definition of health behavior
     personas. These variables are subsequently used by the supervisor to start data generation based
-    on a SMT-solver."""
-
-    # Ensure the marker directory exists inside the persisted Chroma volume
-    os.makedirs("/chroma_db/markers", exist_ok=True)
-
-    # Define user-specific marker path
-    marker_file = f"/chroma_db/markers/semantic_initialized_{username}.txt"
-
-    environmental_expert = AgentBuilder(
+    on a SMT-solver. The experts are built on their first tool call."""
+    environmental_expert = LazyAgentBuilder(
         system_prompt_file="Set_up/Templates/SM_environmental_agent.txt",
         episodic_prompt_file="Set_up/Templates/Episodic_prompt.txt",
         semantic_prompt_file="Set_up/Templates/Semantic_prompt.txt",
@@ -50,10 +104,10 @@ def create_supervisor(username):
         episodic_collection=f"environmental_expert_eps_{username}",  
         semantic_collection=f"environmental_expert_sem_{username}",  
         episodic_number=3, semantic_number=3,
-        agent=OpenAIAgent(), agent_name="environmental_expert"
+        agent_factory=OpenAIAgent, agent_name="environmental_expert"
     )
 
-    event_expert = AgentBuilder(
+    event_expert = LazyAgentBuilder(
         system_prompt_file="Set_up/Templates/SM_event_agent.txt",
         episodic_prompt_file="Set_up/Templates/Episodic_prompt.txt",
         semantic_prompt_file="Set_up/Templates/Semantic_prompt.txt",
@@ -61,10 +115,10 @@ def create_supervisor(username):
         episodic_collection=f"event_expert_eps_{username}",  
         semantic_collection=f"event_expert_sem_{username}",  
         episodic_number=3, semantic_number=3,
-        agent=OpenAIAgent(), agent_name="event_expert"
+        agent_factory=OpenAIAgent, agent_name="event_expert"
     )
 
-    analytical_expert = AgentBuilder(
+    analytical_expert = LazyAgentBuilder(
         system_prompt_file="Set_up/Templates/SM_analyst_agent.txt",
         episodic_prompt_file="Set_up/Templates/Episodic_prompt.txt",
         semantic_prompt_file="Set_up/Templates/Semantic_prompt.txt",
@@ -72,52 +126,30 @@ def create_supervisor(username):
         episodic_collection=f"analytical_expert_eps_{username}",  
         semantic_collection=f"analytical_expert_sem_{username}",  
         episodic_number=3, semantic_number=3,
-        agent=OpenAIAgent(), agent_name="analytical_expert"
+        agent_factory=OpenAIAgent, agent_name="analytical_expert"
     )
 
-    # Check if the general knowledge has already been copied
-    if not os.path.exists(marker_file):
-        memory = ChromaMemory()
-
-        # Copy general knowledge entries for each agent. Ensure that you use the correct collection name, and store in Data folder. 
-        for collection_type, general_name, user_collection in [
-            ("environmental", "general_environmental", f"environmental_expert_sem_{username}"),
-            ("event", "general_event", f"event_expert_sem_{username}"),
-            ("analytical", "general_analytical", f"analytical_expert_sem_{username}")
-        ]:
-            try:
-                entries = memory.search(query="*", collection_name=general_name, top_k=1000)
-                if entries is None:
-                    entries = []
-            except Exception:
-                entries = []  # If collection does not exist or is empty, just skip
-            for entry in entries:
-                memory.add_entry(entry, collection_name=user_collection) # add the general knowledge from the semantic memories to each user memory
-        # Create the persistent marker file
-        with open(marker_file, "w") as f:
-            f.write("Initialized")
-            logging.info("Initialized the semantic memories")  # Log message for Docker container
-    logging.info("Semantic memories already initialized")  # Log message for Docker container
+    start_semantic_bootstrap(username) # copy the general knowledge in the background
 
 
     @tool
-    def environmental_expert_tool(query: str):
+    async def environmental_expert_tool(query: str):
         """Use this tool to extract and structure environmental constants for simulation participants, 
         such as persona features (e.g., age group, gender distribution, education level), sample size, 
         start date, simulation horizon, and available day parts."""
-        return f"{environmental_expert.run(query)}"
+        return f"{await environmental_expert.arun(query)}" # awaited, the graph runs parallel expert calls concurrently
 
     @tool
-    def event_expert_tool(query: str):
+    async def event_expert_tool(query: str):
         """Use this tool to define and structure behavioral events for the simulation, including event metadata, characteristics, 
         constraints, and temporal patterns. Use this when event-related details are needed or incomplete."""
-        return f"{event_expert.run(query)}"
+        return f"{await event_expert.arun(query)}"
 
     @tool
-    def analytical_expert_tool(query: str):
+    async def analytical_expert_tool(query: str):
         """Use this tool to analyze temporal relationships between events. It returns logical constraints and dependencies
         between events in Linear Temporal Logic (LTL) format."""
-        return f"{analytical_expert.run(query)}"
+        return f"{await analytical_expert.arun(query)}"
 
     @tool
     def run_data_generation(constant_persona_features: dict, eventironmental_data: list, ltl_expressions: list):
@@ -132,7 +164,8 @@ def create_supervisor(username):
             eventironmental_data,
             ltl_expressions)
     # Instigate llm for supervisor
-    llm = ChatOpenAI(streaming=True, api_key=OPENAI_API_KEY, model="gpt-4.1", temperature=0.2)  
+    llm = ChatOpenAI(streaming=True, api_key=config.get_api_key(), model="gpt-4.1", temperature=0.2,
+                     http_client=http_client, http_async_client=http_async_client)  # connection pool shared by all sessions
     # Create tools mapping to create connection between supervisor and experts
     tools = [environmental_expert_tool, event_expert_tool, analytical_expert_tool, run_data_generation]
     # expert prompt supervisor
@@ -177,29 +210,184 @@ def format_conversation(messages):
 
 
 
+def conversation_state(session):
+    """Conversation state that is not stored in Chroma: the supervisor history and the messages of each expert"""
+    return {
+        "conversation_history": session.conversation_history,
+        "history_summary": session.history.state(),
+        "supervisor_messages": session.supervisor.memory_handler.messages,
+        "experts": {name: getattr(session.supervisor, name).messages
+                    for name in ("environmental_expert", "event_expert", "analytical_expert")}
+    }
+
+def restore_conversation(session):
+    """Restore the checkpoint written before the container was stopped or the session was evicted"""
+    state = load_checkpoint(session.username)
+    if state is None:
+        return
+    session.conversation_history = state.get("conversation_history", [])
+    session.history.restore(state.get("history_summary", {}))
+    session.supervisor.memory_handler.messages = state.get("supervisor_messages", [])
+    for name, messages in state.get("experts", {}).items():
+        getattr(session.supervisor, name).messages = messages # kept until the expert is built
+    logging.info(f"Restored conversation of {session.username} with {len(session.conversation_history)} messages")
+
+def build_session(username, api_key):
+    """Create the supervisor of a user with the key of the user, runs in a worker thread"""
+    config.use_session(username, api_key)
+    started = time.perf_counter()
+    session = Session(username, api_key, create_supervisor(username))
+    session.history = HistoryManager(session.supervisor.memory_handler.agent)
+    cold_start["supervisor_seconds"][username] = time.perf_counter() - started
+    restore_conversation(session)
+    logging.info(f"Supervisor initialized for {username}")
+    return session
+
+def checkpoint_session(session):
+    """Evicted sessions are stored and restored on the next request of the user"""
+    save_checkpoint(session.username, conversation_state(session))
+
+# Sessions of the users served by this process: only the user of the container, or many in multi-tenant mode
+sessions = SessionStore(build_session, maxsize=config.AGENT_MAX_SESSIONS if config.AGENT_MULTI_TENANT else 1,
+                        on_evict=checkpoint_session)
+
 @app.on_event("startup")  # initialize supervisor once on start-up to ensure that the message history is kept for the tools (episodic)
-def startup_event(): 
-    global supervisor, conversation_history
-    conversation_history = []  # global conversation history
+async def startup_event(): 
+    global _startup_build
+    cold_start["startup_started_seconds"] = time.perf_counter() - _import_started
+    if config.AGENT_MULTI_TENANT: # sessions are created on the first request of each user
+        print(f"Multi-tenant agent started, up to {config.AGENT_MAX_SESSIONS} sessions")
+        return
+    if os.getenv("AGENT_POOL_MODE") == "1": # pre-started container of the gateway warm pool, the user is set trough /bind
+        print("Pooled agent started, waiting for a user")
+        return
     username = os.getenv("USERNAME", "default_user")  # Get the username from the environment variable
-    supervisor = create_supervisor(username)  # Pass the username to create_supervisor
-    print("Supervisor initialized")
+    # built in the background, uvicorn reports the start-up directly and /health answers once the supervisor is ready
+    _startup_build = asyncio.ensure_future(sessions.get_or_create(username, config.OPENAI_API_KEY))
+
+    def ready(task):
+        if task.cancelled():
+            return
+        if task.exception() is not None:
+            logging.error(f"Initializing the supervisor failed: {task.exception()}")
+            return
+        cold_start["ready_seconds"] = time.perf_counter() - _import_started
+        logging.info(f"Supervisor initialized, cold start {cold_start['ready_seconds']:.1f} s "
+                     f"(imports {cold_start['imports_seconds']:.1f} s, supervisor {cold_start['supervisor_seconds'][username]:.1f} s)")
+    _startup_build.add_done_callback(ready)
+
+@app.get("/health") # polled by the gateway container manager, only answers once the supervisor is initialized
+def health():
+    if config.AGENT_MULTI_TENANT:
+        return {"status": "ok", "multi_tenant": True, **sessions.stats()}
+    session = sessions.single()
+    if session is None and _startup_build is not None:
+        if _startup_build.done() and not _startup_build.cancelled() and _startup_build.exception() is not None:
+            # the supervisor will not become ready, the container manager stops waiting and reports the error
+            return JSONResponse(status_code=500, content={"status": "failed", "error": str(_startup_build.exception())})
+        return JSONResponse(status_code=503, content={"status": "starting"})
+    return {"status": "ok", "bound": session is not None, "username": session.username if session else None}
+
+@app.get("/metrics/cold-start")
+def cold_start_metrics():
+    """Seconds from the first import until: imports done, start-up event, supervisor ready (single user).
+    Per user the supervisor build and the background semantic bootstrap, per expert the lazy build"""
+    experts = {}
+    for session in sessions._sessions.values():
+        experts[session.username] = {name: getattr(session.supervisor, name).build_seconds
+                                     for name in ("environmental_expert", "event_expert", "analytical_expert")}
+    return {**cold_start, "expert_build_seconds": experts}
+
+class BindRequest(BaseModel):
+    username: str
+    openai_key: str
+
+@app.post("/bind")
+async def bind(request: BindRequest):
+    """Bind a pre-started (pooled) container to a user, creates the supervisor with the user key and collections"""
+    if config.AGENT_MULTI_TENANT:
+        raise HTTPException(status_code=400, detail="A multi-tenant agent is not bound to one user")
+    if len(sessions):
+        if sessions.get(request.username) is not None:
+            return {"status": "success", "username": request.username} # already bound to this user
+        raise HTTPException(status_code=409, detail="Agent is already bound to another user")
+    config.bind_user(request.username, request.openai_key)
+    await sessions.get_or_create(request.username, request.openai_key) # off the event loop, health checks keep answering
+    return {"status": "success", "username": request.username}
+
+async def get_session(request: Request):
+    """Session of the request: in multi-tenant mode the user of the X-Username header, created on first use with
+    the key of the X-OpenAI-Key header, otherwise the user of this container"""
+    if config.AGENT_MULTI_TENANT:
+        username = request.headers.get("X-Username")
+        if not username:
+            raise HTTPException(status_code=400, detail="X-Username header is required by a multi-tenant agent")
+        session = await sessions.get_or_create(username, request.headers.get("X-OpenAI-Key"))
+    else:
+        session = sessions.single()
+        if session is None and _startup_build is not None:
+            session = await asyncio.shield(_startup_build) # first request during the background start-up
+        if session is None: # pooled containers only answer user requests once they are bound
+            raise HTTPException(status_code=503, detail="Agent is not bound to a user yet")
+    config.use_session(session.username, session.api_key) # key and user for the memories and tools of this request
+    return session
+
+@app.post("/checkpoint")
+def checkpoint(session: Session = Depends(get_session)):
+    """Store the conversation state on the volume, called by the gateway before an idle agent is stopped"""
+    path = save_checkpoint(session.username, conversation_state(session))
+    return {"status": "success", "path": path, "messages": len(session.conversation_history)}
+
+@app.post("/sessions/{username}/close")
+def close_session(username: str):
+    """Drop the session of a user that logged out (multi-tenant mode)"""
+    return {"status": "success", "closed": sessions.remove(username) is not None}
+
+@app.get("/metrics/request-timings")
+def request_timing_metrics():
+    """Stage breakdown (seconds and calls) of the most recent requests, e.g. how often Chroma is opened per turn"""
+    return {"recent": list(request_timing.recent)}
+
+@app.get("/metrics/embedding-cache")
+def embedding_cache_metrics():
+    """Hits and misses of the query embedding cache"""
+    return embedding_cache.stats()
+
+@app.get("/metrics/llm-cache")
+def llm_cache_metrics():
+    """Hits and misses of the response cache of the experts and reflections"""
+    return response_cache.stats()
+
+@app.get("/metrics/llm-replay")
+def llm_replay_metrics():
+    """Recorded or replayed OpenAI exchanges (LLM_REPLAY_MODE), replays without exact recording are counted apart"""
+    return replay_store.info() if replay_store else {"mode": "off"}
+
+@app.get("/metrics/retrieval")
+def retrieval_metrics():
+    """Memory searches per retriever, lexical searches were answered without embedding the query"""
+    return {"semantic_mode": SEMANTIC_RETRIEVAL_MODE, **retrieval_stats}
 
 class QueryRequest(BaseModel):
     query: str
 
 
 @app.post("/supervisor/ask")
-async def ask_supervisor(query: QueryRequest):
-    global supervisor, conversation_history
+async def ask_supervisor(query: QueryRequest, session: Session = Depends(get_session)):
+    supervisor, conversation_history = session.supervisor, session.conversation_history
+    timing = request_timing.start("ask", session.username)
     try:
-        formatted_history = format_conversation(conversation_history) # without system message
+        summary, window = await session.history.acompact(conversation_history) # older messages as a summary
+        formatted_history = format_conversation(window) # without system message
+        if summary:
+            formatted_history = f"Summary of the earlier conversation:\n{summary}\n\nMost recent messages:\n{formatted_history}"
         # Get relevant episodic memory chunks for this query
-        episodic_prompt = supervisor.memory_handler.prompt_manager.get_episodic_prompt(
-            query.query,
-            supervisor.memory_handler.collection_episodic,
-            supervisor.memory_handler.top_k_episodic
-        )
+        with timed("supervisor.episodic_prompt"):
+            episodic_prompt = await supervisor.memory_handler.prompt_manager.aget_episodic_prompt(
+                query.query,
+                supervisor.memory_handler.collection_episodic,
+                supervisor.memory_handler.top_k_episodic
+            )
         conversation_history.append({"role": "user", "content": query.query}) # append user message for future
         conversation_history_prompt = (
             "You are a helpful supervisor who manages expert agents.\n\n"
@@ -209,26 +397,34 @@ async def ask_supervisor(query: QueryRequest):
             
         )
         final_prompt = {"messages": [("user", conversation_history_prompt)]} # final prompt combined all the information
+        prompt_tokens = count_tokens(conversation_history_prompt)
+        request_timing.count("prompt_tokens.supervisor", prompt_tokens)
 
         async def stream_openai(query_input):
+            config.use_session(session.username, session.api_key)
             assistant_response = ""
-            async for item in supervisor.astream(query_input, stream_mode="messages"): # get typewrite stream
-                message_chunk, metadata = item # items that are streamed
-                content = message_chunk.content or ""
-                if len(content.strip()) <= 100: # tool messages are streamed and returned as one final message, stop those to ensure that they are not entered twice
-                    assistant_response += content # add to assistant_response
-                yield json.dumps({
-                    "content": content,
-                    "langgraph_node": metadata.get("langgraph_node"),
-                    "additional_kwargs": message_chunk.additional_kwargs,
-                    "response_metadata": message_chunk.response_metadata,
-                    "id": message_chunk.id
-                }) + "\n"
+            try:
+                with timed("supervisor.stream"): # supervisor LLM and the expert tools it calls
+                    async for item in supervisor.astream(query_input, stream_mode="messages"): # get typewrite stream
+                        message_chunk, metadata = item # items that are streamed
+                        content = message_chunk.content or ""
+                        if len(content.strip()) <= 100: # tool messages are streamed and returned as one final message, stop those to ensure that they are not entered twice
+                            assistant_response += content # add to assistant_response
+                        yield json.dumps({
+                            "content": content,
+                            "langgraph_node": metadata.get("langgraph_node"),
+                            "additional_kwargs": message_chunk.additional_kwargs,
+                            "response_metadata": message_chunk.response_metadata,
+                            "id": message_chunk.id
+                        }) + "\n"
+            finally:
+                request_timing.finish(timing)
             conversation_history.append({
                 "role": "assistant",
                 "content": assistant_response
             }) # add the reponse of the agent to the conversation history
-        return StreamingResponse(stream_openai(final_prompt), media_type="application/json")
+        return StreamingResponse(stream_openai(final_prompt), media_type="application/json",
+                                 headers={"X-Prompt-Tokens": str(prompt_tokens)})
     except Exception as e:
         return JSONResponse(
             status_code=500,
@@ -239,28 +435,71 @@ async def ask_supervisor(query: QueryRequest):
             }
         )
 
+async def reflect(name, handler):
+    """Reflection of one expert (or the supervisor) and its status, the entry is stored by the caller"""
+    started = time.perf_counter()
+    async with reflection_limit:
+        try:
+            entry = await handler.areflect()
+        except Exception as e:
+            logging.error(f"Reflection of {name} failed: {e}")
+            return name, handler, None, {"status": "error", "error": str(e), "seconds": round(time.perf_counter() - started, 3)}
+    status = "skipped" if entry is None else "reflected"
+    return name, handler, entry, {"status": status, "seconds": round(time.perf_counter() - started, 3)}
+
 @app.post("/supervisor/update-memory")
-async def update_memory():
-    global supervisor, conversation_history
+async def update_memory(session: Session = Depends(get_session)):
+    """Reflect on the conversations of the experts and the supervisor at the same time and store the reflections in their
+    episodic memories with one batched write. Returns the status per expert, experts that failed keep their messages."""
+    supervisor, conversation_history = session.supervisor, session.conversation_history
+    timing = request_timing.start("update-memory", session.username)
     try:
-        # Trigger memory update for all experts
-        prompt = "exit"  # Using the existing exit protocol for memory updates
-        supervisor.environmental_expert.run(prompt) # all initialized in create supervisor
-        supervisor.event_expert.run(prompt)
-        supervisor.analytical_expert.run(prompt)
-        # Update supervisor episodic memory as well
+        handlers = {}
+        for name in ("environmental_expert", "event_expert", "analytical_expert"):
+            expert = getattr(supervisor, name)
+            if expert.built or expert.messages: # experts that were never called have nothing to reflect on
+                # restored messages of an expert that is not built yet: build it off the event loop
+                handlers[name] = expert.conversation_handler if expert.built else await asyncio.to_thread(getattr, expert, "conversation_handler")
         if conversation_history:
-            supervisor.memory_handler.messages.extend(conversation_history)
-            supervisor.memory_handler.run_conversation(prompt)
-            conversation_history.clear()
+            supervisor.memory_handler.messages = list(conversation_history) # supervisor episodic memory as well
+            handlers["supervisor"] = supervisor.memory_handler
+        results = await asyncio.gather(*(reflect(name, handler) for name, handler in handlers.items()))
+        experts = {name: result for name, _, _, result in results}
+
+        reflected = [(name, handler, entry) for name, handler, entry, result in results if result["status"] == "reflected"]
+        if reflected:
+            try:
+                items = [(handler.collection_episodic, entry) for _, handler, entry in reflected]
+                await asyncio.to_thread(get_memory().add_entries_to_collections, items) # one embeddings request for all reflections
+                for name, handler, _ in reflected:
+                    handler.messages = [] # Clear messages after storing in episodic memory
+                    handler.history.reset()
+                    experts[name]["status"] = "success"
+                if any(name == "supervisor" for name, _, _ in reflected):
+                    conversation_history.clear()
+                    session.history.reset()
+            except Exception as e:
+                for name, _, _ in reflected:
+                    experts[name].update(status="error", error=f"Storing the reflection failed: {e}")
+
+        failed = [name for name, result in experts.items() if result["status"] == "error"]
+        if failed:
+            status, message = "partial", f"Memory update failed for: {', '.join(failed)}"
+        elif not reflected:
+            status, message = "warning", "No conversation to store, please interact with the agent first"
+        else:
+            status, message = "success", "Memory updated successfully"
         return JSONResponse(
             content={
-                "status": "success",
-                "message": "Memory updated successfully",
-                "timestamp": datetime.now().isoformat()
+                "status": status,
+                "message": message,
+                "timestamp": datetime.now().isoformat(),
+                "experts": experts,
+                "timings": request_timing.finish(timing)
             }
         )
     except Exception as e:
+        request_timing.finish(timing)
         return JSONResponse(
             status_code=500,
             content={
@@ -271,37 +510,86 @@ async def update_memory():
         )
 
 @app.post("/process-pdf/{expert_name}")
-async def process_pdf(expert_name: str, files: List[UploadFile] = File(...)):
+async def process_pdf(expert_name: str, files: List[UploadFile] = File(...), session: Session = Depends(get_session)):
+    """Store the uploads and queue their ingestion, answers with the job id right away. The progress is streamed
+    by /process-pdf/jobs/{job_id}/events."""
+    username = session.username
+    # Map expert names to their semantic collection names
+    collection_mapping = {
+        "environmental_expert": f"environmental_expert_sem_{username}",
+        "event_expert": f"event_expert_sem_{username}",
+        "analytical_expert": f"analytical_expert_sem_{username}"
+    }
+    if expert_name not in collection_mapping: # for future use if someone changes experts but forgets to adjust here
+        raise HTTPException(status_code=400, detail=f"Invalid expert name. Must be one of: {list(collection_mapping.keys())}")
     try:
-        username = os.getenv("USERNAME", "default_user")  # Get the username from the environment variable
-        # Map expert names to their semantic collection names
-        collection_mapping = {
-            "environmental_expert": f"environmental_expert_sem_{username}",
-            "event_expert": f"event_expert_sem_{username}",
-            "analytical_expert": f"analytical_expert_sem_{username}"
-        }
-        if expert_name not in collection_mapping: # for future use if someone changes experts but forgets to adjust here
-            raise HTTPException(status_code=400, detail=f"Invalid expert name. Must be one of: {list(collection_mapping.keys())}")
-        
         semantic_collection = collection_mapping[expert_name] # get user specific collection
-        pdf_dir = os.path.join("Set_up", "Semantic_memory", expert_name) # Make pdf dir for temporary storage
+        job = IngestionJob(username, expert_name, semantic_collection, [file.filename for file in files])
+        pdf_dir = os.path.join("Set_up", "Semantic_memory", expert_name, job.id) # temporary storage of this upload
         os.makedirs(pdf_dir, exist_ok=True)
         for file in files:         # Save uploaded files
-            file_path = os.path.join(pdf_dir, file.filename)
+            file_path = os.path.join(pdf_dir, os.path.basename(file.filename))
             with open(file_path, "wb") as f:
                 shutil.copyfileobj(file.file, f)
-        pdf_processor = PDFProcessor(pdf_dir, semantic_collection) # process all the pdfs in the directory
-        pdf_processor.process_pdf_to_chunks()
-        for file in os.listdir(pdf_dir):
-            os.remove(os.path.join(pdf_dir, file)) # clean up the directory afterwards
-        os.rmdir(pdf_dir) # remove directory
+
+        def run(job):
+            timing = request_timing.start("process-pdf", username)
+            try:
+                pdf_processor = PDFProcessor(pdf_dir, semantic_collection, progress=job.add_event) # process all the pdfs in the directory
+                summary = pdf_processor.process_pdf_to_chunks()
+                return {**summary, "timings": request_timing.finish(timing)}
+            finally:
+                shutil.rmtree(pdf_dir, ignore_errors=True) # clean up the directory afterwards
+
+        ingestion_queue.submit(job, run) # the job keeps the session key of this request
         return JSONResponse(
+            status_code=202,
             content={
-                "status": "success",
-                "message": f"PDFs processed and added to {semantic_collection} successfully",
-                "timestamp": datetime.now().isoformat()
+                "status": "queued",
+                "message": f"PDFs queued for {semantic_collection}",
+                "timestamp": datetime.now().isoformat(),
+                "job_id": job.id
             }
         )
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"PDF processing failed: {str(e)}")
 
+def get_job(job_id: str, session: Session):
+    job = ingestion_queue.get(job_id)
+    if job is None or job.username != session.username:
+        raise HTTPException(status_code=404, detail="Unknown ingestion job")
+    return job
+
+@app.get("/process-pdf/jobs/{job_id}")
+def ingestion_job(job_id: str, session: Session = Depends(get_session)):
+    """Status and summary of an ingestion job"""
+    return get_job(job_id, session).info()
+
+@app.get("/process-pdf/jobs/{job_id}/events")
+async def ingestion_job_events(job_id: str, session: Session = Depends(get_session)):
+    """Progress events of an ingestion job as JSON lines until the job is done or failed, from the first event on
+    so a client can reconnect. A heartbeat line is sent while nothing happens, proxies keep the stream open."""
+    job = get_job(job_id, session)
+
+    async def stream_events():
+        index, last_sent = 0, time.monotonic()
+        while True:
+            events = job.events_since(index)
+            for event in events:
+                yield json.dumps(event) + "\n"
+            index += len(events)
+            if events:
+                last_sent = time.monotonic()
+            elif job.finished:
+                return
+            elif time.monotonic() - last_sent >= INGEST_HEARTBEAT:
+                yield json.dumps({"event": "heartbeat", "job_id": job.id, "status": job.status}) + "\n"
+                last_sent = time.monotonic()
+            await asyncio.sleep(0.2)
+    return StreamingResponse(stream_events(), media_type="application/json")
+
+@app.get("/metrics/ingestion")
+def ingestion_metrics():
+    """Number of ingestion jobs per status"""
+    return ingestion_queue.stats()
+
@@ -1,4 +1,6 @@
-from .chroma_memory import ChromaMemory
+from .chroma_memory import ChromaMemory, get_memory, retrieval_stats, SEMANTIC_RETRIEVAL_MODE
 from .pdf_processor import PDFProcessor
+from .embedding_cache import embedding_cache
+from .embedding_backends import HashingEmbeddings, register_backend
 
-__all__ = ["ChromaMemory", "PDFProcessor"]
\ No newline at end of file
+__all__ = ["ChromaMemory", "get_memory", "retrieval_stats", "SEMANTIC_RETRIEVAL_MODE", "PDFProcessor", "embedding_cache", "HashingEmbeddings", "register_backend"]
\ No newline at end of file
@@ -1,40 +1,273 @@
+import asyncio
 import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+import chromadb
 from langchain_chroma import Chroma
-from langchain_ollama import OllamaEmbeddings
 from langchain.schema import Document
-from langchain_openai import OpenAIEmbeddings
-from config import OPENAI_API_KEY
+import config
+from request_timing import timed
+from .embedding_cache import CachedEmbeddings, embedding_cache
+from .embedding_backends import EMBEDDING_BACKEND, backend_info
+from .lexical_index import BM25Index, reciprocal_rank_fusion
+
+# vectors of different backends do not mix, a local backend gets its own database next to the OpenAI one
+DB_PATH = os.getenv("CHROMA_DB_PATH", "/chroma_db/Data" if EMBEDDING_BACKEND == "openai" else f"/chroma_db/Data_{EMBEDDING_BACKEND}")
+CHROMA_MAX_HANDLES = int(os.getenv("CHROMA_MAX_HANDLES", 256)) # open collection handles kept per ChromaMemory
+# vector: Chroma similarity only, hybrid: BM25 and vector results fused, lexical_first: BM25 only when it covers the query
+SEMANTIC_RETRIEVAL_MODE = os.getenv("SEMANTIC_RETRIEVAL_MODE", "hybrid")
+LEXICAL_MIN_COVERAGE = float(os.getenv("LEXICAL_MIN_COVERAGE", 0.8)) # fraction of query terms the BM25 hits must contain to skip the embedding
+HYBRID_CANDIDATES = 4 # results per retriever that are fused, times top_k
+
+_chroma_clients = {} # db_path -> chromadb client, shared by all sessions of the process
+_embeddings = {} # (backend, OpenAI key) -> embeddings client with the shared query cache
+_memories = {} # (db_path, OpenAI key) -> ChromaMemory
+_manifests = {} # db_path -> sqlite connection of the files ingested into its collections
+_clients_lock = threading.RLock()
+_manifest_lock = threading.Lock()
+retrieval_stats = {"vector": 0, "lexical": 0, "hybrid": 0} # searches answered per retriever, lexical ones needed no embedding
+
+
+def _manifest(db_path: str):
+    """Connection to the list of completely ingested files (sqlite next to the Chroma data, shared by the agents on
+    the volume), used under _manifest_lock"""
+    with _clients_lock:
+        if db_path not in _manifests:
+            os.makedirs(db_path, exist_ok=True)
+            db = sqlite3.connect(os.path.join(db_path, "ingested_files.sqlite"), check_same_thread=False)
+            db.execute("CREATE TABLE IF NOT EXISTS ingested_files (collection TEXT, file_hash TEXT, source TEXT, "
+                       "chunks INTEGER, ingested_at REAL, PRIMARY KEY (collection, file_hash))")
+            db.commit()
+            _manifests[db_path] = db
+        return _manifests[db_path]
+
+def _count_retrieval(retriever: str):
+    with _clients_lock:
+        retrieval_stats[retriever] += 1
+
+def get_chroma_client(db_path: str):
+    """Process wide Chroma client of the database path"""
+    with _clients_lock:
+        if db_path not in _chroma_clients:
+            _chroma_clients[db_path] = chromadb.PersistentClient(path=db_path)
+        return _chroma_clients[db_path]
+
+def get_embeddings(api_key: str, backend: str = EMBEDDING_BACKEND):
+    """Embeddings client of the backend (EMBEDDING_BACKEND) and OpenAI key, users with the same key share one
+    client, local backends one client for all. Query embeddings go through the process wide embedding cache."""
+    factory, model, per_key = backend_info(backend)
+    key = (backend, api_key if per_key else None)
+    with _clients_lock:
+        if key not in _embeddings:
+            _embeddings[key] = CachedEmbeddings(factory(api_key), model, embedding_cache)
+        return _embeddings[key]
+
+def get_memory(db_path: str = DB_PATH):
+    """Process wide ChromaMemory of the database for the key of the current session, keeps its collection handles open"""
+    key = (db_path, config.get_api_key())
+    with _clients_lock:
+        if key not in _memories:
+            _memories[key] = ChromaMemory(db_path)
+        return _memories[key]
 
 
 class ChromaMemory:
     """Vector database for semantic memory and episodic memory. Uses similarity search to find the most relevant messages to a quiry"""
-    def __init__(self, db_path: str = "/chroma_db/Data"):
-        """Initialize ChromaDB with LangChain and Ollama embeddings."""
+    def __init__(self, db_path: str = DB_PATH, max_handles: int = CHROMA_MAX_HANDLES):
+        """Initialize ChromaDB with LangChain and the embeddings of the configured backend."""
         self.db_path = db_path
-        self.embedding_function = OpenAIEmbeddings(api_key=OPENAI_API_KEY, model="text-embedding-3-small",) # specify openai model
+        self.embedding_function = get_embeddings(config.get_api_key()) # key of the current session
+        self.max_handles = max_handles
+        self._vectorstores = OrderedDict() # collection name -> Chroma vectorstore, least recently used first
+        self._lexical = {} # collection name -> BM25Index of the documents, for the open collections
+        self._handles_lock = threading.Lock()
+        self._open_lock = threading.Lock()
 
     def _get_vectorstore(self, collection_name: str):
-        """Returns a Chroma vectorstore for the given collection."""
-        return Chroma(persist_directory=self.db_path, embedding_function=self.embedding_function, collection_name=collection_name)
+        """Returns a Chroma vectorstore for the given collection, opened once and kept in an LRU of handles."""
+        with self._handles_lock:
+            vectorstore = self._vectorstores.get(collection_name)
+            if vectorstore is not None:
+                self._vectorstores.move_to_end(collection_name)
+                return vectorstore
+        with self._open_lock: # Chroma fails when two threads create the segments of a new collection at once
+            with self._handles_lock:
+                vectorstore = self._vectorstores.get(collection_name)
+            if vectorstore is None:
+                with timed("chroma.open"):
+                    vectorstore = Chroma(client=get_chroma_client(self.db_path), embedding_function=self.embedding_function, collection_name=collection_name)
+                    vectorstore.get(limit=1, include=[]) # creates the segments of a new collection
+        with self._handles_lock:
+            self._vectorstores[collection_name] = vectorstore
+            self._vectorstores.move_to_end(collection_name)
+            while len(self._vectorstores) > self.max_handles:
+                evicted, _ = self._vectorstores.popitem(last=False)
+                self._lexical.pop(evicted, None)
+        return vectorstore
+
+    def _lexical_index(self, collection_name: str):
+        """BM25 index of the collection, built from the stored documents (no embeddings) when it is first searched
+        and again when the collection was changed by another process or a raw Chroma write"""
+        vectorstore = self._get_vectorstore(collection_name)
+        with self._handles_lock:
+            index = self._lexical.get(collection_name)
+        if index is not None and len(index) == vectorstore._collection.count():
+            return index
+        with timed("lexical.build"):
+            data = vectorstore.get(include=["documents"])
+            index = BM25Index()
+            index.add(data["ids"], data["documents"])
+        with self._handles_lock:
+            self._lexical[collection_name] = index
+        return index
+
+    def _index_added(self, collection_name: str, ids, page_contents):
+        """Keep a built BM25 index up to date with documents added through this instance"""
+        with self._handles_lock:
+            index = self._lexical.get(collection_name)
+        if index is not None:
+            index.add(ids, page_contents)
 
     def add_entry(self, entry: dict, collection_name: str):
         """Stores a message as one entry in ChromaDB."""
         entry_json = json.dumps(entry)  # Convert dictionary to JSON string
         document = Document(page_content=entry_json)  # Store as a single document
         vectorstore = self._get_vectorstore(collection_name)
-        vectorstore.add_documents([document])
+        with timed("chroma.add"):
+            ids = vectorstore.add_documents([document])
+        self._index_added(collection_name, ids, [document.page_content])
         print(f" 1 structured entry stored in collection '{collection_name}' successfully!") # print confirmation
 
-    def search(self, query: str, collection_name: str, top_k: int = 3):
-        """Performs a similarity search and returns the top K most relevant messages, standard 3 ."""
+    def add_entries(self, entries: list, collection_name: str, batch_size: int = 64, ids: list = None, metadatas: list = None):
+        """Stores many messages, each batch is embedded in one request and written with one add_documents call.
+        With ids the entries are upserted, an entry that is stored again replaces the old one."""
         vectorstore = self._get_vectorstore(collection_name)
-        results = vectorstore.similarity_search(query, k=top_k)
+        for start in range(0, len(entries), batch_size):
+            end = start + batch_size
+            documents = [Document(page_content=json.dumps(entry), metadata=metadatas[i] if metadatas else {})
+                         for i, entry in enumerate(entries[start:end], start=start)]
+            with timed("chroma.add"):
+                added = vectorstore.add_documents(documents, ids=ids[start:end] if ids else None)
+            self._index_added(collection_name, added, [document.page_content for document in documents])
+        print(f" {len(entries)} structured entries stored in collection '{collection_name}' successfully!") # print confirmation
+
+    def add_entries_to_collections(self, items: list):
+        """Stores (collection name, entry) pairs of several collections, all entries are embedded in one request and
+        every collection is written with one call."""
+        if not items:
+            return
+        documents = [json.dumps(entry) for _, entry in items]
+        with timed("chroma.embed"):
+            embeddings = self.embedding_function.embed_documents(documents)
+        by_collection = {} # collection name -> (ids, documents, embeddings)
+        for (collection_name, _), document, embedding in zip(items, documents, embeddings):
+            rows = by_collection.setdefault(collection_name, ([], [], []))
+            for values, value in zip(rows, (str(uuid.uuid4()), document, embedding)):
+                values.append(value)
+        for collection_name, (ids, collection_documents, collection_embeddings) in by_collection.items():
+            vectorstore = self._get_vectorstore(collection_name)
+            with timed("chroma.add"):
+                vectorstore._collection.upsert(ids=ids, documents=collection_documents, embeddings=collection_embeddings)
+            self._index_added(collection_name, ids, collection_documents)
+            print(f" {len(ids)} structured entries stored in collection '{collection_name}' successfully!") # print confirmation
+
+    def existing_ids(self, collection_name: str, ids: list):
+        """The ids of the list that are already stored in the collection"""
+        if not ids:
+            return set()
+        vectorstore = self._get_vectorstore(collection_name)
+        with timed("chroma.get"):
+            return set(vectorstore.get(ids=ids, include=[])["ids"])
+
+    def ingested_file(self, collection_name: str, file_hash: str):
+        """{source, chunks} of a file that was ingested into the collection completely before, None otherwise.
+        Kept apart from the chunk metadata: a chunk that another file stored first keeps the hash of that file."""
+        with _manifest_lock:
+            row = _manifest(self.db_path).execute("SELECT source, chunks FROM ingested_files WHERE collection = ? AND file_hash = ?",
+                                                  (collection_name, file_hash)).fetchone()
+        return {"source": row[0], "chunks": row[1]} if row else None
+
+    def mark_ingested(self, collection_name: str, file_hash: str, source: str, chunks: int):
+        """Record that all chunks of the file are stored in the collection"""
+        with _manifest_lock:
+            db = _manifest(self.db_path)
+            db.execute("INSERT OR REPLACE INTO ingested_files VALUES (?, ?, ?, ?, ?)",
+                       (collection_name, file_hash, source, chunks, time.time()))
+            db.commit()
+
+    def search(self, query: str, collection_name: str, top_k: int = 3, mode: str = "vector"):
+        """Performs a similarity search and returns the top K most relevant messages, standard 3 .
+        mode hybrid fuses the BM25 and the vector results with reciprocal-rank fusion, lexical_first returns the
+        top_k BM25 results without embedding the query when they contain LEXICAL_MIN_COVERAGE of the query terms."""
+        vectorstore = self._get_vectorstore(collection_name)
+        if mode == "vector":
+            with timed("chroma.search"):
+                results = [doc.page_content for doc in vectorstore.similarity_search(query, k=top_k)]
+            _count_retrieval("vector")
+        else:
+            candidates = top_k * HYBRID_CANDIDATES
+            with timed("lexical.search"):
+                hits, coverage = self._lexical_index(collection_name).search(query, candidates, coverage_k=top_k) # coverage of the returned hits
+            lexical = [document for _, document, _ in hits]
+            if mode == "lexical_first" and len(lexical) >= top_k and coverage >= LEXICAL_MIN_COVERAGE:
+                results = lexical[:top_k]
+                _count_retrieval("lexical")
+            else:
+                with timed("chroma.search"):
+                    vector = [doc.page_content for doc in vectorstore.similarity_search(query, k=candidates)]
+                results = reciprocal_rank_fusion([lexical, vector])[:top_k] # documents found by both rank first
+                _count_retrieval("hybrid")
         
         if results:
-            return [json.loads(doc.page_content) for doc in results]  # Convert JSON string back to dictionary
+            return [json.loads(page_content) for page_content in results]  # Convert JSON string back to dictionary
         else:
             return None
             
+    async def asearch(self, query: str, collection_name: str, top_k: int = 3, mode: str = "vector"):
+        """search in a worker thread (the Chroma client and the query embedding block), with the context of the caller"""
+        return await asyncio.to_thread(self.search, query, collection_name, top_k, mode)
+
+    def copy_collection(self, source_name: str, target_name: str):
+        """Copies all documents of a collection together with their stored embeddings into another collection,
+        without calling the embeddings API. Upserts with the source ids, so a repeated copy adds no duplicates.
+        Returns the number of copied documents, 0 if the source collection does not exist."""
+        client = get_chroma_client(self.db_path)
+        try:
+            source = client.get_collection(source_name)
+        except Exception:
+            return 0 # no general knowledge for this collection
+        data = source.get(include=["documents", "embeddings", "metadatas"])
+        ids = data["ids"]
+        if not ids:
+            return 0
+        target = client.get_or_create_collection(target_name, metadata=source.metadata) # same distance function
+        batch_size = client.get_max_batch_size()
+        for start in range(0, len(ids), batch_size):
+            batch = range(start, min(start + batch_size, len(ids)))
+            # Chroma rejects empty metadata, documents without metadata are written in their own call
+            for has_metadata in (True, False):
+                rows = [i for i in batch if bool(data["metadatas"][i]) == has_metadata]
+                if rows:
+                    target.upsert(
+                        ids=[ids[i] for i in rows],
+                        embeddings=[data["embeddings"][i] for i in rows],
+                        documents=[data["documents"][i] for i in rows],
+                        metadatas=[data["metadatas"][i] for i in rows] if has_metadata else None
+                    )
+        with self._handles_lock:
+            self._lexical.pop(target_name, None) # rebuilt from the copied documents on the next search
+        with _manifest_lock: # the files of the source are ingested in the copy as well
+            db = _manifest(self.db_path)
+            db.execute("INSERT OR IGNORE INTO ingested_files SELECT ?, file_hash, source, chunks, ingested_at "
+                       "FROM ingested_files WHERE collection = ?", (target_name, source_name))
+            db.commit()
+        print(f" {len(ids)} entries copied from '{source_name}' to '{target_name}'") # print confirmation
+        return len(ids)
+
     def print_all_entries(self, collection_name: str):
         """Retrieves and prints all entries from a given collection.
         Not implemented in streamlit but might be useful for future use"""
@@ -62,6 +295,8 @@ class ChromaMemory:
         vectorstore = self._get_vectorstore(collection_name)
         if hasattr(vectorstore, "delete_collection"):
             vectorstore.delete_collection()  # Deletes everything
+            with self._handles_lock:
+                self._vectorstores.pop(collection_name, None) # the handle points to the deleted collection
             print(f"Collection '{collection_name}' deleted.")
         else:
             print(f"Collection not deleted.")
@@ -0,0 +1,78 @@
+import math
+import os
+import re
+import zlib
+from langchain_core.embeddings import Embeddings
+from langchain_ollama import OllamaEmbeddings
+from langchain_openai import OpenAIEmbeddings
+from llm_clients import http_client, http_async_client
+
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "openai") # openai, ollama or hashing (local, no network)
+OPENAI_EMBEDDING_MODEL = os.getenv("OPENAI_EMBEDDING_MODEL", "text-embedding-3-small")
+OLLAMA_EMBEDDING_MODEL = os.getenv("OLLAMA_EMBEDDING_MODEL", "nomic-embed-text") # model pulled in the local ollama server
+OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
+HASHING_DIM = int(os.getenv("HASHING_EMBEDDING_DIM", 512)) # size of the vectors of the hashing backend
+
+_TOKEN = re.compile(r"\w+", re.UNICODE)
+
+
+class HashingEmbeddings(Embeddings):
+    """Local embeddings without a model: word unigrams and bigrams and character trigrams of every word are hashed
+    (crc32, stable between processes) into `dim` buckets with a sign, weighted with 1 + log(count) and L2 normalized.
+    Texts that share words and word pieces get a high cosine similarity, which is enough to exercise retrieval in
+    development, tests and benchmarks on a machine without network."""
+    def __init__(self, dim: int = HASHING_DIM):
+        self.dim = dim
+
+    def _features(self, text: str):
+        words = _TOKEN.findall(text.lower())
+        features = list(words)
+        features += [f"{a} {b}" for a, b in zip(words, words[1:])]
+        for word in words:
+            padded = f"<{word}>"
+            features += [f"#{padded[i:i + 3]}" for i in range(len(padded) - 2)]
+        return features
+
+    def embed_query(self, text: str):
+        counts = {}
+        for feature in self._features(text):
+            counts[feature] = counts.get(feature, 0) + 1
+        vector = [0.0] * self.dim
+        for feature, count in counts.items():
+            digest = zlib.crc32(feature.encode("utf-8"))
+            sign = 1.0 if digest & 0x80000000 else -1.0 # top bit for the sign, the rest for the bucket
+            vector[digest % self.dim] += sign * (1.0 + math.log(count))
+        norm = math.sqrt(sum(value * value for value in vector))
+        return [value / norm for value in vector] if norm else vector
+
+    def embed_documents(self, texts):
+        return [self.embed_query(text) for text in texts]
+
+
+def _openai(api_key: str):
+    return OpenAIEmbeddings(api_key=api_key, model=OPENAI_EMBEDDING_MODEL,
+                            http_client=http_client, http_async_client=http_async_client)
+
+def _ollama(api_key: str):
+    return OllamaEmbeddings(model=OLLAMA_EMBEDDING_MODEL, base_url=OLLAMA_BASE_URL)
+
+def _hashing(api_key: str):
+    return HashingEmbeddings(HASHING_DIM)
+
+# backend name -> (factory(api_key), model name used in the embedding cache, whether the embeddings depend on the key)
+BACKENDS = {
+    "openai": (_openai, OPENAI_EMBEDDING_MODEL, True),
+    "ollama": (_ollama, f"ollama/{OLLAMA_EMBEDDING_MODEL}", False),
+    "hashing": (_hashing, f"hashing/{HASHING_DIM}", False),
+}
+
+def register_backend(name: str, factory, model: str, per_key: bool = False):
+    """Add an embedding backend that can be selected with EMBEDDING_BACKEND=name"""
+    BACKENDS[name] = (factory, model, per_key)
+
+def backend_info(name: str = None):
+    """(factory, model, per_key) of the backend, the configured one by default"""
+    name = name or EMBEDDING_BACKEND
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown embedding backend '{name}', must be one of: {list(BACKENDS)}")
+    return BACKENDS[name]
@@ -0,0 +1,156 @@
+import asyncio
+import os
+import re
+import sqlite3
+import threading
+import unicodedata
+from array import array
+from collections import OrderedDict
+from concurrent.futures import Future
+from langchain_core.embeddings import Embeddings
+
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", 4096)) # query embeddings kept in memory
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH") # optional sqlite file, e.g. /chroma_db/embedding_cache.sqlite
+
+
+def normalize_text(text: str):
+    """Same key for texts that only differ in unicode form or whitespace"""
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFC", text)).strip()
+
+
+class EmbeddingCache:
+    """LRU of embeddings keyed by (model, normalized text), optionally backed by a sqlite file so the cache
+    survives restarts and is shared by the agent containers on the volume."""
+    def __init__(self, maxsize: int = EMBEDDING_CACHE_SIZE, path: str = EMBEDDING_CACHE_PATH):
+        self.maxsize = maxsize
+        self.path = path
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        self.hits = 0
+        self.disk_hits = 0
+        self.shared = 0 # lookups that waited for the embedding of the same text in flight
+        self.misses = 0
+        if path:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False) # used under self._lock
+            self._db.execute("CREATE TABLE IF NOT EXISTS embeddings (model TEXT, text TEXT, vector BLOB, PRIMARY KEY (model, text))")
+            self._db.commit()
+
+    def get(self, model: str, text: str):
+        key = (model, normalize_text(text))
+        with self._lock:
+            vector = self._entries.get(key)
+            if vector is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return vector
+            if self._db is not None:
+                row = self._db.execute("SELECT vector FROM embeddings WHERE model = ? AND text = ?", key).fetchone()
+                if row is not None:
+                    vector = array("d", row[0]).tolist()
+                    self._store(key, vector)
+                    self.disk_hits += 1
+                    return vector
+            self.misses += 1
+            return None
+
+    def set(self, model: str, text: str, vector):
+        key = (model, normalize_text(text))
+        with self._lock:
+            self._store(key, list(vector))
+            if self._db is not None:
+                self._db.execute("INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?)", (*key, array("d", vector).tobytes()))
+                self._db.commit()
+
+    def count_shared(self):
+        with self._lock:
+            self.shared += 1
+
+    def _store(self, key, vector):
+        self._entries[key] = vector
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.shared + self.misses
+            return {"size": len(self._entries), "maxsize": self.maxsize, "disk": self.path, "hits": self.hits,
+                    "disk_hits": self.disk_hits, "shared": self.shared, "misses": self.misses,
+                    "hit_rate": (self.hits + self.disk_hits + self.shared) / lookups if lookups else 0.0}
+
+
+class CachedEmbeddings(Embeddings):
+    """Embedding function that looks up query embeddings in the cache first, so the prompt of a turn is
+    embedded once for the supervisor, the episodic and the semantic search of every expert. A query that is
+    already being embedded (the episodic and semantic search of a turn run at the same time) waits for that
+    call instead of embedding the text again. Documents are embedded as before, they are stored once and would
+    only push the queries out of the cache."""
+    def __init__(self, embeddings: Embeddings, model: str, cache: EmbeddingCache):
+        self.embeddings = embeddings
+        self.model = model
+        self.cache = cache
+        self._inflight = {} # normalized text -> Future of the embedding call in progress
+        self._lock = threading.Lock()
+
+    def _begin(self, text):
+        """(cached vector, future of the call in flight, True if this caller makes the call)"""
+        key = normalize_text(text)
+        with self._lock:
+            future = self._inflight.get(key)
+            if future is not None:
+                self.cache.count_shared()
+                return None, future, False
+            vector = self.cache.get(self.model, text)
+            if vector is not None:
+                return vector, None, False
+            future = self._inflight[key] = Future()
+            return None, future, True
+
+    def _finish(self, text, future, vector=None, error=None):
+        if error is None:
+            self.cache.set(self.model, text, vector) # cached before it leaves the calls in flight
+        with self._lock:
+            del self._inflight[normalize_text(text)]
+        if error is None:
+            future.set_result(vector)
+        else:
+            future.set_exception(error)
+
+    def embed_documents(self, texts):
+        return self.embeddings.embed_documents(texts)
+
+    def embed_query(self, text):
+        vector, future, owner = self._begin(text)
+        if vector is not None:
+            return vector
+        if not owner:
+            return future.result()
+        try:
+            vector = self.embeddings.embed_query(text)
+        except BaseException as e:
+            self._finish(text, future, error=e)
+            raise
+        self._finish(text, future, vector)
+        return vector
+
+    async def aembed_documents(self, texts):
+        return await self.embeddings.aembed_documents(texts)
+
+    async def aembed_query(self, text):
+        vector, future, owner = self._begin(text)
+        if vector is not None:
+            return vector
+        if not owner:
+            return await asyncio.shield(asyncio.wrap_future(future)) # a cancelled waiter does not cancel the call
+        try:
+            vector = await self.embeddings.aembed_query(text)
+        except BaseException as e:
+            self._finish(text, future, error=e)
+            raise
+        self._finish(text, future, vector)
+        return vector
+
+
+embedding_cache = EmbeddingCache() # shared by the embedding functions of all keys, the vectors only depend on the model
@@ -0,0 +1,119 @@
+import heapq
+import json
+import math
+import re
+import threading
+from collections import Counter
+
+BM25_K1 = 1.5
+BM25_B = 0.75
+RRF_K = 60 # rank constant of reciprocal-rank fusion
+COMMON_TERM_FRACTION = 0.5 # terms in more documents than this fraction add (almost) nothing to the ranking and are not scored
+
+# words (event names such as long_sleep stay one token, their parts are added as well) and LTL operator symbols
+_TOKEN = re.compile(r"\w+|[¬∧∨→↔]", re.UNICODE)
+STOPWORDS = frozenset(
+    "a an and are as at be by for from has have in is it its of on or that the this to was were will with what "
+    "which who how when where does do can should would could i you we they he she them their our your".split())
+
+
+def tokenize(text: str):
+    tokens = []
+    for token in _TOKEN.findall(text.lower()):
+        tokens.append(token)
+        if "_" in token.strip("_"):
+            tokens.extend(part for part in token.split("_") if part)
+    return tokens
+
+
+def index_text(page_content: str):
+    """The text of a stored entry: the string values of the JSON document (keys and unicode escapes are left out)"""
+    try:
+        entry = json.loads(page_content)
+    except ValueError:
+        return page_content
+    values = []
+    def collect(value):
+        if isinstance(value, str):
+            values.append(value)
+        elif isinstance(value, dict):
+            for item in value.values():
+                collect(item)
+        elif isinstance(value, list):
+            for item in value:
+                collect(item)
+    collect(entry)
+    return " ".join(values)
+
+
+class BM25Index:
+    """In-memory inverted index with BM25 scoring of the documents of one Chroma collection, keyed by the Chroma ids"""
+    def __init__(self):
+        self._postings = {} # term -> {doc id: term frequency}
+        self._lengths = {} # doc id -> number of tokens
+        self._documents = {} # doc id -> page content
+        self._total_length = 0
+        self._norms = None # doc id -> BM25 length normalization, recomputed after changes
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._documents)
+
+    def add(self, ids, documents):
+        """Index the documents, a known id replaces its old document (upsert)"""
+        with self._lock:
+            for doc_id, document in zip(ids, documents):
+                if doc_id in self._documents:
+                    self._remove(doc_id)
+                terms = Counter(tokenize(index_text(document)))
+                for term, count in terms.items():
+                    self._postings.setdefault(term, {})[doc_id] = count
+                length = sum(terms.values())
+                self._lengths[doc_id] = length
+                self._documents[doc_id] = document
+                self._total_length += length
+            self._norms = None
+
+    def _remove(self, doc_id):
+        for term in Counter(tokenize(index_text(self._documents.pop(doc_id)))):
+            postings = self._postings.get(term)
+            if postings is not None:
+                postings.pop(doc_id, None)
+                if not postings:
+                    del self._postings[term]
+        self._total_length -= self._lengths.pop(doc_id)
+
+    def search(self, query: str, k: int, coverage_k: int = None):
+        """[(doc id, page content, score)] of the k best matching documents and the fraction of the query
+        terms (without stopwords) that occur in the first coverage_k (default k) of them"""
+        terms = [term for term in dict.fromkeys(tokenize(query)) if term not in STOPWORDS]
+        with self._lock:
+            count = len(self._documents)
+            if not terms or not count:
+                return [], 0.0
+            if self._norms is None:
+                average_length = self._total_length / count or 1.0
+                self._norms = {doc_id: BM25_K1 * (1 - BM25_B + BM25_B * length / average_length)
+                               for doc_id, length in self._lengths.items()}
+            norms = self._norms
+            scored = [term for term in terms if term in self._postings]
+            rare = [term for term in scored if len(self._postings[term]) <= COMMON_TERM_FRACTION * count]
+            scores = {}
+            for term in rare or scored: # only common terms: score with those
+                postings = self._postings[term]
+                idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+                weight = idf * (BM25_K1 + 1)
+                for doc_id, frequency in postings.items():
+                    scores[doc_id] = scores.get(doc_id, 0.0) + weight * frequency / (frequency + norms[doc_id])
+            best = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+            covered = {term for term in terms for doc_id, _ in best[:coverage_k or k] if doc_id in self._postings.get(term, ())}
+            return [(doc_id, self._documents[doc_id], score) for doc_id, score in best], len(covered) / len(terms)
+
+
+def reciprocal_rank_fusion(rankings, k: int = RRF_K):
+    """Fuse rankings (lists of keys, best first) into one list of keys, best first"""
+    scores = {}
+    for ranking in rankings:
+        for rank, key in enumerate(ranking):
+            scores[key] = scores.get(key, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(scores, key=scores.get, reverse=True)
@@ -1,18 +1,43 @@
+import contextvars
+import hashlib
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
 from typing import List
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_community.document_loaders import PyPDFLoader
-from .chroma_memory import ChromaMemory
+from .chroma_memory import get_memory
+
+PDF_EMBED_BATCH_SIZE = int(os.getenv("PDF_EMBED_BATCH_SIZE", 64)) # chunks per embeddings request and add_documents call
+PDF_MAX_CONCURRENT_FILES = int(os.getenv("PDF_MAX_CONCURRENT_FILES", 4)) # files loaded, split and embedded at the same time
+
+
+def file_hash(path: str):
+    """sha256 of the file content, read in blocks"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def chunk_id(content: str):
+    """Id of a chunk in the collection, the same text is stored once whichever file it came from"""
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
 
 class PDFProcessor:    
-    def __init__(self, pdf_dir: str, collection_name: str):
+    def __init__(self, pdf_dir: str, collection_name: str, memory=None,
+                 batch_size: int = PDF_EMBED_BATCH_SIZE, max_workers: int = PDF_MAX_CONCURRENT_FILES, progress=None):
         """
         Initialize the PDF processor.
-        
+        progress is called with an event dict for every file started, stored batch and finished file.
         """
         self.pdf_dir = pdf_dir
         self.collection_name = collection_name
-        self.memory = ChromaMemory()
+        self.memory = memory or get_memory()
+        self.batch_size = batch_size
+        self.max_workers = max_workers
+        self.progress = progress
         self.text_splitter = RecursiveCharacterTextSplitter(
             chunk_size=1000,
             chunk_overlap=200,
@@ -20,33 +45,77 @@ class PDFProcessor:
         )
     
     def process_pdf_to_chunks(self):
-        """Process all PDFs in the directory and store chunks in semantic memory."""
+        """Process all PDFs in the directory and store chunks in semantic memory.
+        Files are processed concurrently, the chunks of a file are embedded and stored in batches.
+        Chunks that are already stored in the collection are not embedded again.
+        Returns the number of files, stored and skipped chunks, the files that failed and the seconds it took."""
         pdf_files = [f for f in os.listdir(self.pdf_dir) if f.lower().endswith('.pdf')]
         
         if not pdf_files:
             print(f"No PDF files found in {self.pdf_dir}")
-            return
+            return {"files": 0, "chunks": 0, "skipped": 0, "failed": [], "seconds": 0.0}
         
-        for pdf_file in pdf_files:
-            try:
-                pdf_path = os.path.join(self.pdf_dir, pdf_file)
-                print(f"Processing {pdf_file}...")
-                loader = PyPDFLoader(pdf_path)
-                pages = loader.load()
-                chunks = self.text_splitter.split_documents(pages)
-                
-                # Store chunks in semantic memory
-                for chunk in chunks:
-                    self.memory.add_entry({
-                        "content": chunk.page_content,
-                        "metadata": {
-                            "source": pdf_file,
-                            "page": chunk.metadata.get("page", 0)
-                        }
-                    }, self.collection_name)
-                
-                print(f"Successfully processed {pdf_file}")
-                
-            except Exception as e:
-                print(f"Error processing {pdf_file}: {str(e)}")
-                continue 
\ No newline at end of file
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(pdf_files)), thread_name_prefix="pdf") as executor:
+            # each file runs with a copy of the request context (session key, request timing)
+            futures = [executor.submit(contextvars.copy_context().run, self.process_file, pdf_file) for pdf_file in pdf_files]
+            results = [future.result() for future in futures]
+        chunks, skipped = sum(r[0] for r in results), sum(r[1] for r in results)
+        failed = [pdf_file for pdf_file, result in zip(pdf_files, results) if result[2]]
+        seconds = time.perf_counter() - started
+        print(f"Processed {len(pdf_files)} PDFs into {chunks} new chunks ({skipped} already stored, {len(failed)} failed) in {seconds:.1f} s")
+        return {"files": len(pdf_files), "chunks": chunks, "skipped": skipped, "failed": failed, "seconds": seconds}
+
+    def _emit(self, event: str, **data):
+        if self.progress is not None:
+            self.progress({"event": event, **data})
+
+    def process_file(self, pdf_file: str):
+        """Load, split and store one PDF, returns the number of stored and of skipped chunks and whether it failed"""
+        try:
+            pdf_path = os.path.join(self.pdf_dir, pdf_file)
+            print(f"Processing {pdf_file}...")
+            digest = file_hash(pdf_path)
+            self._emit("file_started", file=pdf_file, file_hash=digest)
+            ingested = self.memory.ingested_file(self.collection_name, digest)
+            if ingested is not None: # same file was ingested completely before
+                print(f"Skipped {pdf_file}, already stored")
+                self._emit("file_done", file=pdf_file, chunks=0, skipped=ingested["chunks"])
+                return 0, ingested["chunks"], False
+
+            loader = PyPDFLoader(pdf_path)
+            pages = loader.load()
+            chunks = self.text_splitter.split_documents(pages)
+            unique = {} # chunk id -> chunk, repeated text within the file is stored once
+            for chunk in chunks:
+                unique.setdefault(chunk_id(chunk.page_content), chunk)
+            existing = self.memory.existing_ids(self.collection_name, list(unique))
+            new = [(id_, chunk) for id_, chunk in unique.items() if id_ not in existing]
+            skipped = len(chunks) - len(new)
+            self._emit("file_split", file=pdf_file, chunks=len(chunks), new=len(new), skipped=skipped)
+            
+            # Store the new chunks in semantic memory, batch by batch for the progress events
+            for start in range(0, len(new), self.batch_size):
+                batch = new[start:start + self.batch_size]
+                entries = [{
+                    "content": chunk.page_content,
+                    "metadata": {
+                        "source": pdf_file,
+                        "page": chunk.metadata.get("page", 0)
+                    }
+                } for _, chunk in batch]
+                metadatas = [{"source": pdf_file, "page": chunk.metadata.get("page", 0), "file_hash": digest}
+                             for _, chunk in batch]
+                self.memory.add_entries(entries, self.collection_name, batch_size=self.batch_size,
+                                        ids=[id_ for id_, _ in batch], metadatas=metadatas)
+                self._emit("batch_stored", file=pdf_file, stored=start + len(batch), total=len(new))
+            
+            self.memory.mark_ingested(self.collection_name, digest, pdf_file, len(chunks)) # only once all chunks are stored
+            print(f"Successfully processed {pdf_file}")
+            self._emit("file_done", file=pdf_file, chunks=len(new), skipped=skipped)
+            return len(new), skipped, False
+            
+        except Exception as e:
+            print(f"Error processing {pdf_file}: {str(e)}")
+            self._emit("file_failed", file=pdf_file, error=str(e))
+            return 0, 0, True
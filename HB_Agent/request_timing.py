@@ -0,0 +1,73 @@
+import contextvars
+import logging
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+RECENT_REQUESTS = int(os.getenv("RECENT_REQUESTS", 100)) # timing summaries kept for /metrics/request-timings
+
+_current = contextvars.ContextVar("request_timing", default=None)
+recent = deque(maxlen=RECENT_REQUESTS)
+
+
+class RequestTiming:
+    """Seconds and number of calls per stage of one request. The tools of the supervisor run in worker threads
+    with a copy of the request context, so they add to the same object."""
+    def __init__(self, name: str, username: str = None):
+        self.name = name
+        self.username = username
+        self.started = time.perf_counter()
+        self.stages = {} # stage -> (seconds, calls)
+        self.counts = {} # counter -> value, e.g. the prompt tokens sent to the supervisor and the experts
+        self._lock = threading.Lock()
+
+    def add(self, stage: str, seconds: float):
+        with self._lock:
+            total, calls = self.stages.get(stage, (0.0, 0))
+            self.stages[stage] = (total + seconds, calls + 1)
+
+    def count(self, name: str, value: int):
+        with self._lock:
+            self.counts[name] = self.counts.get(name, 0) + value
+
+    def summary(self):
+        with self._lock:
+            stages = {stage: {"seconds": round(total, 4), "calls": calls} for stage, (total, calls) in self.stages.items()}
+            counts = dict(self.counts)
+        return {"request": self.name, "username": self.username,
+                "total_seconds": round(time.perf_counter() - self.started, 4), "stages": stages, "counts": counts}
+
+
+def start(name: str, username: str = None):
+    """Start the timing of the current request"""
+    timing = RequestTiming(name, username)
+    _current.set(timing)
+    return timing
+
+def finish(timing: RequestTiming):
+    """Store and log the breakdown of a finished request"""
+    summary = timing.summary()
+    recent.append(summary)
+    breakdown = ", ".join(f"{stage} {values['seconds']:.3f} s x{values['calls']}" for stage, values in summary["stages"].items())
+    counts = "".join(f", {name} {value}" for name, value in summary["counts"].items())
+    logging.info(f"{summary['request']} of {summary['username']} took {summary['total_seconds']:.2f} s ({breakdown}{counts})")
+    return summary
+
+def count(name: str, value: int):
+    """Add to a counter of the current request (e.g. prompt tokens), a no-op outside of a request"""
+    timing = _current.get()
+    if timing is not None:
+        timing.count(name, value)
+
+@contextmanager
+def timed(stage: str):
+    """Add the duration of the block to the stage of the current request, a no-op outside of a request"""
+    timing = _current.get()
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        if timing is not None:
+            timing.add(stage, time.perf_counter() - started)
@@ -5,92 +5,65 @@ from collections import deque
 import os
 from datetime import datetime
 import subprocess
-import docker
 import time
 
 st.set_page_config(page_title="Health Behavior Persona Data Generator", layout="centered")
+RUNS_PER_PAGE = 20 # number of data generation runs listed per page
+AGENT_STATUS_POLL_INTERVAL = 1.0 # seconds between readiness checks of the agent container
 
     
-def start_hb_agent(username, openai_key, port):
-    client = docker.from_env() # load /create docker containers trough python
+def start_hb_agent(username, port):
+    """Asks the gateway to start the agent container of the user and polls its readiness state,
+    the container is started and health checked by the gateway in the background"""
     container_name = f"hb_agent_{username}" # name container
-    try:
-        container = client.containers.get(container_name)
-        container.reload()  # Refresh container's status info
-        if container.status != 'running':
-            st.session_state.agent_logs = []  # Clear previous logs
-            with st.spinner(f"Starting agent network for {username}..."):
-                container.start() # start container
-                st.session_state.agent_logs.append(f"Loading {container_name}...")
-                log_placeholder = st.empty() # log placeholder
-                # Wait for the application to start
-                log_stream = container.logs(stream=True, follow=True) # container logs to check for errors
-                for line in log_stream: # stream logs
-                    decoded_line = line.decode('utf-8').strip()
-                    st.session_state.agent_logs.append(decoded_line)
-                    log_placeholder.text_area("Agent Logs", value="\n".join(st.session_state.agent_logs), height=300) 
-                    if "Application startup complete." in decoded_line:
-                        st.success("Agent started successfully!")
-                        time.sleep(2)
-                        break
-                else:
-                    st.error("Agent failed to start. Please check the logs for more details.")
-                    return None, None
-        else:
-            st.info(f"Agent network for {username} is already running.")
-
-        st.session_state.hb_agent_container_name = container_name
-        return container_name, port # return port for later
-
-    except docker.errors.NotFound:
-        st.session_state.agent_logs = []  # Clear previous logs
-        with st.spinner(f"Creating and starting agent network for {username}..."):
-            try:
-                container = client.containers.run(
-                    "hb_agent_image:latest",
-                    name=container_name,
-                    detach=True,
-                    environment={"OPENAI_API_KEY": openai_key, "USERNAME": username},
-                    ports={'5000/tcp': port},
-                    network="app_network",  # use fixed network name, not folder-prefixed
-                    volumes={'chroma_data': {'bind': '/chroma_db', 'mode': 'rw'}}  # use fixed volume name
-                ) # create a new container with its name, OpenAI key, username and user specific port
-                st.session_state.hb_agent_container_name = container_name
-
-                log_placeholder = st.empty()
-                log_stream = container.logs(stream=True, follow=True) # stream the logs
-                for line in log_stream:
-                    decoded_line = line.decode('utf-8').strip()
-                    st.session_state.agent_logs.append(decoded_line)
-                    log_placeholder.text_area("Agent Logs", value="\n".join(st.session_state.agent_logs), height=300)
-                    if "Application startup complete." in decoded_line:
-                        st.success("Agent started successfully!")
-                        time.sleep(1)
-                        break
-                else:
-                    st.error("Agent failed to start. Please check the logs for more details.")
-                    return None, None
-
-                return container_name, port # return container_name and port to use for prompts
-            except docker.errors.APIError as e:
-                st.error(f"Failed to start {container_name}: {e}")
+    st.session_state.agent_logs = []  # Clear previous logs
+    with st.spinner(f"Starting agent network for {username}..."):
+        try:
+            response = requests.post(f"http://fastapi_app:8000/agents/{username}/start")
+            if response.status_code not in (200, 202):
+                st.error(f"Failed to start {container_name}: {response.text}")
                 return None, None
+            state = response.json()
+            status_placeholder = st.empty()
+            while state.get("status") in ("starting", "queued"): # wait for the gateway to report the agent healthy
+                elapsed = time.time() - state.get("started_at", time.time())
+                if state["status"] == "queued": # host memory is full, the gateway waits for idle agents to stop
+                    status_placeholder.warning(f"Waiting for free server memory to start {container_name}... ({elapsed:.0f} s)")
+                else:
+                    status_placeholder.info(f"Loading {container_name}... ({elapsed:.0f} s)")
+                time.sleep(AGENT_STATUS_POLL_INTERVAL)
+                state = requests.get(f"http://fastapi_app:8000/agents/{username}/status").json()
+        except requests.RequestException as e:
+            st.error(f"Failed to start {container_name}: {e}")
+            return None, None
+    if state.get("status") != "ready":
+        st.error(f"Agent failed to start: {state.get('error')}")
+        if state.get("logs"): # container logs to check for errors
+            st.session_state.agent_logs = state["logs"].splitlines()
+            st.text_area("Agent Logs", value=state["logs"], height=300)
+        return None, None
+    st.success("Agent started successfully!")
+    container_name = state.get("container", container_name) # a pre-started container of the pool has its own name
+    port = state.get("port") or port # and port, requests are routed with X-User-Port (no port for multi-tenant agents)
+    st.session_state.hb_agent_container_name = container_name
+    st.session_state.user_port = port
+    return container_name, port # return container_name and port to use for prompts
 
 def stop_hb_agent(container_name):
     """Stops the current running container which is used by the user.
     Afterwards clears all the information stored in the streamlit application"""
-    client = docker.from_env() # get docker
+    username = st.session_state.get("username")
     try:
-        container = client.containers.get(container_name)
-        container.stop()   # stop container
-        print(f"{container_name} stopped.")
-    except docker.errors.NotFound:
-        print(f"Container {container_name} not found.")
-    except docker.errors.APIError as e:
+        response = requests.post(f"http://fastapi_app:8000/agents/{username}/stop") # stop container trough the gateway
+        if response.status_code == 200:
+            print(f"{container_name} stopped.")
+        else:
+            print(f"Error stopping {container_name}: {response.text}")
+    except requests.RequestException as e:
         print(f"Error stopping {container_name}: {e}")
     finally:
         for key in ['logged_in', 'hb_agent_started', 'agent_logs', 'username',
-                    'openai_key', 'user_port', 'hb_agent_container_name', 'history']:
+                    'openai_key', 'user_port', 'hb_agent_container_name', 'history', 'zip_cache']:
             if key in st.session_state:
                 del st.session_state[key] # reset everything stored in streamlit
         st.session_state.page = "login" # back to login
@@ -170,9 +143,8 @@ def agent_startup_screen():
     no credentials on OpenAI key"""
     st.title("Starting Agent Network...")
     username = st.session_state.get("username")
-    openai_key = st.session_state.get("openai_key")
     user_port = st.session_state.get("user_port")
-    container_name, port = start_hb_agent(username, openai_key, user_port)
+    container_name, port = start_hb_agent(username, user_port)
     if container_name is None: # if failed to start
         st.error("Failed to start agent. Please check logs or restart the login procedure.")
         if st.button("Restart login procedure"): # option to go back to login
@@ -230,25 +202,41 @@ else:
                     try:
                         st.session_state.processing_pdfs = True # set true
                         with st.spinner("Processing PDFs..."):
-                            temp_dir = "temp_uploads"
-                            os.makedirs(temp_dir, exist_ok=True) # make temporary directory
-                            for uploaded_file in uploaded_files:
-                                file_path = os.path.join(temp_dir, uploaded_file.name)
-                                with open(file_path, "wb") as f:
-                                    f.write(uploaded_file.getbuffer()) # write a files to a temproary storage
-                            files = [("files", open(os.path.join(temp_dir, f), "rb")) for f in os.listdir(temp_dir)] # write files in tuple for request
-                            response = requests.post(
+                            files = [("files", (uploaded_file.name, uploaded_file.getvalue(), "application/pdf")) for uploaded_file in uploaded_files] # write files in tuple for request
+                            progress_bar = st.progress(0.0, text="Uploading PDFs...")
+                            done_files, last_event = 0, {}
+                            with requests.post(
                                 f"http://fastapi_app:8000/process-pdf/{expert_selection}",
                                 files=files,
-                                headers={"X-User-Port": str(st.session_state.user_port)}
-                            ) # use userport for specific user container
-                            for file in os.listdir(temp_dir):
-                                os.remove(os.path.join(temp_dir, file)) # remove files
-                            os.rmdir(temp_dir) # remove directory
-                            if response.status_code == 200:
-                                st.success("PDFs processed successfully!")
-                            else:
-                                st.error(f"Error processing PDFs: {response.text}")
+                                headers={"X-User-Port": str(st.session_state.user_port), "X-Username": st.session_state.username},
+                                stream=True
+                            ) as response: # use userport for specific user container, progress events are streamed back
+                                if response.status_code != 200:
+                                    st.error(f"Error processing PDFs: {response.text}")
+                                else:
+                                    for line in response.iter_lines(decode_unicode=True):
+                                        try:
+                                            last_event = json.loads(line)
+                                        except json.JSONDecodeError:
+                                            continue
+                                        event = last_event.get("event")
+                                        if event in ("file_done", "file_failed"):
+                                            done_files += 1
+                                        if event == "batch_stored":
+                                            text = f"{last_event['file']}: {last_event['stored']}/{last_event['total']} chunks embedded"
+                                        elif event == "file_done":
+                                            text = f"{last_event['file']}: {last_event['chunks']} new chunks, {last_event['skipped']} already stored"
+                                        elif event == "queued":
+                                            text = "Waiting for earlier uploads..."
+                                        else:
+                                            text = f"{done_files}/{len(files)} PDFs processed"
+                                        progress_bar.progress(min(done_files / len(files), 1.0), text=text)
+                                    if last_event.get("event") == "done":
+                                        st.success(f"PDFs processed successfully! {last_event['chunks']} new chunks, {last_event['skipped']} already stored.")
+                                    elif last_event.get("event") == "partial":
+                                        st.warning(f"{last_event['chunks']} new chunks stored, {last_event['skipped']} already stored, but these PDFs failed: {', '.join(last_event['failed'])}")
+                                    else:
+                                        st.error(f"Error processing PDFs: {last_event.get('error', 'processing did not finish')}")
                     except Exception as e:
                         st.error(f"Error: {str(e)}")
                     finally:
@@ -267,7 +255,7 @@ else:
                     with st.spinner("Updating memory..."):
                         response = requests.post(
                             "http://fastapi_app:8000/update-memory",
-                            headers={"X-User-Port": str(st.session_state.user_port)}
+                            headers={"X-User-Port": str(st.session_state.user_port), "X-Username": st.session_state.username}
                         ) # post to specific user port (using user name for fastapi)
                         if response.status_code == 200:
                             response_data = response.json()
@@ -295,21 +283,36 @@ else:
                 st.rerun()
             username = st.session_state.get("username")
             # Use FastAPI endpoints to fetch data
-            response = requests.get(f"http://fastapi_app:8000/get-generated-data/{username}") # get each user-specifics runs
+            page = st.session_state.get("data_run_page", 1) # runs are fetched one page at a time, newest first
+            response = requests.get(
+                f"http://fastapi_app:8000/get-generated-data/{username}",
+                params={"offset": (page - 1) * RUNS_PER_PAGE, "limit": RUNS_PER_PAGE}
+            ) # get each user-specifics runs
             if response.status_code == 200:
                 data = response.json()
                 runs = data.get("runs", []) # list of runs
+                total_pages = max(1, -(-data.get("total", len(runs)) // RUNS_PER_PAGE))
+                if total_pages > 1:
+                    st.number_input("Page", min_value=1, max_value=total_pages, step=1, key="data_run_page")
                 if runs:
                     run_names = [run["run"] for run in runs]
                     selected_run = st.selectbox("Select a data generation run:", run_names, key="data_run_select") # create selection window for run names
                     if selected_run: 
                         st.write(f"Run: {selected_run}") # show selected run
                         zip_url = f"http://fastapi_app:8000/download-run-zip/{username}/{selected_run}"
-                        zip_response = requests.get(zip_url)
+                        if 'zip_cache' not in st.session_state:
+                            st.session_state.zip_cache = {} # run -> (etag, zip content) of earlier fetched archives
+                        cached_zip = st.session_state.zip_cache.get(selected_run)
+                        zip_headers = {"If-None-Match": cached_zip[0]} if cached_zip else {}
+                        zip_response = requests.get(zip_url, headers=zip_headers) # 304 if the cached archive is still up to date
                         if zip_response.status_code == 200:
+                            cached_zip = (zip_response.headers.get("ETag"), zip_response.content)
+                            if cached_zip[0]:
+                                st.session_state.zip_cache[selected_run] = cached_zip
+                        if zip_response.status_code in (200, 304) and cached_zip:
                             st.download_button(
                                 label=f"Download {selected_run} as ZIP",
-                                data=zip_response.content,
+                                data=cached_zip[1],
                                 file_name=f"{selected_run}.zip",
                                 mime="application/zip"
                             ) # download selected run
@@ -358,7 +361,8 @@ else:
         with requests.post(
             "http://fastapi_app:8000/ask",
             headers={"Content-Type": "application/json",
-            "X-User-Port": str(st.session_state.user_port) 
+            "X-User-Port": str(st.session_state.user_port),
+            "X-Username": st.session_state.username # the gateway restarts the agent if it was stopped while idle
             },
             data=json.dumps({"prompt": prompt}),
             stream=True
@@ -0,0 +1,80 @@
+import asyncio
+import os
+from contextlib import asynccontextmanager, nullcontext
+import httpx
+
+AGENT_MAX_CONNECTIONS = 500 # total connections of the gateway to all agent containers
+AGENT_MAX_KEEPALIVE = 100 # idle connections kept open for reuse
+AGENT_MAX_CONNECTIONS_PER_HOST = int(os.getenv("AGENT_MAX_CONNECTIONS_PER_HOST", 20)) # concurrent requests to the container of one user
+AGENT_SHARED_MAX_CONNECTIONS_PER_HOST = int(os.getenv("AGENT_SHARED_MAX_CONNECTIONS_PER_HOST", 200)) # concurrent requests to a multi-tenant agent (AGENT_SHARED_URLS)
+AGENT_QUEUE_TIMEOUT = float(os.getenv("AGENT_QUEUE_TIMEOUT", 10)) # seconds a request waits for a free slot of its agent, then 503
+AGENT_KEEPALIVE_EXPIRY = 60.0 # seconds an idle connection is kept
+AGENT_TIMEOUT = httpx.Timeout(connect=5.0, read=60.0, write=60.0, pool=30.0) # default, per call the read timeout is overridden
+
+
+class AgentBusy(httpx.PoolTimeout):
+    """Raised when all request slots of an agent stay taken for AGENT_QUEUE_TIMEOUT, the caller should retry later"""
+
+
+class AgentClient:
+    """Application wide HTTP client for the agent containers. Keeps connections to every
+    host.docker.internal:{user_port} alive between requests (also for streaming requests)
+    and limits the number of concurrent requests per container, with a higher limit for the
+    multi-tenant agents that serve many users."""
+    def __init__(self, max_connections_per_host: int = AGENT_MAX_CONNECTIONS_PER_HOST, shared_urls=(),
+                 shared_max_connections_per_host: int = AGENT_SHARED_MAX_CONNECTIONS_PER_HOST,
+                 queue_timeout: float = AGENT_QUEUE_TIMEOUT):
+        self.client = httpx.AsyncClient(
+            timeout=AGENT_TIMEOUT,
+            limits=httpx.Limits(
+                max_connections=AGENT_MAX_CONNECTIONS,
+                max_keepalive_connections=AGENT_MAX_KEEPALIVE,
+                keepalive_expiry=AGENT_KEEPALIVE_EXPIRY
+            )
+        )
+        self.max_connections_per_host = max_connections_per_host
+        self.shared_max_connections_per_host = shared_max_connections_per_host
+        self.shared_hosts = {httpx.URL(url).netloc.decode() for url in shared_urls}
+        self.queue_timeout = queue_timeout
+        self._host_limits = {} # host:port -> semaphore
+
+    def _host_limit(self, host):
+        if host not in self._host_limits:
+            limit = self.shared_max_connections_per_host if host in self.shared_hosts else self.max_connections_per_host
+            self._host_limits[host] = asyncio.Semaphore(limit)
+        return self._host_limits[host]
+
+    @asynccontextmanager
+    async def _slot(self, url: str):
+        """Request slot of the agent of the url, AgentBusy if none is free within the queue timeout"""
+        host = httpx.URL(url).netloc.decode()
+        limit = self._host_limit(host)
+        try:
+            await asyncio.wait_for(limit.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            raise AgentBusy(f"Agent {host} is busy, try again later.") from None
+        try:
+            yield
+        finally:
+            limit.release()
+
+    async def get(self, url: str, **kwargs):
+        """GET to an agent container over a pooled connection"""
+        async with self._slot(url):
+            return await self.client.get(url, **kwargs)
+
+    async def post(self, url: str, **kwargs):
+        """POST to an agent container over a pooled connection"""
+        async with self._slot(url):
+            return await self.client.post(url, **kwargs)
+
+    @asynccontextmanager
+    async def stream(self, method: str, url: str, limited: bool = True, **kwargs):
+        """Streaming request to an agent container, the connection returns to the pool when the stream is closed.
+        Long-lived event streams (limited=False) do not take a request slot, they mostly wait for heartbeats."""
+        async with self._slot(url) if limited else nullcontext():
+            async with self.client.stream(method, url, **kwargs) as response:
+                yield response
+
+    async def aclose(self):
+        await self.client.aclose()
@@ -1,22 +1,50 @@
 import logging
 from fastapi import FastAPI, Request, HTTPException, UploadFile, File
 from pydantic import BaseModel
-from fastapi.responses import StreamingResponse, JSONResponse, FileResponse
+from fastapi.responses import StreamingResponse, JSONResponse, FileResponse, Response
 import httpx
 import traceback
+import json
 import os
-import shutil
-from typing import List
+from typing import List, Optional
 from datetime import datetime
-from database.database import add_user, verify_user, create_table, create_connection, get_user_info 
-import zipfile
-import io
+from database.database import create_table, get_user_info, init_pool, close_pool, insert_user, get_password_hash
+from database.password_hasher import password_hasher, PasswordHasherBusy
+import asyncio
+from starlette.concurrency import run_in_threadpool
+from run_archive import iter_run_zip, run_etag, etag_matches, get_cached_run_zip
+from run_index import list_runs
+from email.utils import parsedate_to_datetime
+from contextlib import asynccontextmanager
+from agent_client import AgentClient, AgentBusy
+from ttl_cache import TTLCache
+from container_manager import ContainerManager, AGENT_SHARED_URLS
+from warm_pool import WarmPool
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("uvicorn.error")
 
-app = FastAPI()
-create_table() # user credentials
+# username -> {"openai_key", "port"}, warm logins are answered without a database round-trip
+user_info_cache = TTLCache(maxsize=int(os.getenv("USER_INFO_CACHE_SIZE", 1024)), ttl=float(os.getenv("USER_INFO_CACHE_TTL", 300)))
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """One pooled client to the agent containers and one database pool for the lifetime of the gateway"""
+    await run_in_threadpool(init_pool)
+    await run_in_threadpool(create_table) # user credentials
+    app.state.agent_client = AgentClient(shared_urls=AGENT_SHARED_URLS) # multi-tenant agents get a higher request limit
+    app.state.container_manager = ContainerManager(app.state.agent_client)
+    app.state.container_manager.pool = WarmPool(app.state.container_manager)
+    await app.state.container_manager.pool.start() # pre-start unbound agent containers in the background
+    app.state.container_manager.start_reaper() # checkpoint and stop idle agent containers
+    yield
+    await app.state.container_manager.stop_reaper()
+    await app.state.container_manager.pool.stop()
+    await app.state.agent_client.aclose()
+    await run_in_threadpool(close_pool)
+    password_hasher.shutdown()
+
+app = FastAPI(lifespan=lifespan)
 
 
 class UserCredentials(BaseModel):
@@ -33,35 +61,60 @@ class QueryRequest(BaseModel):
     """For query type check from streamlit to agent network (query)"""
     query: str
 
+async def resolve_agent(request: Request):
+    """Username, base url and headers of the agent for a request. With X-Username the container is started again
+    when it was stopped (idle), otherwise the X-User-Port header is used as is. Multi-tenant agents get the
+    username and key of the user as headers."""
+    manager = request.app.state.container_manager
+    username = request.headers.get("X-Username")
+    if username:
+        user_info = await lookup_user_info(username)
+        state = await manager.ensure_running(username, user_info["openai_key"], user_info["port"])
+        if state["status"] != "ready":
+            raise HTTPException(status_code=503, detail=f"Agent is not available: {state.get('error')}")
+        headers = {"X-Username": username, "X-OpenAI-Key": user_info["openai_key"]} if state.get("shared") else {}
+        return username, manager.agent_url(username), headers
+    user_port = request.headers.get("X-User-Port")  # get the user port
+    if not user_port:
+        raise HTTPException(status_code=400, detail="User port not provided")
+    return manager.username_for_port(user_port), f"http://host.docker.internal:{user_port}", {}
+
 @app.post("/ask")
 async def ask(request: Request):
     """Prompt to the specific agent network of each user"""
-    user_port = request.headers.get("X-User-Port")  # get the user port
-    if not user_port:
-        raise HTTPException(status_code=400, detail="User port not provided") 
+    username, agent_base_url, agent_headers = await resolve_agent(request)
 
     body = await request.json() # get json
     prompt = body.get("prompt")
     if not prompt:
         raise HTTPException(status_code=400, detail="Prompt is required")
     query_request = {"query": prompt}
-    agent_url = f"http://host.docker.internal:{user_port}/supervisor/ask" # specific container
+    agent_url = f"{agent_base_url}/supervisor/ask" # specific container
 
     try:
+        agent_client = request.app.state.agent_client
         async def stream_response():
-            async with httpx.AsyncClient(timeout=None) as client:
-                async with client.stream("POST", agent_url, json=query_request) as response:
-                    if response.status_code != 200:
-                        raise HTTPException(
-                            status_code=response.status_code,
-                            detail="Error from supervisor service"
-                        )
-                    async for chunk in response.aiter_text(): # stream the response in chunks (type-writer)
-                        if chunk:
-                            yield chunk
-    
-        return StreamingResponse(stream_response(), media_type="application/json")
-    
+            # no read timeout, the supervisor can take long between chunks when experts are called
+            async with request.app.state.container_manager.track(username), \
+                    agent_client.stream("POST", agent_url, json=query_request, headers=agent_headers, timeout=httpx.Timeout(None, connect=5.0)) as response:
+                if response.status_code != 200:
+                    raise HTTPException(
+                        status_code=response.status_code,
+                        detail="Error from supervisor service"
+                    )
+                yield "" # stream opened
+                async for chunk in response.aiter_text(): # stream the response in chunks (type-writer)
+                    if chunk:
+                        yield chunk
+
+        stream = stream_response()
+        await stream.__anext__() # waits for a request slot and the status of the agent, a busy agent is a 503 and not a broken stream
+        return StreamingResponse(stream, media_type="application/json")
+
+    except HTTPException:
+        raise
+    except AgentBusy as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
     except Exception as e:
         logger.error(f"Streaming failed: {e}")
         logger.debug(traceback.format_exc())
@@ -71,134 +124,223 @@ async def ask(request: Request):
 
 @app.post("/update-memory")
 async def update_memory(request: Request):
-    user_port = request.headers.get("X-User-Port") # specific user port to route to correct agent
-    if not user_port:
-        raise HTTPException(status_code=400, detail="User port not provided")
+    username, agent_base_url, agent_headers = await resolve_agent(request) # specific user port to route to correct agent
     try:
-        async with httpx.AsyncClient(timeout=120.0) as client: # long timeout due to multiple experts/supervisor who have to reflect
-            response = await client.post(f"http://host.docker.internal:{user_port}/supervisor/update-memory")
-            if response.status_code != 200:
-                raise HTTPException(
-                    status_code=response.status_code,
-                    detail="Error from supervisor service during memory update"
-                )
-            
-            # Parse the response from HB_Agent
-            response_data = response.json()
-            if "warning" in response_data.get("message", "").lower(): # if no interaction available
-                return JSONResponse(
-                    content={
-                        "status": "warning",
-                        "message": "Please interact with the agent first before updating memory",
-                        "timestamp": datetime.now().isoformat()
-                    }
-                )
-            
+        async with request.app.state.container_manager.track(username):
+            response = await request.app.state.agent_client.post(
+                f"{agent_base_url}/supervisor/update-memory",
+                headers=agent_headers,
+                timeout=httpx.Timeout(120.0, connect=5.0) # the experts and the supervisor reflect at the same time, the slowest one counts
+            )
+        if response.status_code != 200:
+            raise HTTPException(
+                status_code=response.status_code,
+                detail="Error from supervisor service during memory update"
+            )
+        
+        # Parse the response from HB_Agent
+        response_data = response.json()
+        if response_data.get("status") == "warning" or "warning" in response_data.get("message", "").lower(): # if no interaction available
             return JSONResponse(
                 content={
-                    "status": "success",
-                    "message": "Memory updated successfully",
+                    "status": "warning",
+                    "message": "Please interact with the agent first before updating memory",
                     "timestamp": datetime.now().isoformat()
                 }
-            ) # otherwise succesfull
+            )
+        if response_data.get("status") == "partial": # the experts that failed keep their conversation, a retry only reflects those
+            return JSONResponse(
+                content={
+                    "status": "warning",
+                    "message": f"{response_data.get('message')}, please try again",
+                    "timestamp": datetime.now().isoformat(),
+                    "experts": response_data.get("experts")
+                }
+            )
+        
+        return JSONResponse(
+            content={
+                "status": "success",
+                "message": "Memory updated successfully",
+                "timestamp": datetime.now().isoformat(),
+                "experts": response_data.get("experts")
+            }
+        ) # otherwise succesfull
+    except AgentBusy as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
     except Exception as e:
         logger.error(f"Memory update failed: {e}")
         logger.debug(traceback.format_exc())
         raise HTTPException(status_code=500, detail=f"Memory update failed: {str(e)}")
 
+async def stream_ingestion_events(request: Request, username: str, agent_base_url: str, agent_headers: dict, job_id: str):
+    """JSON lines with the progress of an ingestion job of the agent, until the job is done or failed"""
+    async with request.app.state.container_manager.track(username), \
+            request.app.state.agent_client.stream(
+                "GET", f"{agent_base_url}/process-pdf/jobs/{job_id}/events", headers=agent_headers,
+                timeout=httpx.Timeout(None, connect=5.0), # the job can run longer than any read timeout, the agent sends heartbeats
+                limited=False # mostly waits, does not take one of the request slots of the agent
+            ) as response:
+        if response.status_code != 200:
+            yield json.dumps({"event": "failed", "job_id": job_id, "error": f"Agent answered {response.status_code}"}) + "\n"
+            return
+        async for line in response.aiter_lines():
+            if line:
+                yield line + "\n"
+
 @app.post("/process-pdf/{expert_name}")
 async def process_pdf(expert_name: str, request: Request, files: List[UploadFile] = File(...)):
-    user_port = request.headers.get("X-User-Port")
-    if not user_port:
-        raise HTTPException(status_code=400, detail="User port not provided")
-    print(f"this is the user port {user_port}") 
+    """Forward the PDFs to the agent, which queues their ingestion, and stream the progress events of the job"""
+    username, agent_base_url, agent_headers = await resolve_agent(request)
     try:
-        temp_dir = "temp_pdfs"
-        os.makedirs(temp_dir, exist_ok=True) # temporary storage for pdfs
-        # Save uploaded files
-        for file in files:
-            file_path = os.path.join(temp_dir, file.filename)
-            with open(file_path, "wb") as f:
-                shutil.copyfileobj(file.file, f)
-        
-        async with httpx.AsyncClient(timeout=300.0) as client: # long time-out due to multiple pdfs (scenario)
-            response = await client.post(
-                f"http://host.docker.internal:{user_port}/process-pdf/{expert_name}",
-                files=[("files", open(os.path.join(temp_dir, f), "rb")) for f in os.listdir(temp_dir)] # creates list of tuples, for each pdf file one entry
+        upload_files = [("files", (file.filename, file.file, file.content_type or "application/pdf")) for file in files] # forwarded without a copy on disk
+        async with request.app.state.container_manager.track(username):
+            response = await request.app.state.agent_client.post(
+                f"{agent_base_url}/process-pdf/{expert_name}",
+                files=upload_files,
+                headers=agent_headers,
+                timeout=httpx.Timeout(300.0, connect=5.0) # only the upload, the ingestion runs in the background
             )     # Forward to HB_Agent for processing
-
-            
-            # Clean up temporary directory
-            for file in os.listdir(temp_dir):
-                os.remove(os.path.join(temp_dir, file))
-            os.rmdir(temp_dir)
-            
-            if response.status_code != 200:
-                raise HTTPException(
-                    status_code=response.status_code,
-                    detail="Error from HB_Agent service during PDF processing"
-                )
-            
-            return JSONResponse(content={"status": "success", "message": "PDFs processed successfully"}) # reponse after succesful RAG
-            
+    except AgentBusy as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
     except Exception as e:
-        logger.error(f"PDF processing failed: {e}")
+        logger.error(f"PDF upload failed: {e}")
         logger.debug(traceback.format_exc())
         raise HTTPException(status_code=500, detail=f"PDF processing failed: {str(e)}") # failure
 
+    if response.status_code not in (200, 202):
+        raise HTTPException(
+            status_code=response.status_code,
+            detail="Error from HB_Agent service during PDF processing"
+        )
+    job_id = response.json()["job_id"]
+    return StreamingResponse(stream_ingestion_events(request, username, agent_base_url, agent_headers, job_id),
+                             media_type="application/json", headers={"X-Job-Id": job_id})
+
+@app.get("/process-pdf/jobs/{job_id}/events")
+async def process_pdf_events(job_id: str, request: Request):
+    """Progress events of an ingestion job again, e.g. after the upload connection was lost"""
+    username, agent_base_url, agent_headers = await resolve_agent(request)
+    return StreamingResponse(stream_ingestion_events(request, username, agent_base_url, agent_headers, job_id),
+                             media_type="application/json")
+
 @app.post("/add-user")
 async def add_user_endpoint(user: UserRegistration): # add user to the database 
     try:
-        add_user(user.username, user.password, user.openai_key) # add the user credentials if not already existing username
+        if user_info_cache.get(user.username) is not None or await run_in_threadpool(get_password_hash, user.username) is not None:
+            raise HTTPException(status_code=409, detail="Username already exists.") # before spending a bcrypt hash on it
+        hashed_password = await asyncio.wrap_future(password_hasher.hash(user.password)) # bcrypt in the dedicated password pool
+        await run_in_threadpool(insert_user, user.username, hashed_password, user.openai_key) # add the user credentials if not already existing username, off the event loop
+        user_info_cache.invalidate(user.username) # registration changed, next lookup goes to the database
         return {"status": "success", "message": "User added successfully"}
+    except HTTPException:
+        raise
+    except ValueError as e: # registered by a concurrent request after the check
+        raise HTTPException(status_code=409, detail=str(e))
+    except PasswordHasherBusy as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e)) # error message handled in streamlit
 
 @app.post("/verify-user")
 async def verify_user_endpoint(user: UserCredentials):
     try:
-        is_verified = verify_user(user.username, user.password) # verify user name and password in database
+        stored_hash = await run_in_threadpool(get_password_hash, user.username) # database lookup off the event loop
+        is_verified = stored_hash is not None and await asyncio.wrap_future(password_hasher.check(user.password, stored_hash)) # verify user name and password
         return {"status": "success", "verified": is_verified}
+    except PasswordHasherBusy as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.get("/get-user-info/{username}")
-def get_user_info_endpoint(username: str):
-    try:
-        user_info = get_user_info(username) # get user port and openAI key to deploy the hb agent
+@app.get("/metrics/password-hashing")
+def password_hashing_metrics():
+    """Queueing metrics of the bcrypt worker pool"""
+    return password_hasher.stats()
+
+@app.get("/metrics/user-info-cache")
+def user_info_cache_metrics():
+    """Hit/miss counters of the user info cache"""
+    return user_info_cache.stats()
+
+async def lookup_user_info(username: str):
+    """User info from the cache, otherwise from the database (off the event loop)"""
+    user_info = user_info_cache.get(username)
+    if user_info is None:
+        user_info = await run_in_threadpool(get_user_info, username) # get user port and openAI key to deploy the hb agent
         if user_info is None:
             raise HTTPException(status_code=404, detail="User not found")
-        return user_info
+        user_info_cache.set(username, user_info) # unknown users are not cached, they can still register
+    return user_info
+
+@app.get("/get-user-info/{username}")
+async def get_user_info_endpoint(username: str):
+    try:
+        return await lookup_user_info(username)
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error in get_user_info_endpoint: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail="Internal server error")
 
+@app.post("/agents/{username}/start", status_code=202)
+async def start_agent(username: str, request: Request):
+    """Start the agent container of the user in the background, poll /agents/{username}/status for readiness"""
+    user_info = await lookup_user_info(username)
+    return await request.app.state.container_manager.start(username, user_info["openai_key"], user_info["port"])
+
+@app.get("/agents/{username}/status")
+def agent_status(username: str, request: Request):
+    """State of the agent container: not_started, starting, ready, failed or stopped"""
+    return request.app.state.container_manager.status(username)
+
+@app.post("/agents/{username}/stop")
+async def stop_agent(username: str, request: Request):
+    try:
+        return await request.app.state.container_manager.stop(username)
+    except Exception as e:
+        logger.error(f"Stopping agent of {username} failed: {e}")
+        raise HTTPException(status_code=500, detail=f"Stopping agent failed: {str(e)}")
+
+@app.get("/metrics/agent-pool")
+def agent_pool_metrics(request: Request):
+    """Idle, starting and bound pre-started agent containers and how many starts were served from the pool"""
+    return request.app.state.container_manager.pool.stats()
+
 @app.get("/get-generated-data/{username}")
-def get_generated_data(username: str):
+def get_generated_data(username: str, offset: int = 0, limit: Optional[int] = None):
     output_base = f"/chroma_db/output_pipeline/{username}" # specific output for each user
-    if not os.path.exists(output_base):
-        return {"runs": []} # no runs yet
-    runs = sorted([d for d in os.listdir(output_base) if os.path.isdir(os.path.join(output_base, d))]) # creat list of the outputs
-    data = []
-    for run in runs:
-        run_folder = os.path.join(output_base, run)
-        # Only include files, not directories
-        files = [f for f in os.listdir(run_folder) if os.path.isfile(os.path.join(run_folder, f))] # create a list of all the runs in the user output
-        data.append({"run": run, "files": files}) 
-    return {"runs": data} # showcase the runs
+    if offset < 0 or (limit is not None and limit < 1):
+        raise HTTPException(status_code=400, detail="offset must be >= 0 and limit >= 1")
+    runs, total = list_runs(output_base, offset, limit) # read from the user run index, newest run first
+    return {"runs": runs, "total": total, "offset": offset, "limit": limit} # showcase the runs
+
+def stream_run_zip(folder_path: str, run: str):
+    """Stream the zip while the files are read, memory per download stays constant. Used when the archive
+    can not be cached next to the run. Range requests get the whole archive, only the cached file is served
+    in parts (a part of the stream would need to build the archive twice, once for its size)."""
+    headers = {"Content-Disposition": f"attachment; filename={run}.zip"}
+    return StreamingResponse(iter_run_zip(folder_path), media_type="application/zip", headers=headers)
 
 @app.get("/download-run-zip/{username}/{run}")
-def download_run_zip(username: str, run: str): # zip the file and make it available for download
+def download_run_zip(username: str, run: str, request: Request): # zip the file and make it available for download
     folder_path = os.path.join("/chroma_db/output_pipeline", username, run) 
     if not os.path.exists(folder_path) or not os.path.isdir(folder_path):
         raise HTTPException(status_code=404, detail=f"Folder at path {folder_path} not found or is not a directory.")
-    # Create a zip in memory
-    zip_buffer = io.BytesIO()
-    with zipfile.ZipFile(zip_buffer, "w", zipfile.ZIP_DEFLATED) as zipf:
-        for root, _, files in os.walk(folder_path):
-            for file in files:
-                file_path = os.path.join(root, file)
-                arcname = os.path.relpath(file_path, folder_path)
-                zipf.write(file_path, arcname)
-    zip_buffer.seek(0)
-    return StreamingResponse(zip_buffer, media_type="application/zip", headers={"Content-Disposition": f"attachment; filename={run}.zip"}) # return the specified zip file
\ No newline at end of file
+    etag = run_etag(folder_path) # changes when a file of the run changes
+    if etag_matches(request.headers.get("If-None-Match"), etag):
+        return Response(status_code=304, headers={"ETag": etag}) # client already has this archive
+    try:
+        zip_path = get_cached_run_zip(folder_path, etag) # built once, afterwards served from disk
+    except OSError as e:
+        logger.warning(f"Could not cache archive for {folder_path}, streaming instead: {e}")
+        return stream_run_zip(folder_path, run)
+    if_modified_since = request.headers.get("If-Modified-Since")
+    if if_modified_since and not request.headers.get("If-None-Match"):
+        try:
+            if int(os.path.getmtime(zip_path)) <= parsedate_to_datetime(if_modified_since).timestamp():
+                return Response(status_code=304, headers={"ETag": etag})
+        except (TypeError, ValueError):
+            pass # invalid date, send the archive
+    # FileResponse adds Last-Modified and answers Range requests from the cached file
+    return FileResponse(zip_path, media_type="application/zip", filename=f"{run}.zip", headers={"ETag": etag}) # return the specified zip file
\ No newline at end of file
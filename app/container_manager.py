@@ -0,0 +1,322 @@
+import asyncio
+import logging
+import os
+import time
+import zlib
+from contextlib import asynccontextmanager
+import docker
+import httpx
+
+logger = logging.getLogger("uvicorn.error")
+
+AGENT_IMAGE = os.getenv("AGENT_IMAGE", "hb_agent_image:latest")
+AGENT_NETWORK = os.getenv("AGENT_NETWORK", "app_network")
+AGENT_VOLUME = os.getenv("AGENT_VOLUME", "chroma_data")
+AGENT_START_TIMEOUT = float(os.getenv("AGENT_START_TIMEOUT", 300)) # seconds before a start is reported as failed
+HEALTH_BACKOFF_START = 0.25 # first wait between health checks, doubled up to HEALTH_BACKOFF_MAX
+HEALTH_BACKOFF_MAX = 5.0
+FAILED_LOG_LINES = 50 # container log lines returned when a start fails
+AGENT_BIND_TIMEOUT = float(os.getenv("AGENT_BIND_TIMEOUT", 120)) # seconds a pooled container may take to build the supervisor
+AGENT_IDLE_TIMEOUT = float(os.getenv("AGENT_IDLE_TIMEOUT", 1800)) # seconds without requests before a container is checkpointed and stopped
+AGENT_REAP_INTERVAL = float(os.getenv("AGENT_REAP_INTERVAL", 60)) # seconds between idle checks
+AGENT_MEMORY_THRESHOLD = float(os.getenv("AGENT_MEMORY_THRESHOLD", 0.85)) # fraction of host memory in use above which no container is started
+AGENT_QUEUE_TIMEOUT = float(os.getenv("AGENT_QUEUE_TIMEOUT", 120)) # seconds a start waits for free memory, 0 refuses directly
+AGENT_EVICT_MIN_IDLE = float(os.getenv("AGENT_EVICT_MIN_IDLE", 300)) # under memory pressure containers idle this long are stopped early
+MEMORY_POLL_INTERVAL = 2.0 # seconds between memory checks of a queued start
+CHECKPOINT_TIMEOUT = 30.0
+# Multi-tenant agents (AGENT_MULTI_TENANT=1) that serve all users, e.g. "http://hb_agent_shared_1:5000,http://hb_agent_shared_2:5000".
+# When set no container is started per user, each user is routed to one of these agents by a hash of the username.
+AGENT_SHARED_URLS = [url.strip().rstrip("/") for url in os.getenv("AGENT_SHARED_URLS", "").split(",") if url.strip()]
+AGENT_EMBEDDING_BACKEND = os.getenv("AGENT_EMBEDDING_BACKEND") # embedding backend of the started agents, e.g. hashing for offline development
+# Record or replay the OpenAI exchanges of the started agents (LLM_REPLAY_MODE etc. of hb_agent), e.g. for load tests without the API
+AGENT_LLM_REPLAY = {name: os.getenv(f"AGENT_{name}") for name in ("LLM_REPLAY_MODE", "LLM_FIXTURES_PATH", "LLM_REPLAY_LATENCY", "LLM_REPLAY_CHUNK_DELAY")}
+
+
+def agent_environment(**environment):
+    """Environment of a started agent container"""
+    if AGENT_EMBEDDING_BACKEND:
+        environment["EMBEDDING_BACKEND"] = AGENT_EMBEDDING_BACKEND
+    environment.update({name: value for name, value in AGENT_LLM_REPLAY.items() if value})
+    return environment
+
+
+def host_memory_usage():
+    """Fraction of host memory in use from /proc/meminfo (the host values are visible in the container), None if unknown"""
+    try:
+        with open("/proc/meminfo") as f:
+            meminfo = {line.split(":")[0]: int(line.split()[1]) for line in f}
+        return 1 - meminfo["MemAvailable"] / meminfo["MemTotal"]
+    except (OSError, KeyError, ValueError, ZeroDivisionError):
+        return None
+
+
+class ContainerManager:
+    """Starts and stops the hb_agent container of each user without blocking. A start runs as a background
+    task: the docker calls run in a thread and readiness is detected by polling the /health endpoint of the
+    agent with exponential backoff. Callers poll the state of a user instead of following the container logs.
+    The gateway reports every request with track(); containers without requests for AGENT_IDLE_TIMEOUT are
+    checkpointed and stopped by the reaper task and started again (restoring the checkpoint) on the next request.
+    New containers only start while host memory is below AGENT_MEMORY_THRESHOLD, otherwise the start is queued."""
+    def __init__(self, agent_client):
+        self.agent_client = agent_client
+        self._docker = None
+        self._states = {} # username -> state dict
+        self._tasks = {} # username -> running start task
+        self.pool = None # WarmPool of pre-started containers, set in the lifespan of the gateway
+        self._inflight = {} # username -> running requests
+        self._reaper = None
+        self.shared_urls = AGENT_SHARED_URLS
+
+    @property
+    def docker(self):
+        if self._docker is None:
+            self._docker = docker.from_env()
+        return self._docker
+
+    @staticmethod
+    def container_name(username: str):
+        return f"hb_agent_{username}"
+
+    def status(self, username: str):
+        """Current state of the agent of the user: not_started, starting, ready, failed or stopped"""
+        return self._states.get(username, {"username": username, "status": "not_started"})
+
+    def _set_state(self, username: str, status: str, **extra):
+        state = {**self._states.get(username, {}), "username": username, "status": status, "updated_at": time.time(), **extra}
+        if status == "ready" and "last_activity" not in extra:
+            state["last_activity"] = state["updated_at"]
+        self._states[username] = state
+        return state
+
+    def agent_url(self, username: str):
+        """Base url of the agent that serves the user"""
+        state = self.status(username)
+        if state.get("shared"):
+            return state["url"]
+        return f"http://host.docker.internal:{state['port']}"
+
+    def username_for_port(self, port):
+        """User of the running container on this host port, None if unknown"""
+        for username, state in self._states.items():
+            if state.get("status") == "ready" and str(state.get("port")) == str(port):
+                return username
+        return None
+
+    @asynccontextmanager
+    async def track(self, username):
+        """Mark the container of the user as active for the duration of a request, a no-op for unknown users"""
+        if username is None:
+            yield
+            return
+        self._inflight[username] = self._inflight.get(username, 0) + 1
+        try:
+            yield
+        finally:
+            self._inflight[username] -= 1
+            if username in self._states:
+                self._states[username]["last_activity"] = time.time()
+
+    async def ensure_running(self, username: str, openai_key: str, port: int):
+        """Return the state of the ready container of the user, a stopped (e.g. idle reaped) container is started
+        again and its checkpoint restored before the request is forwarded"""
+        if self.status(username).get("status") != "ready":
+            await self.start(username, openai_key, port)
+            task = self._tasks.get(username)
+            if task is not None:
+                await asyncio.shield(task) # a cancelled request does not cancel the start
+        return self.status(username)
+
+    async def start(self, username: str, openai_key: str, port: int):
+        """Start (or reuse) the container of the user in the background and return its state directly"""
+        task = self._tasks.get(username)
+        if task is not None and not task.done():
+            return self.status(username) # start already in progress
+        if self.status(username).get("status") == "ready":
+            return self.status(username) # already running, pooled or own container
+        if self.shared_urls: # sticky routing, the session of the user lives in one agent process
+            url = self.shared_urls[zlib.crc32(username.encode("utf-8")) % len(self.shared_urls)]
+            return self._set_state(username, "ready", shared=True, url=url, port=None, started_at=time.time(),
+                                   ready_at=time.time(), error=None, logs=None, reason=None)
+        self._set_state(username, "starting", container=self.container_name(username), port=port, user_port=port,
+                        pooled=False, started_at=time.time(), error=None, logs=None, reason=None)
+        self._tasks[username] = asyncio.create_task(self._start(username, openai_key, port))
+        return self.status(username)
+
+    async def _start(self, username: str, openai_key: str, port: int):
+        container_name = self.container_name(username)
+        pooled = self.pool.acquire() if self.pool is not None else None
+        if pooled is not None and await self._bind_pooled(username, openai_key, *pooled):
+            return
+        try:
+            await self._wait_for_memory(username)
+            container = await asyncio.to_thread(self._run_container, username, openai_key, port)
+            await self._wait_until_healthy(container, port)
+            self._set_state(username, "ready", ready_at=time.time())
+            logger.info(f"{container_name} ready after {time.time() - self._states[username]['started_at']:.1f} s")
+        except Exception as e:
+            logs = await asyncio.to_thread(self._tail_logs, container_name)
+            self._set_state(username, "failed", error=str(e), logs=logs)
+            logger.error(f"Starting {container_name} failed: {e}")
+
+    async def _bind_pooled(self, username: str, openai_key: str, pooled_name: str, pooled_port: int):
+        """Bind a pre-started container to the user, on failure it is removed and the own container is started"""
+        self._set_state(username, "starting", container=pooled_name, port=pooled_port, pooled=True)
+        try:
+            response = await self.agent_client.post(
+                f"http://host.docker.internal:{pooled_port}/bind",
+                json={"username": username, "openai_key": openai_key},
+                timeout=httpx.Timeout(AGENT_BIND_TIMEOUT, connect=5.0))
+            response.raise_for_status()
+        except httpx.HTTPError as e:
+            logger.error(f"Binding pooled agent {pooled_name} to {username} failed: {e}")
+            await asyncio.to_thread(self._remove_container, pooled_name)
+            self.pool.release_port(pooled_port)
+            self._set_state(username, "starting", container=self.container_name(username),
+                            port=self._states[username].get("user_port"), pooled=False)
+            return False
+        self._set_state(username, "ready", ready_at=time.time())
+        logger.info(f"{pooled_name} bound to {username} after {time.time() - self._states[username]['started_at']:.1f} s")
+        return True
+
+    async def _wait_for_memory(self, username: str):
+        """Queue the start while host memory is above the threshold, idle containers are stopped first"""
+        deadline = time.monotonic() + AGENT_QUEUE_TIMEOUT
+        while True:
+            usage = await asyncio.to_thread(host_memory_usage)
+            if usage is None or usage < AGENT_MEMORY_THRESHOLD:
+                if self.status(username).get("status") == "queued":
+                    self._set_state(username, "starting", memory_usage=usage)
+                return
+            if await self._evict_idle(AGENT_EVICT_MIN_IDLE):
+                continue
+            if time.monotonic() >= deadline:
+                raise MemoryError(f"Host memory usage {usage:.0%} is above {AGENT_MEMORY_THRESHOLD:.0%}, try again later")
+            self._set_state(username, "queued", memory_usage=usage)
+            await asyncio.sleep(MEMORY_POLL_INTERVAL)
+
+    def _idle_users(self, min_idle: float, containers_only: bool = False):
+        """Ready users without running requests, longest idle first. containers_only leaves out the users of the
+        shared multi-tenant agents, stopping their session frees no container."""
+        now = time.time()
+        idle = [(state["last_activity"], username) for username, state in self._states.items()
+                if state.get("status") == "ready" and not self._inflight.get(username)
+                and now - state.get("last_activity", now) >= min_idle and not (containers_only and state.get("shared"))]
+        return [username for _, username in sorted(idle)]
+
+    async def _evict_idle(self, min_idle: float):
+        """Hibernate the longest idle container, False if no container was idle long enough"""
+        for username in self._idle_users(min_idle, containers_only=True):
+            if await self.hibernate(username, reason="memory"):
+                return True
+        return False
+
+    async def hibernate(self, username: str, reason: str = "idle"):
+        """Checkpoint the conversation of the user and stop the container, it is kept running if the checkpoint fails"""
+        state = self.status(username)
+        try:
+            response = await self.agent_client.post(f"{self.agent_url(username)}/checkpoint",
+                                                    headers={"X-Username": username}, # selects the session of a multi-tenant agent
+                                                    timeout=httpx.Timeout(CHECKPOINT_TIMEOUT, connect=5.0))
+            response.raise_for_status()
+        except httpx.HTTPError as e:
+            logger.error(f"Checkpoint of {username} failed, container kept running: {e}")
+            return False
+        await self.stop(username, reason=reason)
+        logger.info(f"Stopped the agent of {username} ({reason}), conversation checkpointed")
+        return True
+
+    def start_reaper(self):
+        self._reaper = asyncio.create_task(self._reap_loop())
+
+    async def stop_reaper(self):
+        if self._reaper is not None:
+            self._reaper.cancel()
+            self._reaper = None
+
+    async def _reap_loop(self):
+        while True:
+            await asyncio.sleep(AGENT_REAP_INTERVAL)
+            for username in self._idle_users(AGENT_IDLE_TIMEOUT):
+                try:
+                    await self.hibernate(username, reason="idle")
+                except Exception as e:
+                    logger.error(f"Stopping idle agent of {username} failed: {e}")
+
+    def _run_container(self, username: str, openai_key: str, port: int):
+        """Blocking docker calls, run in a worker thread"""
+        container_name = self.container_name(username)
+        try:
+            container = self.docker.containers.get(container_name)
+            container.reload() # Refresh container's status info
+            if container.status != "running":
+                container.start() # start container
+        except docker.errors.NotFound:
+            container = self.docker.containers.run(
+                AGENT_IMAGE,
+                name=container_name,
+                detach=True,
+                environment=agent_environment(OPENAI_API_KEY=openai_key, USERNAME=username),
+                ports={'5000/tcp': port},
+                network=AGENT_NETWORK,  # use fixed network name, not folder-prefixed
+                volumes={AGENT_VOLUME: {'bind': '/chroma_db', 'mode': 'rw'}}  # use fixed volume name
+            ) # create a new container with its name, OpenAI key, username and user specific port
+        return container
+
+    async def _wait_until_healthy(self, container, port: int):
+        """Poll the health endpoint of the agent with exponential backoff until it answers or the start times out"""
+        health_url = f"http://host.docker.internal:{port}/health"
+        deadline = time.monotonic() + AGENT_START_TIMEOUT
+        delay = HEALTH_BACKOFF_START
+        while time.monotonic() < deadline:
+            try:
+                response = await self.agent_client.get(health_url, timeout=httpx.Timeout(2.0))
+                if response.status_code == 200:
+                    return
+                if response.status_code == 500 and response.json().get("status") == "failed":
+                    raise RuntimeError(f"Agent failed to start: {response.json().get('error')}")
+            except (httpx.HTTPError, ValueError):
+                pass # not listening yet
+            await asyncio.to_thread(container.reload)
+            if container.status in ("exited", "dead"):
+                raise RuntimeError(f"Container stopped during start-up (status {container.status})")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, HEALTH_BACKOFF_MAX)
+        raise TimeoutError(f"Agent did not become healthy within {AGENT_START_TIMEOUT:.0f} s")
+
+    def _remove_container(self, container_name: str):
+        try:
+            self.docker.containers.get(container_name).remove(force=True)
+        except docker.errors.NotFound:
+            pass
+
+    def _tail_logs(self, container_name: str):
+        try:
+            logs = self.docker.containers.get(container_name).logs(tail=FAILED_LOG_LINES)
+            return logs.decode("utf-8", errors="replace")
+        except Exception:
+            return None
+
+    async def stop(self, username: str, reason: str = "user"):
+        """Stop the container of the user, a running start is cancelled first"""
+        task = self._tasks.pop(username, None)
+        if task is not None and not task.done():
+            task.cancel()
+        state = self.status(username)
+        if state.get("shared"): # only the session is closed, the agent process keeps serving the other users
+            try:
+                await self.agent_client.post(f"{state['url']}/sessions/{username}/close", timeout=httpx.Timeout(10.0))
+            except httpx.HTTPError as e:
+                logger.error(f"Closing the session of {username} failed: {e}")
+            return self._set_state(username, "stopped", reason=reason)
+        if state.get("pooled"):
+            # a pooled container holds the state of this user only in memory, it is not reused
+            await asyncio.to_thread(self._remove_container, state["container"])
+            self.pool.release_port(state["port"])
+            return self._set_state(username, "stopped", pooled=False, container=self.container_name(username),
+                                   port=state.get("user_port"), reason=reason)
+        try:
+            container = await asyncio.to_thread(self.docker.containers.get, self.container_name(username))
+            await asyncio.to_thread(container.stop) # stop container
+        except docker.errors.NotFound:
+            pass
+        return self._set_state(username, "stopped", reason=reason)
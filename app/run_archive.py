@@ -0,0 +1,122 @@
+import hashlib
+import io
+import os
+import threading
+import zipfile
+
+ZIP_CHUNK_SIZE = 64 * 1024 # bytes read from disk per step, bounds the memory used per download
+STORED_EXTENSIONS = {".png", ".npz", ".zip", ".gz", ".jpg", ".jpeg"} # already compressed, deflating them only costs CPU
+
+_build_locks = {} # one lock per archive path, so concurrent downloads of a run build the archive once
+_build_locks_guard = threading.Lock()
+
+
+class _ZipStreamSink(io.RawIOBase):
+    """Write-only and unseekable sink for zipfile. Collects the written bytes until the generator drains them,
+    because it is unseekable zipfile writes data descriptors instead of seeking back to patch the headers."""
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self._chunks.append(bytes(b))
+        self._position += len(b)
+        return len(b)
+
+    def tell(self):
+        return self._position
+
+    def drain(self):
+        """Return everything written since the last drain"""
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def list_run_files(folder_path):
+    """List (file path, archive name) for every file in a run folder, sorted so the archive bytes are
+    the same for every request"""
+    run_files = []
+    for root, dirs, files in os.walk(folder_path):
+        dirs.sort()
+        for file in sorted(files):
+            file_path = os.path.join(root, file)
+            run_files.append((file_path, os.path.relpath(file_path, folder_path)))
+    return run_files
+
+
+def iter_run_zip(folder_path, chunk_size=ZIP_CHUNK_SIZE):
+    """Yield a zip archive of the run folder chunk by chunk while the files are read. PNG/npz content is
+    STORED, everything else (JSON, reports) is DEFLATED."""
+    sink = _ZipStreamSink()
+    with zipfile.ZipFile(sink, "w") as zipf:
+        for file_path, arcname in list_run_files(folder_path):
+            info = zipfile.ZipInfo.from_file(file_path, arcname) # date_time from mtime keeps the output deterministic
+            extension = os.path.splitext(file_path)[1].lower()
+            info.compress_type = zipfile.ZIP_STORED if extension in STORED_EXTENSIONS else zipfile.ZIP_DEFLATED
+            with open(file_path, "rb") as src, zipf.open(info, "w") as dest:
+                while True:
+                    chunk = src.read(chunk_size)
+                    if not chunk:
+                        break
+                    dest.write(chunk)
+                    data = sink.drain()
+                    if data:
+                        yield data
+            data = sink.drain() # local header/data descriptor of the file
+            if data:
+                yield data
+    data = sink.drain() # central directory
+    if data:
+        yield data
+
+
+def run_etag(folder_path):
+    """ETag of a run, hash over name, size and mtime of every file. Only needs a stat per file and changes
+    as soon as a file of the run is added or rewritten"""
+    digest = hashlib.sha1()
+    for file_path, arcname in list_run_files(folder_path):
+        stat_result = os.stat(file_path)
+        digest.update(f"{arcname}:{stat_result.st_size}:{stat_result.st_mtime_ns}\n".encode("utf-8"))
+    return f'"{digest.hexdigest()}"'
+
+
+def etag_matches(if_none_match, etag):
+    """Check an If-None-Match header against the etag (also handles lists, weak tags and *)"""
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or etag in [tag[2:] if tag.startswith("W/") else tag for tag in tags]
+
+
+def _write_atomic(path, chunks):
+    """Write the chunks to a temporary file and move it in place, readers never see a half written file"""
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            for chunk in chunks:
+                f.write(chunk)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def get_cached_run_zip(folder_path, etag):
+    """Return the path of the archive stored next to the run folder (data_N.zip). It is built on the first request
+    and rebuilt when the etag of the run changed since it was built, e.g. when the pipeline was still writing."""
+    zip_path = folder_path.rstrip(os.sep) + ".zip"
+    etag_path = zip_path + ".etag"
+    with _build_locks_guard:
+        lock = _build_locks.setdefault(zip_path, threading.Lock())
+    with lock:
+        if os.path.exists(zip_path) and os.path.exists(etag_path):
+            with open(etag_path, "r") as f:
+                if f.read() == etag:
+                    return zip_path # cached archive is up to date
+        _write_atomic(zip_path, iter_run_zip(folder_path))
+        _write_atomic(etag_path, [etag.encode("utf-8")])
+    return zip_path
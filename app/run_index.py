@@ -0,0 +1,49 @@
+import os
+import json
+import threading
+
+INDEX_FILE = "runs_index.json" # written atomically by the hb_agent pipeline when a run starts and completes
+
+_index_cache = {} # index path -> (mtime_ns, parsed index), avoids re-parsing an unchanged index on every refresh
+_index_cache_lock = threading.Lock()
+
+
+def _load_index(output_base):
+    """Load the run index of a user, None if the user has no index (runs created before the index existed)"""
+    index_path = os.path.join(output_base, INDEX_FILE)
+    try:
+        mtime_ns = os.stat(index_path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+    with _index_cache_lock:
+        cached = _index_cache.get(index_path)
+    if cached and cached[0] == mtime_ns:
+        return cached[1]
+    with open(index_path, "r") as f:
+        index = json.load(f)
+    with _index_cache_lock:
+        _index_cache[index_path] = (mtime_ns, index)
+    return index
+
+
+def _scan_runs(output_base):
+    """Fallback without index, list every run folder and its files"""
+    runs = []
+    for run in os.listdir(output_base):
+        run_folder = os.path.join(output_base, run)
+        if os.path.isdir(run_folder):
+            files = [f for f in os.listdir(run_folder) if os.path.isfile(os.path.join(run_folder, f))]
+            run_id = int(run[5:]) if run.startswith("data_") and run[5:].isdigit() else 0
+            runs.append({"run": run, "id": run_id, "files": files})
+    return runs
+
+
+def list_runs(output_base, offset=0, limit=None):
+    """Return (runs, total) for a user, newest run first. Only one page of runs is returned when limit is given"""
+    if not os.path.exists(output_base):
+        return [], 0
+    index = _load_index(output_base)
+    runs = list(index["runs"].values()) if index is not None else _scan_runs(output_base)
+    runs.sort(key=lambda entry: entry.get("id", 0), reverse=True)
+    end = None if limit is None else offset + limit
+    return runs[offset:end], len(runs)
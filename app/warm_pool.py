@@ -0,0 +1,156 @@
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+import docker
+import httpx
+from container_manager import AGENT_IMAGE, AGENT_NETWORK, AGENT_VOLUME, AGENT_MEMORY_THRESHOLD, host_memory_usage, agent_environment
+
+logger = logging.getLogger("uvicorn.error")
+
+AGENT_POOL_SIZE = int(os.getenv("AGENT_POOL_SIZE", 2)) # idle pre-started agent containers kept ready, 0 disables the pool
+AGENT_POOL_PORT_START = int(os.getenv("AGENT_POOL_PORT_START", 6000)) # host ports of pooled containers, outside the 5001-5999 user range
+AGENT_POOL_PORT_END = int(os.getenv("AGENT_POOL_PORT_END", 6999))
+POOL_LABEL = "hb_agent_pool" # docker label of pooled containers, used to adopt them after a gateway restart
+POOL_RETRY_DELAY = 10.0 # seconds before a failed pool start is retried
+
+
+class WarmPool:
+    """Keeps AGENT_POOL_SIZE agent containers started without a user (AGENT_POOL_MODE=1). The import of langchain,
+    chromadb etc. and the uvicorn start-up are done before a user logs in; acquire() hands out a healthy container
+    that only has to be bound to the user (/bind). A background task refills the pool after every acquire."""
+    def __init__(self, container_manager, size: int = AGENT_POOL_SIZE,
+                 port_start: int = AGENT_POOL_PORT_START, port_end: int = AGENT_POOL_PORT_END):
+        self.container_manager = container_manager
+        self.size = size
+        self.ports = range(port_start, port_end + 1)
+        self._idle = deque() # (container name, port) of healthy unbound containers
+        self._used_ports = set() # ports of pooled containers, idle, starting or bound to a user
+        self._starting = 0
+        self._refill = asyncio.Event()
+        self._task = None
+        self._start_tasks = set()
+        self.acquired = 0 # starts served from the pool
+        self.misses = 0 # starts that found the pool empty
+
+    async def start(self):
+        """Adopt pooled containers of a previous gateway run and start the refill task"""
+        if self.size <= 0 or self.container_manager.shared_urls: # multi-tenant agents need no per-user containers
+            return
+        try:
+            await self._adopt()
+        except Exception as e:
+            logger.error(f"Adopting pooled agent containers failed: {e}")
+        self._task = asyncio.create_task(self._run())
+        self._refill.set()
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        for task in list(self._start_tasks):
+            task.cancel()
+
+    def acquire(self):
+        """(container name, port) of an idle pooled container, None if the pool is empty"""
+        if not self._idle:
+            self.misses += 1
+            return None
+        self.acquired += 1
+        self._refill.set()
+        return self._idle.popleft()
+
+    def release_port(self, port: int):
+        """Free the port of a pooled container that was removed"""
+        self._used_ports.discard(port)
+        self._refill.set()
+
+    def stats(self):
+        return {"size": self.size, "idle": len(self._idle), "starting": self._starting,
+                "in_use": len(self._used_ports) - len(self._idle) - self._starting,
+                "acquired": self.acquired, "misses": self.misses}
+
+    async def _run(self):
+        while True:
+            await self._refill.wait()
+            self._refill.clear()
+            usage = await asyncio.to_thread(host_memory_usage)
+            if usage is not None and usage >= AGENT_MEMORY_THRESHOLD: # memory is kept for the containers of users
+                await asyncio.sleep(POOL_RETRY_DELAY)
+                self._refill.set()
+                continue
+            missing = self.size - len(self._idle) - self._starting
+            for _ in range(max(0, missing)):
+                port = self._free_port()
+                if port is None:
+                    logger.error("No free port left for pooled agent containers")
+                    break
+                self._used_ports.add(port)
+                self._starting += 1
+                task = asyncio.create_task(self._start_one(port))
+                self._start_tasks.add(task)
+                task.add_done_callback(self._start_tasks.discard)
+
+    def _free_port(self):
+        for port in self.ports:
+            if port not in self._used_ports:
+                return port
+        return None
+
+    async def _start_one(self, port: int):
+        name = f"hb_agent_pool_{port}"
+        try:
+            container = await asyncio.to_thread(self._run_container, name, port)
+            await self.container_manager._wait_until_healthy(container, port)
+            self._idle.append((name, port))
+            logger.info(f"Pooled agent {name} ready")
+        except Exception as e:
+            logger.error(f"Starting pooled agent {name} failed: {e}")
+            try:
+                await asyncio.to_thread(self.container_manager._remove_container, name)
+            except Exception:
+                pass # docker not reachable, retried with the next start
+            self._used_ports.discard(port)
+            await asyncio.sleep(POOL_RETRY_DELAY)
+            self._refill.set()
+        finally:
+            self._starting -= 1
+
+    def _run_container(self, name: str, port: int):
+        """Blocking docker calls, run in a worker thread"""
+        try:
+            self.container_manager.docker.containers.get(name).remove(force=True) # left over from a crash
+        except docker.errors.NotFound:
+            pass
+        return self.container_manager.docker.containers.run(
+            AGENT_IMAGE,
+            name=name,
+            detach=True,
+            environment=agent_environment(AGENT_POOL_MODE="1"), # no user and key yet, set by /bind
+            labels={POOL_LABEL: "1"},
+            ports={'5000/tcp': port},
+            network=AGENT_NETWORK,
+            volumes={AGENT_VOLUME: {'bind': '/chroma_db', 'mode': 'rw'}}
+        )
+
+    async def _adopt(self):
+        """Reuse running pooled containers that are still unbound, remove the others"""
+        containers = await asyncio.to_thread(
+            self.container_manager.docker.containers.list, all=True, filters={"label": POOL_LABEL})
+        for container in containers:
+            port = int(container.name.rsplit("_", 1)[-1])
+            bound = True
+            if container.status == "running":
+                try:
+                    response = await self.container_manager.agent_client.get(
+                        f"http://host.docker.internal:{port}/health", timeout=httpx.Timeout(2.0))
+                    bound = response.status_code != 200 or response.json().get("bound", True)
+                except httpx.HTTPError:
+                    pass
+            if bound:
+                await asyncio.to_thread(container.remove, force=True) # the user of a bound container is not known anymore
+            else:
+                self._used_ports.add(port)
+                self._idle.append((container.name, port))
+        logger.info(f"Adopted {len(self._idle)} pooled agent containers")
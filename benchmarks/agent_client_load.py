@@ -0,0 +1,104 @@
+"""Load test for the gateway -> agent container connection handling.
+
+Starts a local stand-in for the hb_agent /supervisor/ask endpoint (streams a few chunks) and sends the
+same load through a new httpx.AsyncClient per request (old gateway behaviour) and through the shared
+AgentClient of the gateway. Reports p50/p99 latency and throughput for both.
+
+Usage: python benchmarks/agent_client_load.py --requests 2000 --concurrency 50
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import statistics
+import sys
+import threading
+import time
+
+import httpx
+import uvicorn
+from fastapi import FastAPI
+from fastapi.responses import StreamingResponse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+from agent_client import AgentClient  # noqa: E402
+
+stand_in_agent = FastAPI()
+
+
+@stand_in_agent.post("/supervisor/ask")
+async def ask_supervisor(query: dict):
+    async def stream():
+        for i in range(5):
+            yield json.dumps({"content": f"chunk {i}", "langgraph_node": "agent"}) + "\n"
+            await asyncio.sleep(0)
+    return StreamingResponse(stream(), media_type="application/json")
+
+
+def start_stand_in_agent():
+    """Run the stand-in agent in a background thread on a free port"""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(stand_in_agent, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server, port
+
+
+async def ask_new_client(url):
+    async with httpx.AsyncClient(timeout=None) as client:
+        async with client.stream("POST", url, json={"query": "hello"}) as response:
+            async for _ in response.aiter_text():
+                pass
+
+
+async def ask_shared_client(agent_client, url):
+    async with agent_client.stream("POST", url, json={"query": "hello"}, timeout=httpx.Timeout(None, connect=5.0)) as response:
+        async for _ in response.aiter_text():
+            pass
+
+
+async def run_load(ask, total, concurrency):
+    """Send total requests with the given concurrency, returns latencies (s) and wall time"""
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with semaphore:
+            start = time.perf_counter()
+            await ask()
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(total)))
+    return latencies, time.perf_counter() - start
+
+
+def report(name, latencies, wall):
+    latencies = sorted(latencies)
+    p50 = statistics.median(latencies) * 1000
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000
+    print(f"{name:<28} p50 {p50:7.2f} ms   p99 {p99:7.2f} ms   {len(latencies) / wall:8.1f} req/s")
+
+
+async def main(total, concurrency):
+    server, port = start_stand_in_agent()
+    url = f"http://127.0.0.1:{port}/supervisor/ask"
+    latencies, wall = await run_load(lambda: ask_new_client(url), total, concurrency)
+    report("new client per request", latencies, wall)
+    agent_client = AgentClient(max_connections_per_host=concurrency)
+    latencies, wall = await run_load(lambda: ask_shared_client(agent_client, url), total, concurrency)
+    report("shared pooled AgentClient", latencies, wall)
+    await agent_client.aclose()
+    server.should_exit = True
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    args = parser.parse_args()
+    asyncio.run(main(args.requests, args.concurrency))
@@ -0,0 +1,187 @@
+"""End-to-end load test of /ask with N concurrent simulated users and recorded instead of live OpenAI calls.
+
+The OpenAI exchanges of the agent (supervisor, experts, embeddings) are recorded once to a fixtures file and then
+replayed with a configurable synthetic latency (LLM_REPLAY_MODE in hb_agent), so the run measures the overhead of the
+system itself: retrieval, prompt assembly, the supervisor graph and streaming. Every user sends --turns questions
+one after the other (--prompts), the users run at the same time. Reports the throughput, the latency percentiles seen by the
+client (first chunk, whole answer) and per stage of the agent (/metrics/request-timings: supervisor.stream,
+llm.expert, chroma.search, ...) and the prompt tokens per turn.
+
+Spawned agent (no gateway, database or docker needed): a multi-tenant agent is started in a subprocess with a
+temporary Chroma database, the users are sent to it directly.
+    record once (real API, or OPENAI_BASE_URL):  python benchmarks/gateway_load.py --spawn-agent --record --users 2 --turns 3
+    replay:  python benchmarks/gateway_load.py --spawn-agent --users 20 --turns 3 --latency 0.5 --chunk-delay 0.02
+
+Running gateway: agents started with AGENT_LLM_REPLAY_MODE=replay (or AGENT_SHARED_URLS to replaying multi-tenant
+agents), the users are registered with /add-user. --agent-urls adds the agent stages (RECENT_REQUESTS on the agents
+must hold all turns of the run).
+    python benchmarks/gateway_load.py --gateway http://localhost:8000 --users 20 --turns 3 --agent-urls http://localhost:5000
+"""
+import argparse
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+
+import httpx
+
+AGENT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "HB_Agent")
+PROMPTS = [
+    "Define a persona of a 45 year old office worker who tries to quit smoking, with smoking and craving events.",
+    "Which environmental features are needed for this persona? Use a horizon of 90 days.",
+    "Add the LTL relations between smoking, coffee and stress events.",
+    "Smoking decreases by 20 percent in the evening during the weekend, add this constraint.",
+    "Summarize the persona, the events and the constraints that we agreed on.",
+]
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else 0.0
+
+
+def start_agent(args, workdir):
+    """Multi-tenant agent in a subprocess that records or replays the OpenAI exchanges"""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    env = dict(os.environ, AGENT_MULTI_TENANT="1", AGENT_MAX_SESSIONS=str(max(args.users, 1)),
+               LLM_REPLAY_MODE="record" if args.record else "replay", LLM_FIXTURES_PATH=os.path.abspath(args.fixtures),
+               LLM_REPLAY_LATENCY=str(args.latency), LLM_REPLAY_CHUNK_DELAY=str(args.chunk_delay),
+               CHROMA_DB_PATH=os.path.join(workdir, "chroma"), CHECKPOINT_DIR=os.path.join(workdir, "checkpoints"),
+               RECENT_REQUESTS=str(args.users * args.turns + 10), ANONYMIZED_TELEMETRY="False")
+    env.setdefault("OPENAI_API_KEY", "sk-replay") # replayed requests never reach the API
+    log = open(os.path.join(workdir, "agent.log"), "w")
+    process = subprocess.Popen([sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+                                "--log-level", "warning"], cwd=AGENT_DIR, env=env, stdout=log, stderr=subprocess.STDOUT)
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.time() + 120
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Agent exited, see {log.name}")
+        try:
+            if httpx.get(f"{url}/health", timeout=1).status_code == 200:
+                return process, url
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.5)
+    process.terminate()
+    raise RuntimeError(f"Agent did not start within 120 s, see {log.name}")
+
+
+async def ask(client, args, target, username, prompt):
+    """(seconds to the first chunk, seconds to the end) of one question"""
+    if args.gateway:
+        url, body, headers = f"{target}/ask", {"prompt": prompt}, {"X-Username": username}
+    else:
+        url, body, headers = f"{target}/supervisor/ask", {"query": prompt}, {"X-Username": username, "X-OpenAI-Key": args.openai_key}
+    started = time.perf_counter()
+    first = None
+    async with client.stream("POST", url, json=body, headers=headers) as response:
+        if response.status_code != 200:
+            await response.aread()
+            raise RuntimeError(f"{response.status_code}: {response.text[:200]}")
+        async for chunk in response.aiter_text():
+            if chunk and first is None:
+                first = time.perf_counter() - started
+    return first or 0.0, time.perf_counter() - started
+
+
+async def user(client, args, target, username, results, errors):
+    if args.gateway:
+        response = await client.post(f"{target}/add-user", json={"username": username, "password": "benchmark", "openai_key": args.openai_key})
+        response.raise_for_status()
+    for turn in range(args.turns):
+        try:
+            results.append(await ask(client, args, target, username, args.prompts[turn % len(args.prompts)]))
+        except Exception as e:
+            errors.append(f"{username} turn {turn}: {e}")
+
+
+async def agent_metrics(client, urls, usernames):
+    """Timing summaries of the asks of the users of this run and the replay statistics of the agents"""
+    timings, replay = [], []
+    for url in urls:
+        recent = (await client.get(f"{url}/metrics/request-timings")).json()["recent"]
+        timings += [summary for summary in recent if summary["request"] == "ask" and summary["username"] in usernames]
+        replay.append((await client.get(f"{url}/metrics/llm-replay")).json())
+    return timings, replay
+
+
+async def run(args, target, agent_urls):
+    run_id = uuid.uuid4().hex[:6]
+    usernames = [f"bench-{run_id}-{i}" for i in range(args.users)]
+    results, errors = [], []
+    async with httpx.AsyncClient(timeout=httpx.Timeout(None, connect=10.0), limits=httpx.Limits(max_connections=None)) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(user(client, args, target, username, results, errors) for username in usernames))
+        seconds = time.perf_counter() - started
+        timings, replay = await agent_metrics(client, agent_urls, set(usernames)) if agent_urls else ([], [])
+
+    print(f"\n{args.users} users x {args.turns} turns against {'the gateway' if args.gateway else 'the agent'} {target}, "
+          f"{'recording' if args.record else f'replay latency {args.latency} s, {args.chunk_delay * 1000:.0f} ms between chunks'}")
+    print(f"asks: {len(results)} ok, {len(errors)} failed in {seconds:.2f} s, {len(results) / seconds:.2f} asks/s")
+    for error in errors[:5]:
+        print(f"  {error}")
+    print(f"{'stage':<28}{'p50 ms':>9}{'p90 ms':>9}{'p99 ms':>9}{'calls':>7}")
+    rows = [("client.first_chunk", [first for first, _ in results], 1), ("client.total", [total for _, total in results], 1)]
+    stages = {}
+    for summary in timings:
+        stages.setdefault("agent.total", []).append((summary["total_seconds"], 1))
+        for stage, values in summary["stages"].items():
+            stages.setdefault(stage, []).append((values["seconds"], values["calls"]))
+    rows += [(stage, [seconds for seconds, _ in values], sum(calls for _, calls in values) / len(values))
+             for stage, values in stages.items()]
+    for stage, values, calls in rows:
+        print(f"{stage:<28}{percentile(values, 0.5) * 1000:>9.1f}{percentile(values, 0.9) * 1000:>9.1f}"
+              f"{percentile(values, 0.99) * 1000:>9.1f}{calls:>7.1f}")
+    counts = {}
+    for summary in timings:
+        for name, value in summary.get("counts", {}).items():
+            counts.setdefault(name, []).append(value)
+    for name, values in counts.items():
+        print(f"{name}: {sum(values) / len(timings):.0f} per turn (max {max(values)})")
+    for info in replay:
+        print(f"llm replay: {info}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--turns", type=int, default=3)
+    parser.add_argument("--gateway", help="url of a running gateway, e.g. http://localhost:8000")
+    parser.add_argument("--agent-urls", default="", help="comma separated agent urls to read the stage timings from")
+    parser.add_argument("--spawn-agent", action="store_true", help="start a multi-tenant agent and send the users to it")
+    parser.add_argument("--record", action="store_true", help="spawned agent records the exchanges with the real API")
+    parser.add_argument("--fixtures", default="llm_fixtures.jsonl", help="recorded exchanges of the spawned agent")
+    parser.add_argument("--latency", type=float, default=0.5, help="seconds before every replayed response")
+    parser.add_argument("--chunk-delay", type=float, default=0.0, help="seconds between the chunks of a replayed stream")
+    parser.add_argument("--prompts", help="file with the questions of a user, one per line (default: a persona definition)")
+    parser.add_argument("--openai-key", default=os.getenv("OPENAI_API_KEY", "sk-replay"), help="key of the simulated users")
+    args = parser.parse_args()
+    if bool(args.gateway) == args.spawn_agent:
+        parser.error("use either --gateway or --spawn-agent")
+    if args.prompts:
+        with open(args.prompts, encoding="utf-8") as f:
+            args.prompts = [line.strip() for line in f if line.strip()]
+    else:
+        args.prompts = PROMPTS
+
+    if args.gateway:
+        asyncio.run(run(args, args.gateway.rstrip("/"), [url.strip().rstrip("/") for url in args.agent_urls.split(",") if url.strip()]))
+        return
+    with tempfile.TemporaryDirectory() as workdir:
+        process, url = start_agent(args, workdir)
+        try:
+            asyncio.run(run(args, url, [url]))
+        finally:
+            process.terminate()
+            process.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""Throughput and latency of the memory subsystem without network.
+
+Uses the local hashing embedding backend (EMBEDDING_BACKEND=hashing) and a temporary Chroma database, stores
+synthetic episodic entries with ChromaMemory.add_entries and runs similarity searches from a number of threads.
+--embed-latency adds a fixed wait to every embeddings call, like the round trip to a remote embeddings API.
+Reports the embedding rate, the write rate, and per retrieval mode (vector, hybrid BM25 + vector, lexical_first)
+the search latency (p50/p99), throughput, the number of query embeddings and how often the entry a query was made
+from is the top result.
+
+Usage: python benchmarks/memory_retrieval.py --entries 5000 --queries 1000 --threads 8 --embed-latency 0.1
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+_tmp = tempfile.TemporaryDirectory()
+os.environ["EMBEDDING_BACKEND"] = "hashing"
+os.environ["CHROMA_DB_PATH"] = os.path.join(_tmp.name, "chroma")
+os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark") # never used by the hashing backend
+os.environ.setdefault("ANONYMIZED_TELEMETRY", "False")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "HB_Agent"))
+
+from memory import ChromaMemory, HashingEmbeddings  # noqa: E402
+
+TOPICS = ["smoking", "craving", "relapse", "stress", "coffee", "alcohol", "exercise", "sleep", "work", "family",
+          "weekend", "nicotine patch", "counseling", "motivation", "withdrawal", "party", "morning", "evening"]
+ACTIONS = ["reported", "avoided", "struggled with", "talked about", "planned", "reduced", "noticed", "logged"]
+
+
+def make_entry(rng, i):
+    words = rng.sample(TOPICS, 4)
+    content = (f"Persona {i % 50} {rng.choice(ACTIONS)} {words[0]} and {words[1]} on day {rng.randint(1, 90)}, "
+               f"linked to {words[2]} after {words[3]}")
+    return {"role": "assistant", "content": content, "id": i}
+
+
+class RemoteLikeEmbeddings(HashingEmbeddings):
+    """Hashing embeddings that wait `latency` seconds per call and count the calls"""
+    def __init__(self, latency: float):
+        super().__init__()
+        self.latency = latency
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def _call(self):
+        with self._lock:
+            self.calls += 1
+        time.sleep(self.latency)
+
+    def embed_query(self, text):
+        self._call()
+        return super().embed_query(text)
+
+    def embed_documents(self, texts):
+        self._call()
+        return [HashingEmbeddings.embed_query(self, text) for text in texts]
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--entries", type=int, default=5000)
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--batch-size", type=int, default=256)
+    parser.add_argument("--top-k", type=int, default=3)
+    parser.add_argument("--embed-latency", type=float, default=0.0, help="seconds added to every embeddings call")
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    entries = [make_entry(rng, i) for i in range(args.entries)]
+    memory = ChromaMemory(os.environ["CHROMA_DB_PATH"])
+    memory.embedding_function = RemoteLikeEmbeddings(args.embed_latency) # no query cache, every search that needs a vector embeds
+    collection = "benchmark_episodic"
+
+    embeddings = HashingEmbeddings()
+    started = time.perf_counter()
+    embeddings.embed_documents([entry["content"] for entry in entries[:1000]])
+    embed_rate = min(1000, len(entries)) / (time.perf_counter() - started)
+
+    started = time.perf_counter()
+    memory.add_entries(entries, collection, batch_size=args.batch_size)
+    write_seconds = time.perf_counter() - started
+
+    memory.search("warm up", collection, top_k=args.top_k, mode="hybrid") # builds the BM25 index of the collection
+
+    rows = []
+    for mode in ("vector", "hybrid", "lexical_first"):
+        queries = rng.sample(entries, min(args.queries, len(entries)))
+        calls = memory.embedding_function.calls
+
+        def search(entry):
+            started = time.perf_counter()
+            results = memory.search(entry["content"], collection, top_k=args.top_k, mode=mode)
+            return time.perf_counter() - started, bool(results) and results[0]["id"] == entry["id"]
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.threads) as executor:
+            results = list(executor.map(search, queries))
+        seconds = time.perf_counter() - started
+        latencies = [latency for latency, _ in results]
+        rows.append((mode, len(queries) / seconds, statistics.median(latencies) * 1000, percentile(latencies, 0.99) * 1000,
+                     memory.embedding_function.calls - calls, sum(hit for _, hit in results) / len(results)))
+
+    print(f"\n{args.entries} entries, {args.queries} queries from {args.threads} threads, hashing backend "
+          f"with {args.embed_latency * 1000:.0f} ms per embeddings call")
+    print(f"embedding:  {embed_rate:,.0f} texts/s")
+    print(f"write:      {args.entries / write_seconds:,.0f} entries/s ({write_seconds:.2f} s, batches of {args.batch_size})")
+    print(f"{'mode':<15}{'queries/s':>10}{'p50 ms':>9}{'p99 ms':>9}{'embeds':>8}{'top-1':>8}")
+    for mode, rate, p50, p99, embeds, hit_rate in rows:
+        print(f"{mode:<15}{rate:>10,.0f}{p50:>9.1f}{p99:>9.1f}{embeds:>8}{hit_rate:>8.1%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""Throughput benchmark of the PDF ingestion into semantic memory.
+
+Writes a set of generated text PDFs to a temporary folder and ingests them into a temporary Chroma database
+with a local fake embeddings model (fixed latency per request, no OpenAI calls). Compares the old path, one
+add_entry (one embeddings request and one write) per chunk and one file after the other, with the batched
+and concurrent PDFProcessor, and the same upload a second time (all chunks already stored). Reports chunks per
+second and the number of embeddings requests.
+
+Usage: python benchmarks/pdf_ingestion.py --files 8 --pages 20 --latency 0.02
+"""
+import argparse
+import hashlib
+import os
+import sys
+import tempfile
+import threading
+import time
+
+os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark") # never used, the embeddings are replaced below
+os.environ.setdefault("ANONYMIZED_TELEMETRY", "False")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "HB_Agent"))
+
+from langchain_core.embeddings import Embeddings  # noqa: E402
+from memory import ChromaMemory, PDFProcessor  # noqa: E402
+
+WORDS = ("craving smoking relapse stress morning coffee nicotine patch weekend alcohol friends "
+         "quit attempt counseling motivation withdrawal sleep exercise trigger routine support").split()
+
+
+class FakeEmbeddings(Embeddings):
+    """Deterministic vectors, every call waits `latency` seconds like a request to the embeddings API"""
+    def __init__(self, latency: float, dim: int = 64):
+        self.latency = latency
+        self.dim = dim
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def _vector(self, text):
+        digest = hashlib.sha256(text.encode()).digest() * (self.dim // 32 + 1)
+        return [b / 255.0 for b in digest[:self.dim]]
+
+    def embed_documents(self, texts):
+        with self._lock:
+            self.requests += 1
+        time.sleep(self.latency)
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+
+def write_pdf(path, pages, document, lines_per_page=45):
+    """Minimal PDF with one Helvetica text stream per page"""
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>", None, "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for page in range(pages):
+        lines = [f"document {document} page {page} line {line} " + " ".join(WORDS[(page * 7 + line * 3 + i) % len(WORDS)] for i in range(10))
+                 for line in range(lines_per_page)]
+        text = "".join(f"({line}) Tj T* " for line in lines)
+        stream = f"BT /F1 10 Tf 12 TL 40 800 Td {text}ET"
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+                       f"/Resources << /Font << /F1 3 0 R >> >> /Contents {len(objects)} 0 R >>")
+        kids.append(f"{len(objects)} 0 R")
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {pages} >>"
+    body, offsets = "%PDF-1.4\n", []
+    for number, obj in enumerate(objects, start=1):
+        offsets.append(len(body))
+        body += f"{number} 0 obj\n{obj}\nendobj\n"
+    xref = len(body)
+    body += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n" + "".join(f"{offset:010d} 00000 n \n" for offset in offsets)
+    body += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n"
+    with open(path, "w", encoding="latin-1") as f:
+        f.write(body)
+
+
+def make_memory(db_path, embeddings):
+    memory = ChromaMemory(db_path)
+    memory.embedding_function = embeddings
+    return memory
+
+
+class PerChunkProcessor(PDFProcessor):
+    """Old ingestion path: one file after the other, one add_entry per chunk"""
+    def process_file(self, pdf_file):
+        from langchain_community.document_loaders import PyPDFLoader
+        chunks = self.text_splitter.split_documents(PyPDFLoader(os.path.join(self.pdf_dir, pdf_file)).load())
+        for chunk in chunks:
+            self.memory.add_entry({"content": chunk.page_content,
+                                   "metadata": {"source": pdf_file, "page": chunk.metadata.get("page", 0)}},
+                                  self.collection_name)
+        return len(chunks), 0
+
+
+def run(name, processor_class, pdf_dir, db_path, latency, collection, **kwargs):
+    embeddings = FakeEmbeddings(latency)
+    memory = make_memory(db_path, embeddings)
+    processor = processor_class(pdf_dir, collection, memory=memory, **kwargs)
+    summary = processor.process_pdf_to_chunks()
+    return {"name": name, "chunks": summary["chunks"], "skipped": summary.get("skipped", 0),
+            "seconds": summary["seconds"], "requests": embeddings.requests}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--files", type=int, default=8)
+    parser.add_argument("--pages", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.02, help="seconds per embeddings request")
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        pdf_dir = os.path.join(tmp, "pdfs")
+        os.makedirs(pdf_dir)
+        for i in range(args.files):
+            write_pdf(os.path.join(pdf_dir, f"document_{i}.pdf"), args.pages, i)
+        db_path = os.path.join(tmp, "chroma")
+        results = [
+            run("per_chunk", PerChunkProcessor, pdf_dir, db_path, args.latency, "benchmark_per_chunk", max_workers=1),
+            run("batched", PDFProcessor, pdf_dir, db_path, args.latency, "benchmark_batched",
+                batch_size=args.batch_size, max_workers=args.workers),
+            run("re-upload", PDFProcessor, pdf_dir, db_path, args.latency, "benchmark_batched",
+                batch_size=args.batch_size, max_workers=args.workers),
+        ]
+
+    print(f"\n{args.files} files x {args.pages} pages, {args.latency * 1000:.0f} ms per embeddings request")
+    print(f"{'path':<12}{'stored':>8}{'skipped':>9}{'seconds':>10}{'chunks/s':>10}{'requests':>10}")
+    for result in results:
+        chunks = result["chunks"] + result["skipped"]
+        print(f"{result['name']:<12}{result['chunks']:>8}{result['skipped']:>9}{result['seconds']:>10.2f}"
+              f"{chunks / result['seconds']:>10.1f}{result['requests']:>10}")
+
+
+if __name__ == "__main__":
+    main()
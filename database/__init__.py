@@ -1,9 +1,18 @@
-from .database import create_connection, create_table, add_user, verify_user, get_user_info
+from .database import create_connection, create_table, add_user, verify_user, get_user_info, init_pool, close_pool, pooled_connection, insert_user, get_password_hash
+from .password_hasher import PasswordHasher, PasswordHasherBusy, password_hasher
 
 __all__ = [
     "create_connection",
     "create_table",
     "add_user",
     "verify_user",
-    "get_user_info"
+    "get_user_info",
+    "init_pool",
+    "close_pool",
+    "pooled_connection",
+    "insert_user",
+    "get_password_hash",
+    "PasswordHasher",
+    "PasswordHasherBusy",
+    "password_hasher"
 ]
\ No newline at end of file
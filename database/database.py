@@ -1,12 +1,38 @@
 import os
+import threading
+from contextlib import contextmanager
 import psycopg2
-import bcrypt
+import psycopg2.errors
+import psycopg2.extensions
+import psycopg2.pool
+from .password_hasher import password_hasher
 
 DB_HOST = os.getenv('DB_HOST')
 DB_PORT = os.getenv('DB_PORT')
 DB_NAME = os.getenv('DB_NAME')
 DB_USERNAME = os.getenv('DB_USERNAME')
 DB_PASSWORD = os.getenv('DB_PASSWORD')
+DB_POOL_MIN = int(os.getenv('DB_POOL_MIN', 1))
+DB_POOL_MAX = int(os.getenv('DB_POOL_MAX', 10))
+
+# Statements used on every login/registration, prepared once per pooled connection
+PREPARED_STATEMENTS = {
+    "user_insert": "INSERT INTO users (username, password, openai_key, port) VALUES ($1, $2, $3, $4) ON CONFLICT (username) DO NOTHING",
+    "user_password": "SELECT password FROM users WHERE username = $1",
+    "user_info": "SELECT openai_key, port FROM users WHERE username = $1",
+}
+
+_pool = None
+_pool_slots = None # blocks callers until a connection is free, ThreadedConnectionPool raises instead of waiting
+_pool_lock = threading.Lock()
+
+
+class PreparedConnection(psycopg2.extensions.connection):
+    """Connection that remembers which statements are prepared in its session"""
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = set()
+
 
 def create_connection():
     try:
@@ -22,65 +48,124 @@ def create_connection():
         print(f"Error connecting to the database: {e}")
         return None
 
+def init_pool(minconn=DB_POOL_MIN, maxconn=DB_POOL_MAX):
+    """Create the connection pool, called once at start-up of the gateway"""
+    global _pool, _pool_slots
+    with _pool_lock:
+        if _pool is None:
+            _pool = psycopg2.pool.ThreadedConnectionPool(
+                minconn, maxconn,
+                host=DB_HOST,
+                port=DB_PORT,
+                database=DB_NAME,
+                user=DB_USERNAME,
+                password=DB_PASSWORD,
+                connection_factory=PreparedConnection
+            )
+            _pool_slots = threading.BoundedSemaphore(maxconn)
+    return _pool
+
+def close_pool():
+    """Close all pooled connections, called on shutdown of the gateway"""
+    global _pool, _pool_slots
+    with _pool_lock:
+        if _pool is not None:
+            _pool.closeall()
+            _pool = None
+            _pool_slots = None
+
+@contextmanager
+def pooled_connection():
+    """Borrow a connection from the pool (created on first use), commits on success and rolls back on errors.
+    Broken connections are dropped from the pool instead of being handed out again."""
+    pool = _pool or init_pool()
+    slots = _pool_slots
+    with slots:
+        conn = pool.getconn()
+        broken = False
+        try:
+            yield conn
+            conn.commit()
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            broken = True
+            raise
+        except Exception as e:
+            try:
+                conn.rollback()
+                if isinstance(e, (psycopg2.errors.InvalidSqlStatementName, psycopg2.errors.DuplicatePreparedStatement)):
+                    # the prepared statements of the session do not match conn.prepared, start clean
+                    conn.cursor().execute("DEALLOCATE ALL")
+                    conn.commit()
+                    conn.prepared.clear()
+            except psycopg2.Error:
+                broken = True
+            raise
+        finally:
+            pool.putconn(conn, close=broken or conn.closed != 0)
+
+def execute_prepared(cursor, name, params):
+    """Execute one of the PREPARED_STATEMENTS, it is prepared on the first use on this connection"""
+    conn = cursor.connection
+    if name not in conn.prepared:
+        cursor.execute(f"PREPARE {name} AS {PREPARED_STATEMENTS[name]}")
+        conn.prepared.add(name)
+    placeholders = ", ".join(["%s"] * len(params))
+    cursor.execute(f"EXECUTE {name} ({placeholders})", params)
+
 def create_table():
     """Create a user table, with ID, username, password, openai_key and port"""
-    conn = create_connection()
-    cursor = conn.cursor()
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            id SERIAL PRIMARY KEY,
-            username VARCHAR(255) UNIQUE NOT NULL,
-            password BYTEA NOT NULL,
-            openai_key VARCHAR(255) NOT NULL,
-            port INTEGER
-        )
-    ''') # only create if the table does not exist yet
-    conn.commit()
-    conn.close()
+    with pooled_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS users (
+                id SERIAL PRIMARY KEY,
+                username VARCHAR(255) UNIQUE NOT NULL,
+                password BYTEA NOT NULL,
+                openai_key VARCHAR(255) NOT NULL,
+                port INTEGER
+            )
+        ''') # only create if the table does not exist yet
+
+def insert_user(username, hashed_password, openai_key):
+    """Add a user with an already hashed password to the table"""
+    with pooled_connection() as conn:
+        cursor = conn.cursor()
+        port = 5001 + abs(hash(username)) % 1000 # add custom port in til 5999
+        execute_prepared(cursor, "user_insert", (username, hashed_password, openai_key, port))
+        if cursor.rowcount == 0: # the username exists, also when a concurrent registration inserted it first
+            raise ValueError("Username already exists.")
 
 def add_user(username, password, openai_key):
     """Add a user to the table"""
-    conn = create_connection()
-    cursor = conn.cursor()
-
-    cursor.execute('SELECT * FROM users WHERE username = %s', (username,)) # check if username already exists
-    if cursor.fetchone() is not None:
-        raise ValueError("Username already exists.")
-    
-    hashed_password = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8') # hashed passowrd
-    port = 5001 + abs(hash(username)) % 1000 # add custom port in til 5999
-    cursor.execute(
-        'INSERT INTO users (username, password, openai_key, port) VALUES (%s, %s, %s, %s)', 
-        (username, hashed_password, openai_key, port)
-    )
-    conn.commit()
-    conn.close()
-
-    
-def verify_user(username, password):
-    """Function to verify username and password with database"""
-    conn = create_connection()
-    cursor = conn.cursor()
-    cursor.execute('SELECT password FROM users WHERE username = %s', (username,)) # get password
-    result = cursor.fetchone()
-    conn.close()
+    hashed_password = password_hasher.hash(password).result() # hashed passowrd, before a connection is taken from the pool
+    insert_user(username, hashed_password, openai_key)
 
-    if not result:
-        return False # if not username
 
+def get_password_hash(username):
+    """Stored bcrypt hash of the user as bytes, None if the username does not exist"""
+    with pooled_connection() as conn:
+        cursor = conn.cursor()
+        execute_prepared(cursor, "user_password", (username,)) # get password
+        result = cursor.fetchone()
+    if not result:
+        return None
     # stored_hash: encode it to bytes before checking
-    stored_hash = result[0].encode('utf-8') if isinstance(result[0], str) else bytes(result[0])
-    
-    return bcrypt.checkpw(password.encode('utf-8'), stored_hash) # return true if password is correct
+    return result[0].encode('utf-8') if isinstance(result[0], str) else bytes(result[0])
+
+def verify_user(username, password):
+    """Function to verify username and password with database"""
+    stored_hash = get_password_hash(username)
+    if stored_hash is None:
+        return False # if not username
+    return password_hasher.check(password, stored_hash).result() # return true if password is correct
 
 def get_user_info(username):
     """Get user info for startin user specific container hb_agent. Returns openai_key and port"""
-    conn = create_connection()
-    cursor = conn.cursor()
-    cursor.execute('SELECT openai_key, port FROM users WHERE username = %s', (username,)) # get username port and openai_key
-    result = cursor.fetchone()
-    conn.close()
+    with pooled_connection() as conn:
+        cursor = conn.cursor()
+        execute_prepared(cursor, "user_info", (username,)) # get username port and openai_key
+        result = cursor.fetchone()
     if result:
         return {"openai_key": result[0], "port": result[1]} # return them
     else:
-        return None
\ No newline at end of file
+        return None
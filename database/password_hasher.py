@@ -0,0 +1,89 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import bcrypt
+
+BCRYPT_WORKERS = int(os.getenv('BCRYPT_WORKERS', max(1, (os.cpu_count() or 2) // 2))) # leave cores for the event loop
+BCRYPT_MAX_QUEUE = int(os.getenv('BCRYPT_MAX_QUEUE', 100)) # waiting hash/check calls before new ones are rejected
+
+
+class PasswordHasherBusy(RuntimeError):
+    """Raised when the password pool queue is full, the caller should retry later"""
+
+
+class PasswordHasher:
+    """Runs bcrypt hashing and verification in a dedicated, size limited thread pool (bcrypt releases the GIL),
+    so a burst of logins uses at most BCRYPT_WORKERS cores and never runs on the event loop or the shared threadpool.
+    Keeps counters of queued, running, completed and rejected calls and of the wait and run times."""
+    def __init__(self, max_workers: int = BCRYPT_WORKERS, max_queue: int = BCRYPT_MAX_QUEUE):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="bcrypt")
+        self._slots = threading.BoundedSemaphore(max_workers + max_queue)
+        self._lock = threading.Lock()
+        self._stats = {"queued": 0, "running": 0, "completed": 0, "failed": 0, "rejected": 0, "cancelled": 0,
+                       "wait_seconds_total": 0.0, "wait_seconds_max": 0.0, "run_seconds_total": 0.0}
+
+    def _submit(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._stats["rejected"] += 1
+            raise PasswordHasherBusy("Too many password operations waiting, try again later.")
+        queued_at = time.perf_counter()
+        with self._lock:
+            self._stats["queued"] += 1
+
+        def task():
+            started_at = time.perf_counter()
+            with self._lock:
+                self._stats["queued"] -= 1
+                self._stats["running"] += 1
+                self._stats["wait_seconds_total"] += started_at - queued_at
+                self._stats["wait_seconds_max"] = max(self._stats["wait_seconds_max"], started_at - queued_at)
+            outcome = "failed"
+            try:
+                result = fn(*args)
+                outcome = "completed"
+                return result
+            finally:
+                with self._lock:
+                    self._stats["running"] -= 1
+                    self._stats[outcome] += 1
+                    self._stats["run_seconds_total"] += time.perf_counter() - started_at
+
+        def done(future):
+            if future.cancelled(): # caller went away or shutdown while queued, task never ran
+                with self._lock:
+                    self._stats["queued"] -= 1
+                    self._stats["cancelled"] += 1
+            self._slots.release() # also for cancelled calls, otherwise the queue fills up for good
+
+        future = self._executor.submit(task)
+        future.add_done_callback(done)
+        return future
+
+    def hash(self, password: str):
+        """Future with the bcrypt hash (str) of the password"""
+        return self._submit(lambda: bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8'))
+
+    def check(self, password: str, stored_hash: bytes):
+        """Future with True if the password matches the stored hash"""
+        return self._submit(bcrypt.checkpw, password.encode('utf-8'), stored_hash)
+
+    def stats(self):
+        """Snapshot of the queueing metrics"""
+        with self._lock:
+            stats = dict(self._stats)
+        finished = stats["completed"] + stats["failed"]
+        stats["avg_wait_seconds"] = stats["wait_seconds_total"] / finished if finished else 0.0
+        stats["avg_run_seconds"] = stats["run_seconds_total"] / finished if finished else 0.0
+        stats["max_workers"] = self.max_workers
+        stats["max_queue"] = self.max_queue
+        return stats
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+password_hasher = PasswordHasher() # shared by all callers in the process